@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Detección en línea de lecturas anómalas y sensores con fallas.
+
+Por cada IdSensor se guarda un estado de tamaño fijo: última lectura de
+llenado y su hora, tasa de cambio (%/h), largo de la racha de valores
+repetidos y media/varianza móviles de la temperatura (exponenciales, exactas
+como Welford mientras hay pocas lecturas) junto a una media rápida para
+detectar deriva. Cada lectura nueva se marca con un bitmask de banderas:
+
+  TEMP_RANGO    temperatura fuera de (-50, 100)
+  TEMP_PICO     lejos de la media del sensor (> spike_z desviaciones)
+  TEMP_DERIVA   la media rápida se alejó de la lenta (> drift_z desviaciones)
+  TEMP_PEGADA   misma temperatura `stuck_count` veces seguidas
+  LLENADO_SALTO subida de llenado imposible para el tiempo transcurrido
+  LLENADO_PEGADO mismo llenado `stuck_count` veces seguidas
+
+Las lecturas marcadas se guardan igual en mediciones; las banderas van a
+mediciones_anomalias (sólo las filas marcadas). La regla es una sola: las
+filas se listan y exportan tal cual (/mediciones, exportaciones de
+mediciones, eventos de lecturas, última lectura por contenedor), pero un
+valor marcado no entra en ninguna estadística: agregados, promedios,
+conteo de críticas, alertas ni pronóstico. En SQL se aplica con
+ANOMALIAS_JOIN + FILL_OK_SQL / TEMP_OK_SQL y en memoria con fill_ok() o
+las máscaras FILL_FLAGS / TEMP_FLAGS.
+
+El estado arranca una sola vez desde la ventana reciente de mediciones y
+desde ahí se actualiza lectura a lectura: la ingesta marca el lote con
+mark() (sin tocar el estado) y, ya confirmada la transacción, apply() lo
+suma al estado. Cada `max_age` segundos catch_up() suma además las lecturas
+que otros procesos insertaron desde la última vez (IdMedicion mayor que la
+última vista y posteriores a la última lectura de su sensor).
+
+La actualización está vectorizada por sensor: un lote se ordena por (sensor,
+hora) y se recorre por posición dentro de cada sensor, aplicando a la vez
+la k-ésima lectura de todos los sensores. La misma rutina sirve para la
+ingesta y para recalcular el histórico:
+
+    python anomalies.py backfill [--desde 2024-01-01]
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+TEMP_MIN = -50
+TEMP_MAX = 100
+
+TEMP_RANGO = 1
+TEMP_PICO = 2
+TEMP_DERIVA = 4
+TEMP_PEGADA = 8
+LLENADO_SALTO = 16
+LLENADO_PEGADO = 32
+
+TEMP_FLAGS = TEMP_RANGO | TEMP_PICO | TEMP_DERIVA | TEMP_PEGADA
+FILL_FLAGS = LLENADO_SALTO | LLENADO_PEGADO
+
+FLAG_NAMES = {
+    TEMP_RANGO: 'temp_rango',
+    TEMP_PICO: 'temp_pico',
+    TEMP_DERIVA: 'temp_deriva',
+    TEMP_PEGADA: 'temp_pegada',
+    LLENADO_SALTO: 'llenado_salto',
+    LLENADO_PEGADO: 'llenado_pegado',
+}
+
+# Alias `a` sobre mediciones `m`; sin fila en la tabla, la lectura está limpia
+ANOMALIAS_JOIN = "LEFT JOIN mediciones_anomalias a ON a.FechaHora = m.FechaHora AND a.IdSensor = m.IdSensor"
+FILL_OK_SQL = f"(a.Tipo IS NULL OR (a.Tipo & {FILL_FLAGS}) = 0)"
+TEMP_OK_SQL = f"(a.Tipo IS NULL OR (a.Tipo & {TEMP_FLAGS}) = 0)"
+
+MSSQL_DDL = """
+IF OBJECT_ID('mediciones_anomalias') IS NULL
+CREATE TABLE mediciones_anomalias (
+    FechaHora DATETIME NOT NULL,
+    IdSensor  INT      NOT NULL,
+    Tipo      INT      NOT NULL,
+    CONSTRAINT PK_mediciones_anomalias PRIMARY KEY (FechaHora, IdSensor)
+)
+"""
+
+SQLITE_DDL = """
+CREATE TABLE IF NOT EXISTS mediciones_anomalias (
+    FechaHora DATETIME NOT NULL,
+    IdSensor  INTEGER  NOT NULL,
+    Tipo      INTEGER  NOT NULL,
+    PRIMARY KEY (FechaHora, IdSensor)
+)
+"""
+
+# Un sensor puede reenviar una lectura ya marcada: no se duplica
+_RECORD_SQL = """
+    INSERT INTO mediciones_anomalias (FechaHora, IdSensor, Tipo)
+    SELECT ?, ?, ?
+    WHERE NOT EXISTS (SELECT 1 FROM mediciones_anomalias WHERE FechaHora = ? AND IdSensor = ?)
+"""
+
+LOAD_SQL = """
+    SELECT IdMedicion, IdSensor, FechaHora, PorcentajeLlenado, Temperatura
+    FROM mediciones
+    WHERE FechaHora >= ?
+"""
+
+CATCH_UP_SQL = """
+    SELECT IdMedicion, IdSensor, FechaHora, PorcentajeLlenado, Temperatura
+    FROM mediciones
+    WHERE IdMedicion > ? AND FechaHora >= ?
+"""
+
+BACKFILL_SQL = """
+    SELECT IdSensor, FechaHora, PorcentajeLlenado, Temperatura
+    FROM mediciones
+    WHERE IdSensor BETWEEN ? AND ?{desde}
+    ORDER BY IdSensor, FechaHora
+"""
+
+
+def ensure_schema(conn, backend_name):
+    cur = conn.cursor()
+    try:
+        cur.execute(SQLITE_DDL if backend_name == 'sqlite' else MSSQL_DDL)
+    finally:
+        cur.close()
+    conn.commit()
+
+
+def flag_names(flags):
+    return [name for bit, name in FLAG_NAMES.items() if flags & bit]
+
+
+def fill_ok(reading):
+    """El llenado de la lectura (dict con 'Anomalia' opcional) cuenta en las estadísticas."""
+    return reading.get('PorcentajeLlenado') is not None and not (reading.get('Anomalia') or 0) & FILL_FLAGS
+
+
+# Arreglos del estado por sensor (todos menos _ids)
+_STATE = ('_t_seen', '_t_fill', '_fill', '_rate', '_fill_run', '_n', '_mean', '_var', '_fast', '_temp', '_temp_run')
+
+
+def _column(values):
+    return np.fromiter((np.nan if v is None else v for v in values), dtype=np.float64, count=len(values))
+
+
+def _seconds(times):
+    return np.array(times, dtype='datetime64[us]').astype(np.int64) / 1e6
+
+
+def _arrays(readings):
+    """(sensores, segundos, llenado, temperatura) de dicts de ingest.validate."""
+    return (np.array([r['IdSensor'] for r in readings], dtype=np.int64),
+            _seconds([r['FechaHora'] for r in readings]),
+            _column([r.get('PorcentajeLlenado') for r in readings]),
+            _column([r.get('Temperatura') for r in readings]))
+
+
+class AnomalyDetector:
+    def __init__(self, window_hours=48, max_age=300, alpha=0.01, var_alpha=0.001, fast_alpha=0.2, min_count=96,
+                 spike_z=5.0, drift_z=2.5, min_std=0.5, max_rise_rate=50.0, jump_margin=20.0,
+                 stuck_count=24):
+        self.window_hours = window_hours
+        self.max_age = max_age
+        self.alpha = alpha                  # peso de cada lectura en la media lenta
+        self.var_alpha = var_alpha          # en la varianza (más lenta: es el umbral)
+        self.fast_alpha = fast_alpha        # peso en la media rápida (deriva)
+        self.min_count = min_count          # lecturas antes de juzgar la temperatura
+        self.spike_z = spike_z
+        self.drift_z = drift_z
+        self.min_std = min_std              # °C; evita umbrales ~0 en sensores muy estables
+        self.max_rise_rate = max_rise_rate  # %/h de llenado plausible
+        self.jump_margin = jump_margin      # % de ruido tolerado en una subida
+        self.stuck_count = stuck_count
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._synced_at = None
+        self._last_id = 0                   # mayor IdMedicion ya sumado al estado
+        self._counts = dict.fromkeys(FLAG_NAMES.values(), 0)
+        self._reset()
+
+    def _reset(self):
+        self._row = {}
+        self._alloc(0)
+
+    def _alloc(self, capacity):
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._t_seen = np.full(capacity, -np.inf)   # hora de la última lectura sumada
+        self._t_fill = np.full(capacity, np.nan)    # hora de la última lectura de llenado
+        self._fill = np.full(capacity, np.nan)      # último llenado
+        self._rate = np.full(capacity, np.nan)      # %/h entre las dos últimas
+        self._fill_run = np.zeros(capacity, dtype=np.int64)
+        self._n = np.zeros(capacity, dtype=np.int64)
+        self._mean = np.zeros(capacity)
+        self._var = np.zeros(capacity)
+        self._fast = np.zeros(capacity)
+        self._temp = np.full(capacity, np.nan)      # última temperatura
+        self._temp_run = np.zeros(capacity, dtype=np.int64)
+
+    def _grow(self, needed):
+        old = len(self._ids)
+        capacity = max(16, 2 * old, needed)
+        arrays = {name: getattr(self, name) for name in ('_ids',) + _STATE}
+        self._alloc(capacity)
+        for name, values in arrays.items():
+            getattr(self, name)[:old] = values
+
+    def _rows_for(self, sensors):
+        """Filas de estado de `sensors` (únicos), creando las que falten."""
+        rows = np.empty(len(sensors), dtype=np.int64)
+        for i, sensor in enumerate(sensors.tolist()):
+            row = self._row.get(sensor)
+            if row is None:
+                row = self._row[sensor] = len(self._row)
+                if row >= len(self._ids):
+                    self._grow(row + 1)
+                self._ids[row] = sensor
+            rows[i] = row
+        return rows
+
+    # ----- núcleo vectorizado -----
+    def _step(self, rows, t, fill, temp):
+        """Una lectura por sensor (filas distintas); devuelve las banderas."""
+        flags = np.zeros(len(rows), dtype=np.int64)
+
+        # Llenado: lecturas atrasadas no se comparan ni mueven el estado
+        has_fill = ~np.isnan(fill)
+        t_prev, prev = self._t_fill[rows], self._fill[rows]
+        in_order = has_fill & ~(t < t_prev)
+        known = in_order & ~np.isnan(prev)
+        hours = np.where(known, (t - np.where(known, t_prev, t)) / 3600, 0.0)
+        rise = np.where(known, fill - np.where(known, prev, 0.0), 0.0)
+        flags[known & (rise > self.jump_margin + self.max_rise_rate * hours)] |= LLENADO_SALTO
+        run = np.where(in_order, np.where(known & (fill == prev), self._fill_run[rows] + 1, 1), self._fill_run[rows])
+        flags[in_order & (run >= self.stuck_count)] |= LLENADO_PEGADO
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._rate[rows] = np.where(known & (hours > 0), rise / hours, self._rate[rows])
+        self._fill_run[rows] = run
+        self._fill[rows] = np.where(in_order, fill, prev)
+        self._t_fill[rows] = np.where(in_order, t, t_prev)
+
+        # Temperatura
+        has_temp = ~np.isnan(temp)
+        out_of_range = has_temp & ((temp <= TEMP_MIN) | (temp >= TEMP_MAX))
+        flags[out_of_range] |= TEMP_RANGO
+        valid = has_temp & ~out_of_range
+        x = np.where(valid, temp, 0.0)
+        n, mean, var, fast = self._n[rows], self._mean[rows], self._var[rows], self._fast[rows]
+        scale = np.maximum(np.sqrt(np.maximum(var, 0.0)), self.min_std)
+        warm = valid & (n >= self.min_count)
+        spike = warm & (np.abs(x - mean) > self.spike_z * scale)
+        # Un pico entra recortado: un cambio de nivel real se absorbe de a poco
+        xc = np.where(warm, np.clip(x, mean - self.spike_z * scale, mean + self.spike_z * scale), x)
+        a = np.maximum(self.alpha, 1.0 / (n + 1))
+        diff = xc - mean
+        incr = a * diff
+        new_mean = mean + incr
+        new_fast = np.where(n == 0, xc, fast + self.fast_alpha * (xc - fast))
+        drift = warm & (np.abs(new_fast - new_mean) > self.drift_z * scale)
+        # Lo marcado mueve la media pero no la varianza, y lo demás aporta a
+        # la varianza a lo sumo drift_z desviaciones: si no, una deriva
+        # ensancharía su propio umbral antes de verse
+        dv = np.where(warm, np.clip(diff, -self.drift_z * scale, self.drift_z * scale), diff)
+        av = np.maximum(self.var_alpha, 1.0 / (n + 1))
+        new_var = np.where(spike | drift, var, (1 - av) * (var + av * dv * dv))
+        flags[spike] |= TEMP_PICO
+        flags[drift] |= TEMP_DERIVA
+        temp_run = np.where(valid, np.where(x == self._temp[rows], self._temp_run[rows] + 1, 1), self._temp_run[rows])
+        flags[valid & (temp_run >= self.stuck_count)] |= TEMP_PEGADA
+
+        self._n[rows] = np.where(valid, n + 1, n)
+        self._mean[rows] = np.where(valid, new_mean, mean)
+        self._var[rows] = np.where(valid, new_var, var)
+        self._fast[rows] = np.where(valid, new_fast, fast)
+        self._temp[rows] = np.where(valid, x, self._temp[rows])
+        self._temp_run[rows] = temp_run
+        self._t_seen[rows] = np.maximum(self._t_seen[rows], t)
+        return flags
+
+    def _run(self, sensors, t, fill, temp):
+        """Procesa lecturas de muchos sensores; banderas en el orden recibido."""
+        flags = np.zeros(len(sensors), dtype=np.int64)
+        if not len(sensors):
+            return flags
+        order = np.lexsort((t, sensors))
+        sensors, t, fill, temp = sensors[order], t[order], fill[order], temp[order]
+        new_group = np.r_[True, sensors[1:] != sensors[:-1]]
+        starts = np.flatnonzero(new_group)
+        group = np.cumsum(new_group) - 1
+        pos = np.arange(len(sensors)) - starts[group]
+        rows = self._rows_for(sensors[starts])[group]
+
+        # Paso k: la k-ésima lectura de cada sensor, todas a la vez
+        by_pos = np.argsort(pos, kind='stable')
+        bounds = np.r_[0, np.cumsum(np.bincount(pos))]
+        result = np.zeros(len(sensors), dtype=np.int64)
+        for k in range(len(bounds) - 1):
+            sel = by_pos[bounds[k]:bounds[k + 1]]
+            result[sel] = self._step(rows[sel], t[sel], fill[sel], temp[sel])
+        flags[order] = result
+        return flags
+
+    def _count(self, flags):
+        for bit, name in FLAG_NAMES.items():
+            self._counts[name] += int(np.count_nonzero(flags & bit))
+
+    # ----- carga (estado inicial y lo escrito por otros procesos) -----
+    def _fetch(self, conn, sql, params):
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        ids = np.array([r[0] for r in rows], dtype=np.int64)
+        sensors = np.array([r[1] for r in rows], dtype=np.int64)
+        t = _seconds([r[2] for r in rows])
+        return ids, sensors, t, _column([r[3] for r in rows]), _column([r[4] for r in rows])
+
+    def load(self, conn, now=None):
+        """Arranca el estado desde las últimas `window_hours` de mediciones."""
+        since = (now or datetime.now()) - timedelta(hours=self.window_hours)
+        ids, sensors, t, fill, temp = self._fetch(conn, LOAD_SQL, (since,))
+        with self._lock:
+            self._reset()
+            self._run(sensors, t, fill, temp)
+            self._last_id = int(ids.max()) if len(ids) else 0
+            self._loaded_at = self._synced_at = time.monotonic()
+
+    def catch_up(self, conn, now=None):
+        """Suma las lecturas que otros procesos insertaron desde la última
+        vez; las que ya pasaron por apply() se reconocen porque no son
+        posteriores a la última lectura sumada de su sensor."""
+        since = (now or datetime.now()) - timedelta(hours=self.window_hours)
+        ids, sensors, t, fill, temp = self._fetch(conn, CATCH_UP_SQL, (self._last_id, since))
+        with self._lock:
+            if len(ids):
+                unique, inverse = np.unique(sensors, return_inverse=True)
+                new = t > self._t_seen[self._rows_for(unique)[inverse]]
+                self._run(sensors[new], t[new], fill[new], temp[new])
+                self._last_id = max(self._last_id, int(ids.max()))
+            self._synced_at = time.monotonic()
+
+    def ensure_loaded(self, conn):
+        if self._loaded_at is None:
+            self.load(conn)
+        elif time.monotonic() - self._synced_at > self.max_age:
+            self.catch_up(conn)
+
+    # ----- ingesta -----
+    def mark(self, readings):
+        """Marca lecturas validadas (dicts de ingest.validate) con 'Anomalia'
+        sin tocar el estado: si la inserción falla y el cliente reintenta,
+        el lote no cuenta dos veces. Devuelve cuántas quedaron marcadas."""
+        if not readings:
+            return 0
+        sensors, t, fill, temp = _arrays(readings)
+        with self._lock:
+            # Crear antes las filas de sensores nuevos para que _run no
+            # redimensione los arreglos y el estado se pueda restaurar
+            rows = self._rows_for(np.unique(sensors))
+            saved = {name: getattr(self, name)[rows].copy() for name in _STATE}
+            try:
+                flags = self._run(sensors, t, fill, temp)
+            finally:
+                for name, values in saved.items():
+                    getattr(self, name)[rows] = values
+        for r, f in zip(readings, flags.tolist()):
+            r['Anomalia'] = f
+        return int(np.count_nonzero(flags))
+
+    def apply(self, readings):
+        """Suma al estado lecturas ya guardadas (después del commit)."""
+        if not readings:
+            return
+        sensors, t, fill, temp = _arrays(readings)
+        with self._lock:
+            self._run(sensors, t, fill, temp)
+            self._count(np.array([r.get('Anomalia') or 0 for r in readings], dtype=np.int64))
+
+    @staticmethod
+    def record(cur, readings):
+        """Guarda las banderas de las lecturas marcadas. No hace commit."""
+        marked = {}
+        for r in readings:
+            if r.get('Anomalia'):
+                key = (r['FechaHora'], r['IdSensor'])
+                marked[key] = marked.get(key, 0) | r['Anomalia']
+        if marked:
+            cur.executemany(_RECORD_SQL, [(fecha, sensor, tipo, fecha, sensor)
+                                          for (fecha, sensor), tipo in marked.items()])
+        return len(marked)
+
+    def sensor_state(self, sensor):
+        with self._lock:
+            row = self._row.get(sensor)
+            if row is None:
+                return None
+            n = int(self._n[row])
+            return {
+                'ultimo_llenado': None if np.isnan(self._fill[row]) else float(self._fill[row]),
+                'tasa_hora': None if np.isnan(self._rate[row]) else round(float(self._rate[row]), 3),
+                'temp_n': n,
+                'temp_media': round(float(self._mean[row]), 2) if n else None,
+                'temp_desv': round(float(np.sqrt(max(self._var[row], 0.0))), 3) if n else None,
+                'temp_ultima': None if np.isnan(self._temp[row]) else float(self._temp[row]),
+            }
+
+    def stats(self):
+        with self._lock:
+            return {'sensores': len(self._row), 'marcadas': dict(self._counts)}
+
+
+# ========= RECÁLCULO DEL HISTÓRICO =========
+def backfill(conn, backend_name, detector=None, desde=None, sensors_per_batch=2000, log=print):
+    """Recalcula mediciones_anomalias desde `desde` (o todo el histórico).
+
+    Recorre los sensores por rangos de IdSensor con el índice
+    (IdSensor, FechaHora) y procesa cada rango en una sola pasada
+    vectorizada. Con `desde` las estadísticas arrancan de cero en esa fecha
+    (las primeras min_count lecturas de cada sensor no se juzgan).
+    Devuelve {bandera: cantidad}.
+    """
+    detector = detector or AnomalyDetector()
+    ensure_schema(conn, backend_name)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT MIN(IdSensor), MAX(IdSensor) FROM sensores")
+        lo, hi = cur.fetchone()
+        if desde:
+            cur.execute("DELETE FROM mediciones_anomalias WHERE FechaHora >= ?", (desde,))
+        else:
+            cur.execute("DELETE FROM mediciones_anomalias")
+        conn.commit()
+        if lo is None:
+            return dict(detector._counts)
+
+        sql = BACKFILL_SQL.format(desde=" AND FechaHora >= ?" if desde else "")
+        started = time.perf_counter()
+        total = 0
+        for first in range(lo, hi + 1, sensors_per_batch):
+            params = (first, first + sensors_per_batch - 1) + ((desde,) if desde else ())
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            if not rows:
+                continue
+            sensors = np.array([r[0] for r in rows], dtype=np.int64)
+            times = [r[1] for r in rows]
+            flags = detector._run(sensors, _seconds(times), _column([r[2] for r in rows]),
+                                  _column([r[3] for r in rows]))
+            detector._count(flags)
+            marked = np.flatnonzero(flags)
+            readings = [{'FechaHora': times[i], 'IdSensor': int(sensors[i]), 'Anomalia': int(flags[i])}
+                        for i in marked.tolist()]
+            AnomalyDetector.record(cur, readings)
+            conn.commit()
+            total += len(rows)
+            if log:
+                log(f"  sensores {first}-{min(first + sensors_per_batch - 1, hi)}: {total:,} lecturas "
+                    f"({total / (time.perf_counter() - started):,.0f}/s), {len(marked):,} marcadas")
+    finally:
+        cur.close()
+    return dict(detector._counts)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import crear_app
+
+    parser = argparse.ArgumentParser(description="Recalcula las banderas de anomalías del histórico")
+    parser.add_argument('cmd', choices=['backfill'])
+    parser.add_argument('--desde', help='YYYY-MM-DD (por defecto todo el histórico)')
+    parser.add_argument('--sensores-por-lote', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = crear_app()
+    pool = app.extensions['db_pool']
+    conn = pool.acquire()
+    try:
+        desde = datetime.strptime(args.desde, '%Y-%m-%d') if args.desde else None
+        counts = backfill(conn, pool.backend.name, desde=desde, sensors_per_batch=args.sensores_por_lote)
+        print(f"  marcadas: {counts}")
+        print("  recalculando agregados sin las lecturas marcadas...")
+        app.extensions['rollups'].rebuild(conn)
+    finally:
+        pool.release(conn)
+    print("[Done]")
@@ -1,9 +1,31 @@
-from flask import Flask, render_template, request
-import pyodbc
+from flask import Flask, render_template, request, g, make_response
+import functools
+from itertools import islice
 import os
-
-
-def crear_app():
+from datetime import date, datetime
+
+from db import ConnectionPool, RowCursor, make_backend
+from inspect_schema import SchemaCatalog
+from exports import parse_date_range, iter_csv, iter_columnar, gzip_chunks, stream_query
+from latest_readings import LatestReadings
+from rollups import RollupStore, CRITICAL_FILL
+from ingest import SensorDirectory, iter_ndjson, validate, insert_readings
+from query_cache import QueryCache
+from parallel import QueryExecutor
+from realtime import Broker, TooManyClients, sse_stream, readings_publisher
+from metrics import SQLMetrics
+from forecast import FillForecaster
+from routing import plan_routes
+from container_map import ContainerMap
+from conditional import DataVersions, is_not_modified
+from compression import COMPRESSIBLE, negotiate, compress_body, compress_chunks
+from reference_data import ReferenceData, resolve
+import anomalies
+from anomalies import AnomalyDetector
+from cold_storage import ColdStore, TieredCursor, merge_tiers
+
+
+def crear_app(config=None):
     app = Flask(__name__)
 
     # ========= CONFIGURACIÓN SQL SERVER (WINDOWS AUTH) =========
@@ -11,78 +33,272 @@ def crear_app():
     app.config['SQL_SERVER_DB'] = 'SisResiduos'
     app.config['SQL_DRIVER'] = 'ODBC Driver 17 for SQL Server'
 
-    # ========== CONEXIÓN SQL SERVER (Windows Auth) ==========
-    def get_mssql_connection():
-        driver = app.config['SQL_DRIVER']
-        server = app.config['SQL_SERVER_HOST']
-        database = app.config['SQL_SERVER_DB']
-
-        conn_str = (
-            f"DRIVER={{{driver}}};"
-            f"SERVER={server};"
-            f"DATABASE={database};"
-            f"Trusted_Connection=yes;"
-        )
-        return pyodbc.connect(conn_str)
-
-    # ========= CURSOR QUE RETORNA DICCIONARIOS =========
-    class DictCursor:
-        def __init__(self, cursor):
-            self.cursor = cursor
-            self._colnames = None
-
-        def execute(self, sql, params=None):
-            if params is None:
-                res = self.cursor.execute(sql)
-            else:
-                res = self.cursor.execute(sql, params)
+    # ========= CONFIGURACIÓN DEL POOL =========
+    app.config['DB_BACKEND'] = os.environ.get('DB_BACKEND', 'mssql')   # 'mssql' | 'sqlite'
+    app.config['SQLITE_PATH'] = os.environ.get('SQLITE_PATH', 'sisresiduos.db')
+    app.config['SQLITE_LATENCY_MS'] = float(os.environ.get('SQLITE_LATENCY_MS', 0))
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+    app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+    app.config['DB_POOL_PING_AFTER'] = float(os.environ.get('DB_POOL_PING_AFTER', 30))
+    app.config['SCHEMA_CATALOG_TTL'] = float(os.environ.get('SCHEMA_CATALOG_TTL', 3600))
+    app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    app.config['COLUMNAR_BATCH_SIZE'] = int(os.environ.get('COLUMNAR_BATCH_SIZE', 10000))
+    app.config['LATEST_READINGS_MAX_AGE'] = float(os.environ.get('LATEST_READINGS_MAX_AGE', 300))
+    app.config['INGEST_MAX_ROWS'] = int(os.environ.get('INGEST_MAX_ROWS', 50000))
+    app.config['INGEST_BATCH_SIZE'] = int(os.environ.get('INGEST_BATCH_SIZE', 5000))
+    app.config['SENSOR_RELOAD_INTERVAL'] = float(os.environ.get('SENSOR_RELOAD_INTERVAL', 30))   # s entre recargas por ids desconocidos
+    app.config['MEDICIONES_MAX_PAGE'] = int(os.environ.get('MEDICIONES_MAX_PAGE', 500))
+    app.config['QUERY_CACHE_MAX_ENTRIES'] = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 256))
+    app.config['QUERY_CACHE_MAX_ROWS'] = int(os.environ.get('QUERY_CACHE_MAX_ROWS', 200000))
+    app.config['QUERY_CACHE_TTL'] = float(os.environ.get('QUERY_CACHE_TTL', 30))
+    app.config['QUERY_EXECUTOR_WORKERS'] = int(os.environ.get('QUERY_EXECUTOR_WORKERS', 8))
+    app.config['DASHBOARD_QUERY_TIMEOUT'] = float(os.environ.get('DASHBOARD_QUERY_TIMEOUT', 10))
+    app.config['SSE_MAX_CLIENTS'] = int(os.environ.get('SSE_MAX_CLIENTS', 500))
+    app.config['SSE_QUEUE_SIZE'] = int(os.environ.get('SSE_QUEUE_SIZE', 100))
+    app.config['SSE_HEARTBEAT'] = float(os.environ.get('SSE_HEARTBEAT', 15))
+    app.config['ASGI_WORKER_THREADS'] = int(os.environ.get('ASGI_WORKER_THREADS', 32))
+    app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 500))
+    app.config['FORECAST_WINDOW_HOURS'] = float(os.environ.get('FORECAST_WINDOW_HOURS', 48))
+    app.config['FORECAST_MAX_POINTS'] = int(os.environ.get('FORECAST_MAX_POINTS', 64))
+    app.config['FORECAST_MAX_AGE'] = float(os.environ.get('FORECAST_MAX_AGE', 3600))
+    app.config['ROUTE_DEPOT_LAT'] = float(os.environ.get('ROUTE_DEPOT_LAT', 4.7))
+    app.config['ROUTE_DEPOT_LNG'] = float(os.environ.get('ROUTE_DEPOT_LNG', -74.01))
+    app.config['ROUTE_VEHICLE_CAPACITY'] = float(os.environ.get('ROUTE_VEHICLE_CAPACITY', 8000))   # kg
+    app.config['ROUTE_FILL_THRESHOLD'] = float(os.environ.get('ROUTE_FILL_THRESHOLD', 75))
+    app.config['ROUTE_TIME_BUDGET'] = float(os.environ.get('ROUTE_TIME_BUDGET', 2))
+    app.config['MAP_CLUSTER_MAX_ZOOM'] = int(os.environ.get('MAP_CLUSTER_MAX_ZOOM', 14))
+    app.config['MAP_MAX_POINTS'] = int(os.environ.get('MAP_MAX_POINTS', 2000))
+    app.config['MAP_MAX_AGE'] = float(os.environ.get('MAP_MAX_AGE', 600))
+    app.config['DATA_VERSION_TTL'] = float(os.environ.get('DATA_VERSION_TTL', 30))
+    app.config['REFERENCE_DATA_MAX_AGE'] = float(os.environ.get('REFERENCE_DATA_MAX_AGE', 600))
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    app.config['COMPRESS_GZIP_LEVEL'] = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+    app.config['COMPRESS_BROTLI_QUALITY'] = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+    app.config['ANOMALY_WINDOW_HOURS'] = float(os.environ.get('ANOMALY_WINDOW_HOURS', 48))
+    app.config['ANOMALY_MAX_AGE'] = float(os.environ.get('ANOMALY_MAX_AGE', 300))    # s entre catch_up()
+    app.config['ANOMALY_SPIKE_Z'] = float(os.environ.get('ANOMALY_SPIKE_Z', 5))
+    app.config['ANOMALY_DRIFT_Z'] = float(os.environ.get('ANOMALY_DRIFT_Z', 2.5))
+    app.config['ANOMALY_MAX_RISE_RATE'] = float(os.environ.get('ANOMALY_MAX_RISE_RATE', 50))   # %/h
+    app.config['ANOMALY_STUCK_COUNT'] = int(os.environ.get('ANOMALY_STUCK_COUNT', 24))
+    app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR', 'archivo')
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+    app.config['ARCHIVE_KEEP_FULL'] = os.environ.get('ARCHIVE_KEEP_FULL', '1') not in ('0', 'false')
+
+    if config:
+        app.config.update(config)
+
+    # ========= MÉTRICAS SQL (todas las conexiones del pool) =========
+    metrics = SQLMetrics(slow_ms=app.config['SLOW_QUERY_MS'])
+    app.extensions['sql_metrics'] = metrics
+
+    pool = ConnectionPool(
+        make_backend(app.config),
+        size=app.config['DB_POOL_SIZE'],
+        timeout=app.config['DB_POOL_TIMEOUT'],
+        ping_after=app.config['DB_POOL_PING_AFTER'],
+        wrap=metrics.wrap_connection,
+        on_acquire=metrics.record_acquire,
+    )
+    app.extensions['db_pool'] = pool
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_req, g.metrics_token = metrics.start_request(request.endpoint or 'desconocida')
+
+    @app.after_request
+    def track_streamed_response(response):
+        req = g.get('metrics_req')
+        if req is not None and response.is_streamed:
+            response.response = metrics.track_stream(response.response, req)
+            g.metrics_streamed = True
+        return response
+
+    @app.teardown_request
+    def end_request_metrics(exc):
+        req = g.pop('metrics_req', None)
+        token = g.pop('metrics_token', None)
+        if req is not None:
+            # Las respuestas en streaming se cierran en track_stream
+            metrics.end_request(req, token, finish=not g.pop('metrics_streamed', False))
+
+    # ========== CONEXIÓN POR PETICIÓN (desde el pool) ==========
+    def get_db():
+        if 'db_conn' not in g:
+            g.db_conn = pool.acquire()
+        return g.db_conn
+
+    @app.teardown_appcontext
+    def release_db(exc):
+        conn = g.pop('db_conn', None)
+        if conn is not None:
+            pool.release(conn)
+
+    # ========= CATÁLOGO DE ESQUEMA (en memoria) =========
+    catalog = SchemaCatalog(pool, app.config['SQL_SERVER_DB'], ttl=app.config['SCHEMA_CATALOG_TTL'])
+    app.extensions['schema_catalog'] = catalog
+    try:
+        catalog.refresh()
+    except Exception as e:
+        app.logger.warning("No se pudo cargar el catálogo de esquema al iniciar: %s", e)
+
+    # ========= ÚLTIMA MEDICIÓN POR CONTENEDOR (en memoria) =========
+    # Carga completa una vez; después sólo lo nuevo, en segundo plano
+    latest = LatestReadings(max_age=app.config['LATEST_READINGS_MAX_AGE'], pool=pool)
+    app.extensions['latest_readings'] = latest
+
+    # Quien inserte mediciones llama a notify_mediciones(rows) tras el commit;
+    # cada fila es un dict con IdSensor, IdContenedor, FechaHora,
+    # PorcentajeLlenado, PesoKg y Temperatura.
+    mediciones_listeners = [latest.apply]
+
+    def notify_mediciones(rows):
+        for listener in mediciones_listeners:
             try:
-                self._colnames = [col[0] for col in self.cursor.description]
+                listener(rows)
             except Exception:
-                self._colnames = None
-            return res
-
-        def fetchone(self):
-            row = self.cursor.fetchone()
-            if row is None:
-                return None
-            return dict(zip(self._colnames, row)) if self._colnames else row
-
-        def fetchall(self):
-            rows = self.cursor.fetchall()
-            if not rows:
-                return []
-            return [dict(zip(self._colnames, r)) for r in rows]
-
-        def close(self):
-            try: self.cursor.close()
-            except: pass
-
-        def __getattr__(self, name):
-            return getattr(self.cursor, name)
-
-    # ========= UTILIDAD PARA DETECTAR COLUMNA =========
-    def get_column_for_table(cur, schema, table, candidates):
-        cur.execute(
-            "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
-            "WHERE TABLE_CATALOG=? AND TABLE_NAME=?",
-            (schema, table),
-        )
-        rows = cur.fetchall()
-        cols = [r['COLUMN_NAME'] for r in rows]
-        for cand in candidates:
-            if cand in cols:
-                return cand
-        return None
-
-    # ========= KPIs DEL DASHBOARD =========
-    def get_dashboard_kpi():
-        conn = get_mssql_connection()
-        cur = DictCursor(conn.cursor())
-
-        estado_col = get_column_for_table(
-            cur,
-            app.config['SQL_SERVER_DB'],
+                app.logger.exception("Error propagando mediciones nuevas")
+
+    # ========= MEDICIONES ARCHIVADAS (almacenamiento frío, cold_storage.py) =========
+    cold = ColdStore(app.config['ARCHIVE_DIR'])
+    app.extensions['cold_store'] = cold
+
+    # ========= AGREGADOS POR HORA / DÍA (mediciones_rollup) =========
+    rollups = RollupStore(pool.backend, cold)
+    app.extensions['rollups'] = rollups
+
+    # IdSensor -> (IdContenedor, IdTipoResiduo) para validar la ingesta
+    sensors = SensorDirectory(reload_interval=app.config['SENSOR_RELOAD_INTERVAL'])
+
+    # ========= DETECCIÓN DE ANOMALÍAS (estadísticas en línea por sensor) =========
+    # Marca las lecturas antes de insertarlas (mark) y suma al estado sólo las
+    # ya confirmadas (apply, como listener); los agregados excluyen lo marcado
+    detector = AnomalyDetector(
+        window_hours=app.config['ANOMALY_WINDOW_HOURS'],
+        max_age=app.config['ANOMALY_MAX_AGE'],
+        spike_z=app.config['ANOMALY_SPIKE_Z'],
+        drift_z=app.config['ANOMALY_DRIFT_Z'],
+        max_rise_rate=app.config['ANOMALY_MAX_RISE_RATE'],
+        stuck_count=app.config['ANOMALY_STUCK_COUNT'],
+    )
+    app.extensions['anomaly_detector'] = detector
+    mediciones_listeners.append(detector.apply)
+
+    # Tablas propias (banderas y agregados): se crean al iniciar y los
+    # agregados se recalculan si la tabla está vacía y ya hay mediciones;
+    # la última medición por contenedor se carga aquí y no en una petición
+    try:
+        conn = pool.acquire()
+        try:
+            anomalies.ensure_schema(conn, pool.backend.name)
+            if rollups.rebuild_if_empty(conn):
+                app.logger.info("mediciones_rollup estaba vacía: recalculada desde mediciones")
+            latest.load(conn)
+        finally:
+            pool.release(conn)
+    except Exception as e:
+        app.logger.warning("No se pudieron preparar mediciones_anomalias / mediciones_rollup "
+                           "/ última medición: %s", e)
+
+    # ========= CACHÉ DE RESULTADOS (invalidada por escrituras) =========
+    cache = QueryCache(
+        max_entries=app.config['QUERY_CACHE_MAX_ENTRIES'],
+        max_rows=app.config['QUERY_CACHE_MAX_ROWS'],
+        ttl=app.config['QUERY_CACHE_TTL'],
+    )
+    app.extensions['query_cache'] = cache
+    mediciones_listeners.append(lambda rows: cache.invalidate('mediciones', 'mediciones_rollup'))
+
+    # ========= EVENTOS EN VIVO (SSE) =========
+    broker = Broker(max_clients=app.config['SSE_MAX_CLIENTS'], max_queue=app.config['SSE_QUEUE_SIZE'])
+    app.extensions['sse_broker'] = broker
+    # Va primero para comparar con el nivel anterior antes de que cambie el índice
+    mediciones_listeners.insert(0, readings_publisher(broker, latest, CRITICAL_FILL))
+
+    # ========= PRONÓSTICO DE LLENADO (en memoria, NumPy) =========
+    forecaster = FillForecaster(
+        window_hours=app.config['FORECAST_WINDOW_HOURS'],
+        max_points=app.config['FORECAST_MAX_POINTS'],
+        max_age=app.config['FORECAST_MAX_AGE'],
+    )
+    app.extensions['fill_forecaster'] = forecaster
+    mediciones_listeners.append(forecaster.apply)
+
+    # ========= MAPA DE CONTENEDORES (rejilla y clusters en memoria) =========
+    container_map = ContainerMap(
+        cluster_max_zoom=app.config['MAP_CLUSTER_MAX_ZOOM'],
+        max_points=app.config['MAP_MAX_POINTS'],
+        critical=CRITICAL_FILL,
+        max_age=app.config['MAP_MAX_AGE'],
+    )
+    app.extensions['container_map'] = container_map
+    # Después de latest.apply: toma de ahí el nivel ya actualizado
+    mediciones_listeners.append(lambda rows: container_map.apply(rows, latest))
+
+    # ========= VERSIONES DE DATOS Y GET CONDICIONAL =========
+    # Las rutas que escriben llaman a versions.bump(tabla) tras el commit
+    versions = DataVersions(ttl=app.config['DATA_VERSION_TTL'])
+    app.extensions['data_versions'] = versions
+    mediciones_listeners.append(lambda rows: versions.bump('mediciones', 'mediciones_rollup'))
+
+    def conditional(*tables, extra=None):
+        """La vista responde 304 sin ejecutarse (ni consultar la base) si el
+        cliente ya tiene la versión vigente de `tables`."""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                etag, last_modified = versions.validator(tables, extra() if extra else '')
+                if is_not_modified(request, etag, last_modified):
+                    response = app.response_class(status=304)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag, weak=True)
+                response.last_modified = last_modified
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+            return wrapper
+        return decorator
+
+    # ========= TABLAS DE REFERENCIA (en memoria, por ID) =========
+    # tiposresiduos, ubicaciones y tipossensores: las consultas devuelven IDs
+    # y los nombres se resuelven aquí en vez de con JOINs
+    reference = ReferenceData(versions, max_age=app.config['REFERENCE_DATA_MAX_AGE'])
+    app.extensions['reference_data'] = reference
+
+    # ========= COMPRESIÓN (br / gzip negociada) =========
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.mimetype not in COMPRESSIBLE
+                or 'Content-Encoding' in response.headers or response.direct_passthrough):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+        levels = app.config['COMPRESS_GZIP_LEVEL'], app.config['COMPRESS_BROTLI_QUALITY']
+        if response.is_streamed:
+            response.response = compress_chunks(response.response, encoding, *levels)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config['COMPRESS_MIN_SIZE']:
+                return response
+            response.set_data(compress_body(data, encoding, *levels))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    # ========= CONSULTAS DEL DASHBOARD (independientes, en paralelo) =========
+    executor = QueryExecutor(
+        pool,
+        max_workers=app.config['QUERY_EXECUTOR_WORKERS'],
+        timeout=app.config['DASHBOARD_QUERY_TIMEOUT'],
+    )
+    app.extensions['query_executor'] = executor
+
+    def kpi_contenedores(cur):
+        cur = RowCursor(cur)
+        estado_col = catalog.resolve(
             'contenedores',
             ['estado', 'Estado', 'estado_contenedor',
              'EstadoContenedor', 'estadoContenedor']
@@ -91,190 +307,466 @@ def crear_app():
         if estado_col:
             q = f"SELECT COUNT(*) AS total FROM contenedores WHERE [{estado_col}] = ?"
             cur.execute(q, ('Activo',))
-            total_cont = cur.fetchone()['total']
         else:
             cur.execute("SELECT COUNT(*) AS total FROM contenedores")
-            total_cont = cur.fetchone()['total']
+        return cur.fetchone()['total']
 
+    def kpi_mediciones(cur):
+        cur = RowCursor(cur)
+        hoy = datetime.combine(date.today(), datetime.min.time())
         cur.execute("""
-            SELECT COUNT(*) AS total 
-            FROM mediciones 
-            WHERE CONVERT(date, FechaHora) = CONVERT(date, GETDATE())
-        """)
-        mediciones_hoy = cur.fetchone()['total']
-
-        cur.execute("SELECT ROUND(AVG(PorcentajeLlenado), 2) AS promedio FROM mediciones")
-        result = cur.fetchone()
-        promedio_llenado = result['promedio'] if result['promedio'] else 0
-
-        cur.execute("SELECT COUNT(*) AS total FROM mediciones WHERE PorcentajeLlenado > 85")
-        critical_alerts = cur.fetchone()['total']
-
-        cur.close()
-        conn.close()
-
-        return {
-            'containers_active': total_cont,
-            'measurements_today': mediciones_hoy,
-            'avg_fill': promedio_llenado,
-            'critical_alerts': critical_alerts
-        }
-
-    # ========= DATOS PARA GRÁFICAS =========
-    def get_chart_and_container_data():
-        conn = get_mssql_connection()
-        cur = DictCursor(conn.cursor())
-
-        cur.execute("""
-            SELECT TOP 100 c.IdContenedor AS id, t.TipoResiduo AS tipo,
-                ISNULL((
-                    SELECT TOP 1 PorcentajeLlenado 
-                    FROM mediciones m 
-                    WHERE m.IdSensor IN (
-                        SELECT IdSensor FROM sensores WHERE IdContenedor = c.IdContenedor
-                    )
-                    ORDER BY m.FechaHora DESC
-                ), 0) AS nivel_llenado,
-                ISNULL(u.Latitud, 4.7) AS lat, 
-                ISNULL(u.Longitud, -74.01) AS lng,
-                'Activo' AS estado
-            FROM contenedores c
-            LEFT JOIN tiposresiduos t ON c.IdTipoResiduo = t.IdTipoResiduo
-            LEFT JOIN ubicaciones u ON c.IdUbicacion = u.IdUbicacion
-        """)
-        containers = cur.fetchall()
-
+            SELECT ISNULL(SUM(CASE WHEN Periodo = ? THEN N ELSE 0 END), 0) AS hoy,
+                ROUND(SUM(SumaLlenado) / NULLIF(SUM(NLlenado), 0), 2) AS promedio,
+                ISNULL(SUM(NCriticas), 0) AS criticas
+            FROM mediciones_rollup
+            WHERE Granularidad = 'D'
+        """, (hoy,))
+        return cur.fetchone()
+
+    def kpi_anomalias(cur):
+        cur = RowCursor(cur)
+        hoy = datetime.combine(date.today(), datetime.min.time())
+        cur.execute("SELECT COUNT(*) AS hoy FROM mediciones_anomalias WHERE FechaHora >= ?", (hoy,))
+        return cur.fetchone()['hoy']
+
+    def chart_containers(cur):
+        latest.ensure_loaded(cur.connection)
+        reference.ensure_loaded(cur.connection)
+        cur = RowCursor(cur)
+        cur.execute("SELECT IdContenedor AS id, IdTipoResiduo AS tipo, IdUbicacion AS ubicacion FROM contenedores")
+        tipos, coordenadas = reference.tipos_residuo, reference.coordenadas
+        result = []
+        for c in cur.fetchall():
+            lat, lng = coordenadas.get(c['ubicacion'], (4.7, -74.01))
+            result.append({'id': c['id'], 'tipo': tipos.get(c['tipo']), 'nivel_llenado': latest.fill_level(c['id']),
+                           'lat': lat, 'lng': lng, 'estado': 'Activo'})
+        return result
+
+    def chart_fill(cur):
+        reference.ensure_loaded(cur.connection)
+        cur = RowCursor(cur)
         cur.execute("""
-            SELECT TOP 10 t.TipoResiduo, ROUND(AVG(m.PorcentajeLlenado), 1) AS avg_fill
-            FROM mediciones m
-            JOIN sensores s ON m.IdSensor = s.IdSensor
-            JOIN contenedores c ON s.IdContenedor = c.IdContenedor
-            JOIN tiposresiduos t ON c.IdTipoResiduo = t.IdTipoResiduo
-            GROUP BY t.TipoResiduo
+            SELECT TOP 10 IdTipoResiduo AS TipoResiduo,
+                ROUND(SUM(SumaLlenado) / NULLIF(SUM(NLlenado), 0), 1) AS avg_fill
+            FROM mediciones_rollup
+            WHERE Granularidad = 'D' AND IdTipoResiduo IS NOT NULL
+            GROUP BY IdTipoResiduo
             ORDER BY avg_fill DESC
         """)
-        fill_data = cur.fetchall()
-        fill_labels = [row['TipoResiduo'] for row in fill_data]
-        fill_values = [row['avg_fill'] for row in fill_data]
+        return resolve(cur.fetchall(), {'TipoResiduo': reference.tipos_residuo})
 
+    def chart_temp(cur):
+        cur = RowCursor(cur)
         cur.execute("""
-            SELECT TOP 24 DATEPART(HOUR, FechaHora) AS hora,
-                ROUND(AVG(Temperatura), 1) AS temp_avg
-            FROM mediciones
-            WHERE Temperatura IS NOT NULL AND Temperatura > -50 AND Temperatura < 100
-            GROUP BY DATEPART(HOUR, FechaHora)
+            SELECT TOP 24 DATEPART(HOUR, Periodo) AS hora,
+                ROUND(SUM(SumaTemp) / SUM(NTemp), 1) AS temp_avg
+            FROM mediciones_rollup
+            WHERE Granularidad = 'HD' AND NTemp > 0
+            GROUP BY DATEPART(HOUR, Periodo)
             ORDER BY hora ASC
         """)
-        temp_rows = cur.fetchall()
-        temp_labels = [f"{r['hora']}:00" for r in temp_rows]
-        temp_values = [r['temp_avg'] for r in temp_rows]
+        return cur.fetchall()
 
-        cur.close()
-        conn.close()
+    dashboard_queries = {
+        'contenedores': kpi_contenedores,
+        'mediciones': kpi_mediciones,
+        'anomalias': kpi_anomalias,
+        'containers': chart_containers,
+        'fill': chart_fill,
+        'temp': chart_temp,
+    }
 
+    # ========= KPIs DEL DASHBOARD =========
+    def get_dashboard_kpi(results):
+        mediciones = results.get('mediciones') or {}
         return {
-            'containers': containers,
+            'containers_active': results.get('contenedores', 0),
+            'measurements_today': mediciones.get('hoy', 0),
+            'avg_fill': mediciones.get('promedio') or 0,
+            'critical_alerts': mediciones.get('criticas', 0),
+            'anomalies_today': results.get('anomalias', 0),
+        }
+
+    # ========= DATOS PARA GRÁFICAS =========
+    def get_chart_and_container_data(results):
+        fill_data = results.get('fill', [])
+        temp_rows = results.get('temp', [])
+        return {
+            'containers': results.get('containers', []),
             'chart': {
-                'fill_data': fill_values,
-                'fill_labels': fill_labels,
-                'temp_data': temp_values,
-                'temp_labels': temp_labels
+                'fill_data': [row['avg_fill'] for row in fill_data],
+                'fill_labels': [row['TipoResiduo'] for row in fill_data],
+                'temp_data': [r['temp_avg'] for r in temp_rows],
+                'temp_labels': [f"{r['hora']}:00" for r in temp_rows]
             }
         }
 
+    def load_dashboard():
+        results, errors = executor.run(dashboard_queries)
+        for name, exc in errors.items():
+            app.logger.warning("Consulta del dashboard '%s' falló: %s", name, exc)
+        return {
+            'kpi': get_dashboard_kpi(results),
+            'chart_data': get_chart_and_container_data(results),
+            'errors': sorted(errors),
+        }
+
+    # ========= FILTROS DE MEDICIONES (desde / hasta / idContenedor) =========
+    def mediciones_filters(args):
+        desde, hasta = parse_date_range(args)
+        contenedor = args.get('idContenedor') or None
+        where, params = [], []
+        if desde:
+            where.append("m.FechaHora >= ?")
+            params.append(desde)
+        if hasta:
+            where.append("m.FechaHora < ?")
+            params.append(hasta)
+        if contenedor:
+            where.append("s.IdContenedor = ?")
+            params.append(int(contenedor))
+        return where, params
+
+    def archived_mediciones(args, descending=True, after=None):
+        """Lecturas archivadas con los filtros de mediciones_filters, en el
+        orden de la tabla; vacío si no hay nada archivado."""
+        if not cold.periods():
+            return iter(())
+        desde, hasta = parse_date_range(args)
+        contenedor = args.get('idContenedor') or None
+        # Como el JOIN con sensores: sólo sensores existentes (del contenedor pedido)
+        owners = sensors.resolve(get_db(), ())
+        ids = [s for s, (c, _) in owners.items() if not contenedor or c == int(contenedor)]
+        return cold.rows(desde, hasta, ids, descending=descending, after=after)
+
     # ========= RUTAS =========
 
     @app.route('/')
     def index():
         return render_template('index.html')
 
+    @app.route('/stats')
+    def stats():
+        return {'pool': pool.stats(), 'query_cache': cache.stats(), 'sse': broker.stats(),
+                'mapa': container_map.stats(), 'versiones': versions.stats(), 'referencia': reference.stats(),
+                'anomalias': detector.stats(), 'archivo': cold.stats()}
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        pool_stats = pool.stats()
+        cache_stats = cache.stats()
+        sse_stats = broker.stats()
+        extra = [
+            ('sisresiduos_db_pool_open', 'gauge', 'Conexiones abiertas.', pool_stats['open']),
+            ('sisresiduos_db_pool_in_use', 'gauge', 'Conexiones prestadas.', pool_stats['in_use']),
+            ('sisresiduos_db_pool_idle', 'gauge', 'Conexiones ociosas.', pool_stats['idle']),
+            ('sisresiduos_db_pool_waits_total', 'counter', 'Acquires que tuvieron que esperar.', pool_stats['waits']),
+            ('sisresiduos_db_pool_timeouts_total', 'counter', 'Acquires que agotaron la espera.', pool_stats['timeouts']),
+            ('sisresiduos_query_cache_hits_total', 'counter', 'Aciertos de la caché de consultas.', cache_stats['hits']),
+            ('sisresiduos_query_cache_misses_total', 'counter', 'Fallos de la caché de consultas.', cache_stats['misses']),
+            ('sisresiduos_query_cache_entries', 'gauge', 'Entradas en la caché de consultas.', cache_stats['entries']),
+            ('sisresiduos_sse_clients', 'gauge', 'Clientes SSE conectados.', sse_stats['clients']),
+        ]
+        return app.response_class(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/eventos')
+    def eventos():
+        try:
+            sub = broker.subscribe()
+        except TooManyClients as e:
+            return {'error': str(e)}, 503
+        return app.response_class(
+            response=sse_stream(broker, sub, app.config['SSE_HEARTBEAT']),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
     @app.route('/dashboard')
     def dashboard():
-        kpi = get_dashboard_kpi()
-        chart_data = get_chart_and_container_data()
-        return render_template('dashboard.html', kpi=kpi, containers=chart_data['containers'], chart=chart_data['chart'])
+        # Con consultas fallidas se muestra lo que haya, pero no se guarda en caché
+        data = cache.get_or_compute(
+            ('dashboard', date.today()),
+            {'contenedores', 'tiposresiduos', 'ubicaciones', 'mediciones', 'mediciones_rollup'},
+            load_dashboard,
+            store=lambda d: not d['errors'])
+        chart_data = data['chart_data']
+        return render_template('dashboard.html', kpi=data['kpi'], containers=chart_data['containers'], chart=chart_data['chart'])
 
     @app.route('/contenedores')
+    @conditional('contenedores', 'tiposresiduos', 'ubicaciones', 'sensores', 'mediciones', 'mediciones_rollup',
+                 extra=lambda: datetime.now().strftime('%Y%m%d%H%M'))     # el pronóstico avanza con el reloj
     def contenedores():
-        conn = get_mssql_connection()
-        cur = DictCursor(conn.cursor())
+        def load():
+            conn = get_db()
+            reference.ensure_loaded(conn)
+            cur = RowCursor(conn.cursor())
 
-        cur.execute("SELECT IdTipoResiduo AS id, TipoResiduo AS nombre FROM tiposresiduos ORDER BY TipoResiduo")
-        tipos = cur.fetchall()
+            # Desde los agregados diarios: incluyen lo archivado y ya
+            # excluyen los llenados marcados como anómalos
+            cur.execute("""
+                SELECT c.IdContenedor AS id, c.IdTipoResiduo AS tipo, c.Capacidad AS capacidad, 
+                    c.IdUbicacion AS ubicacion, 'Activo' AS estado,
+                    ROUND(SUM(r.SumaLlenado) / NULLIF(SUM(r.NLlenado), 0), 1) AS promedio_ll
+                FROM contenedores c
+                LEFT JOIN sensores s ON s.IdContenedor = c.IdContenedor
+                LEFT JOIN mediciones_rollup r ON r.IdSensor = s.IdSensor AND r.Granularidad = 'D'
+                GROUP BY c.IdContenedor, c.IdTipoResiduo, c.IdUbicacion, c.Capacidad
+                ORDER BY c.IdContenedor ASC
+            """)
+            data = resolve(cur.fetchall(), {'tipo': reference.tipos_residuo, 'ubicacion': reference.ubicaciones})
 
-        cur.execute("SELECT IdUbicacion AS id, Direccion AS nombre FROM ubicaciones ORDER BY Direccion")
-        ubicaciones = cur.fetchall()
+            cur.close()
 
-        cur.execute("""
-            SELECT c.IdContenedor AS id, t.TipoResiduo AS tipo, c.Capacidad AS capacidad, 
-                u.Direccion AS ubicacion, 'Activo' AS estado,
-                ROUND(AVG(m.PorcentajeLlenado), 1) AS promedio_ll
-            FROM contenedores c
-            JOIN tiposresiduos t ON c.IdTipoResiduo = t.IdTipoResiduo
-            JOIN ubicaciones u ON c.IdUbicacion = u.IdUbicacion
-            LEFT JOIN sensores s ON s.IdContenedor = c.IdContenedor
-            LEFT JOIN mediciones m ON m.IdSensor = s.IdSensor
-            GROUP BY c.IdContenedor, t.TipoResiduo, u.Direccion, c.Capacidad
-            ORDER BY c.IdContenedor ASC
-        """)
-        data = cur.fetchall()
+            return {'contenedores': data, 'tipos': reference.options('tiposresiduos'),
+                    'ubicaciones': reference.options('ubicaciones')}
 
-        cur.close()
-        conn.close()
+        ctx = cache.get_or_compute(
+            'contenedores', {'contenedores', 'tiposresiduos', 'ubicaciones', 'sensores', 'mediciones',
+                             'mediciones_rollup'}, load)
+        # El pronóstico cambia con la hora: se calcula aparte, no se cachea
+        forecaster.ensure_loaded(get_db())
+        return render_template('contenedores.html', pronostico=forecaster.forecast(), **ctx)
 
-        return render_template('contenedores.html', contenedores=data, tipos=tipos, ubicaciones=ubicaciones)
+    @app.route('/contenedores/pronostico')
+    def pronostico_contenedores():
+        try:
+            contenedor = request.args.get('idContenedor')
+            contenedor = int(contenedor) if contenedor else None
+            horizonte = request.args.get('horizonte')
+            horizonte = float(horizonte) if horizonte else None
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        forecaster.ensure_loaded(get_db())
+        now = datetime.now()
+        data = [
+            dict(contenedor=id_contenedor, **f)
+            for id_contenedor, f in forecaster.forecast(now).items()
+            if (contenedor is None or id_contenedor == contenedor)
+            and (horizonte is None or (f['horas_para_lleno'] is not None and f['horas_para_lleno'] <= horizonte))
+        ]
+        data.sort(key=lambda f: (f['horas_para_lleno'] is None, f['horas_para_lleno'] or 0))
+        return {'generado': now.isoformat(' ', 'seconds'), 'pronosticos': data}
+
+    # ========= MAPA (bbox + zoom) =========
+    @app.route('/mapa/contenedores')
+    def mapa_contenedores():
+        try:
+            west, south, east, north = (float(v) for v in request.args['bbox'].split(','))
+            zoom = int(request.args.get('zoom', 12))
+            if west > east or south > north:
+                raise ValueError("bbox debe ser oeste,sur,este,norte")
+        except KeyError:
+            return {'error': 'falta bbox=oeste,sur,este,norte'}, 400
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        conn = get_db()
+        latest.ensure_loaded(conn)
+        reference.ensure_loaded(conn)
+        container_map.ensure_loaded(conn, latest, reference)
+        data = container_map.query(west, south, east, north, zoom)
+        data['zoom'] = zoom
+        return data
+
+    # ========= PLAN DE RUTAS DE RECOLECCIÓN =========
+    @app.route('/rutas')
+    def rutas():
+        """Rutas para los contenedores sobre `umbral` (% de llenado) o que se
+        llenan dentro de `horizonte` horas, con vehículos de `capacidad` kg."""
+        args = request.args
+        try:
+            horizonte = float(args['horizonte']) if args.get('horizonte') else None
+            umbral = args.get('umbral')
+            umbral = float(umbral) if umbral else (None if horizonte is not None else app.config['ROUTE_FILL_THRESHOLD'])
+            capacidad = float(args.get('capacidad') or app.config['ROUTE_VEHICLE_CAPACITY'])
+            vehiculos = int(args['vehiculos']) if args.get('vehiculos') else None
+            depot = (float(args.get('lat') or app.config['ROUTE_DEPOT_LAT']),
+                     float(args.get('lng') or app.config['ROUTE_DEPOT_LNG']))
+            if capacidad <= 0:
+                raise ValueError("capacidad debe ser mayor que 0")
+            if vehiculos is not None and vehiculos < 1:
+                raise ValueError("vehiculos debe ser al menos 1")
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        def load():
+            conn = get_db()
+            reference.ensure_loaded(conn)
+            cur = conn.cursor()
+            cur.execute("SELECT IdContenedor, Capacidad, IdUbicacion FROM contenedores")
+            coordenadas = reference.coordenadas
+            data = [{'id': id_contenedor, 'capacidad': capacidad, 'lat': coordenadas[u][0], 'lng': coordenadas[u][1]}
+                    for id_contenedor, capacidad, u in cur.fetchall() if u in coordenadas]
+            cur.close()
+            return data
+
+        contenedores = cache.get_or_compute('rutas:contenedores', {'contenedores', 'ubicaciones'}, load)
+        conn = get_db()
+        latest.ensure_loaded(conn)
+        forecaster.ensure_loaded(conn)
+        ids, niveles, _, horas = forecaster.arrays()
+        pronostico = dict(zip(ids.tolist(), zip(niveles.tolist(), horas.tolist())))
+
+        seleccion = []
+        for c in contenedores:
+            nivel, horas_lleno = pronostico.get(c['id'], (None, None))
+            if nivel is None or nivel != nivel:
+                nivel = latest.fill_level(c['id'], None)
+            if nivel is None:
+                continue
+            if (umbral is not None and nivel >= umbral) or (
+                    horizonte is not None and horas_lleno is not None and horas_lleno <= horizonte):
+                seleccion.append((c, nivel, float(c['capacidad'] or 0) * nivel / 100))
+
+        plan = plan_routes(
+            [(c['lat'], c['lng'], carga) for c, _, carga in seleccion],
+            depot, capacidad, vehiculos, time_budget=app.config['ROUTE_TIME_BUDGET'])
+
+        def parada(i):
+            c, nivel, carga = seleccion[i]
+            return {'contenedor': c['id'], 'lat': c['lat'], 'lng': c['lng'],
+                    'nivel': round(nivel, 1), 'carga_kg': round(carga, 1)}
+
+        return {
+            'rutas': [
+                {'vehiculo': n, 'paradas': [parada(i) for i in r['stops']],
+                 'carga_kg': round(r['load'], 1), 'distancia_km': round(r['distance_km'], 2)}
+                for n, r in enumerate(plan['routes'], 1)
+            ],
+            'sin_asignar': [seleccion[i][0]['id'] for i in plan['unassigned']],
+            'resumen': {
+                'paradas': len(seleccion),
+                'rutas': len(plan['routes']),
+                'distancia_km': round(plan['distance_km'], 2),
+                'distancia_inicial_km': round(plan['initial_km'], 2),
+                'mejoras': plan['improvements'],
+                'tiempo_ms': round(plan['elapsed'] * 1000, 1),
+            },
+        }
 
     @app.route('/sensores')
+    @conditional('sensores', 'tipossensores', 'contenedores')
     def sensores():
-        conn = get_mssql_connection()
-        cur = DictCursor(conn.cursor())
+        def load():
+            conn = get_db()
+            reference.ensure_loaded(conn)
+            cur = RowCursor(conn.cursor())
 
-        cur.execute("SELECT IdTipoSensor AS id, TipoSensor AS nombre FROM tipossensores ORDER BY TipoSensor")
-        tipos = cur.fetchall()
+            cur.execute("SELECT IdContenedor AS id, IdContenedor AS nombre FROM contenedores ORDER BY IdContenedor")
+            conts = cur.fetchall()
 
-        cur.execute("SELECT IdContenedor AS id, IdContenedor AS nombre FROM contenedores ORDER BY IdContenedor")
-        conts = cur.fetchall()
+            cur.execute("""
+                SELECT s.IdSensor AS id, s.IdTipoSensor AS tipo, s.Modelo AS modelo, 
+                    c.IdContenedor AS contenedor, s.IdEstado AS estado, s.FechaInstalacion AS fecha_instalacion
+                FROM sensores s
+                JOIN contenedores c ON s.IdContenedor = c.IdContenedor
+                ORDER BY s.IdSensor ASC
+            """)
+            data = resolve(cur.fetchall(), {'tipo': reference.tipos_sensor})
 
-        cur.execute("""
-            SELECT s.IdSensor AS id, ts.TipoSensor AS tipo, s.Modelo AS modelo, 
-                c.IdContenedor AS contenedor, s.IdEstado AS estado, s.FechaInstalacion AS fecha_instalacion
-            FROM sensores s
-            JOIN tipossensores ts ON s.IdTipoSensor = ts.IdTipoSensor
-            JOIN contenedores c ON s.IdContenedor = c.IdContenedor
-            ORDER BY s.IdSensor ASC
-        """)
-        data = cur.fetchall()
+            cur.close()
 
-        cur.close()
-        conn.close()
+            return {'sensores': data, 'tipos': reference.options('tipossensores'), 'contenedores': conts}
 
-        return render_template('sensores.html', sensores=data, tipos=tipos, contenedores=conts)
+        ctx = cache.get_or_compute('sensores', {'sensores', 'tipossensores', 'contenedores'}, load)
+        return render_template('sensores.html', **ctx)
 
     @app.route('/mediciones')
+    @conditional('contenedores')
     def mediciones():
-        conn = get_mssql_connection()
-        cur = DictCursor(conn.cursor())
+        def load():
+            conn = get_db()
+            cur = RowCursor(conn.cursor())
 
-        cur.execute("""
-            SELECT TOP 500 m.IdMedicion AS id, s.IdSensor AS sensor, m.FechaHora AS fecha_hora, 
-                m.PorcentajeLlenado AS porcentaje, m.PesoKg As peso, m.Temperatura AS temp
-            FROM mediciones m
-            JOIN sensores s ON m.IdSensor = s.IdSensor
-            ORDER BY m.FechaHora DESC
-        """)
-        data = cur.fetchall()
+            cur.execute("SELECT IdContenedor AS id, IdContenedor AS nombre FROM contenedores ORDER BY IdContenedor")
+            conts = cur.fetchall()
 
-        cur.execute("""
-            SELECT DISTINCT u.IdUbicacion AS id, u.Direccion AS nombre
-            FROM ubicaciones u
-            ORDER BY u.Direccion
-        """)
-        ubicaciones = cur.fetchall()
+            cur.close()
+
+            return conts
+
+        conts = cache.get_or_compute('mediciones:contenedores', {'contenedores'}, load)
+        return render_template('mediciones.html', contenedores=conts, filtros=request.args)
+
+    # ========= MEDICIONES PAGINADAS (DataTables server-side, keyset) =========
+    def parse_cursor(value):
+        fecha, _, id_medicion = value.rpartition('_')
+        return datetime.fromisoformat(fecha), int(id_medicion)
+
+    def make_cursor(row):
+        return f"{row['fecha_hora'].isoformat()}_{row['id']}"
+
+    ROW_KEYS = ('id', 'sensor', 'fecha_hora', 'porcentaje', 'peso', 'temp')
 
-        cur.close()
-        conn.close()
+    @app.route('/mediciones/data')
+    def mediciones_data():
+        try:
+            where, params = mediciones_filters(request.args)
+            length = min(max(int(request.args.get('length', 25)), 1), app.config['MEDICIONES_MAX_PAGE'])
+            after = request.args.get('after')
+            before = request.args.get('before')
+            filter_where, filter_params = list(where), list(params)
+            if after:
+                fecha, id_medicion = parse_cursor(after)
+                where.append("(m.FechaHora < ? OR (m.FechaHora = ? AND m.IdMedicion < ?))")
+                params += [fecha, fecha, id_medicion]
+            elif before:
+                fecha, id_medicion = parse_cursor(before)
+                where.append("(m.FechaHora > ? OR (m.FechaHora = ? AND m.IdMedicion > ?))")
+                params += [fecha, fecha, id_medicion]
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        def load():
+            # Hacia atrás se recorre en orden ascendente y luego se invierte
+            direction = 'ASC' if before and not after else 'DESC'
+            conn = get_db()
+            cur = RowCursor(conn.cursor())
+            cur.execute(f"""
+                SELECT TOP {length} m.IdMedicion AS id, m.IdSensor AS sensor, m.FechaHora AS fecha_hora,
+                    m.PorcentajeLlenado AS porcentaje, m.PesoKg AS peso, m.Temperatura AS temp
+                FROM mediciones m
+                JOIN sensores s ON m.IdSensor = s.IdSensor
+                {"WHERE " + " AND ".join(where) if where else ""}
+                ORDER BY m.FechaHora {direction}, m.IdMedicion {direction}
+            """, tuple(params))
+            rows = cur.fetchall()
+            # Una lectura atrasada puede quedar en la tabla con fecha dentro
+            # de un mes ya archivado: las dos páginas se intercalan por clave
+            descending = direction == 'DESC'
+            cursor = after if descending else before
+            archived = archived_mediciones(request.args, descending, parse_cursor(cursor) if cursor else None)
+            archived = (dict(zip(ROW_KEYS, r)) for r in islice(archived, length))
+            rows = list(islice(merge_tiers(rows, archived, lambda r: (r['fecha_hora'], r['id']), descending),
+                               length))
+            if direction == 'ASC':
+                rows.reverse()
+
+            # Los filtros son por día completo, así que los totales salen exactos
+            # de los agregados diarios sin contar filas de mediciones
+            rollup_filter = [w.replace('m.FechaHora', 'Periodo').replace('s.IdContenedor', 'IdContenedor')
+                             for w in filter_where]
+            cur.execute(f"""
+                SELECT ISNULL(SUM(N), 0) AS total,
+                    ISNULL(SUM(CASE WHEN {" AND ".join(rollup_filter) or "1 = 1"} THEN N ELSE 0 END), 0) AS filtrado
+                FROM mediciones_rollup
+                WHERE Granularidad = 'D'
+            """, tuple(filter_params))
+            totals = cur.fetchone()
+            cur.close()
+
+            return {
+                'recordsTotal': totals['total'],
+                'recordsFiltered': totals['filtrado'],
+                'first': make_cursor(rows[0]) if rows else None,
+                'last': make_cursor(rows[-1]) if rows else None,
+                'data': [dict(r, fecha_hora=r['fecha_hora'].isoformat(' ', 'seconds')) for r in rows],
+            }
 
-        return render_template('mediciones.html', mediciones=data, ubicaciones=ubicaciones)
+        key = ('mediciones:data', tuple(sorted((k, v) for k, v in request.args.items(multi=True) if k != 'draw')))
+        page = cache.get_or_compute(key, {'mediciones', 'sensores', 'mediciones_rollup'}, load)
+        return dict(page, draw=int(request.args.get('draw', 0)))
 
     # ========= INSERTAR CONTENEDOR =========
     @app.route('/contenedores/agregar', methods=['POST'])
@@ -284,7 +776,7 @@ def crear_app():
             capacidad = request.form.get('capacidad')
             ubicacion = request.form.get('ubicacion')
 
-            conn = get_mssql_connection()
+            conn = get_db()
             cur = conn.cursor()
             cur.execute("""
                 INSERT INTO contenedores (IdTipoResiduo, Capacidad, IdUbicacion, IdEstado)
@@ -292,7 +784,9 @@ def crear_app():
             """, (int(tipo), int(capacidad), int(ubicacion), 1))
             conn.commit()
             cur.close()
-            conn.close()
+            cache.invalidate('contenedores')
+            versions.bump('contenedores')
+            container_map.invalidate()
             return {'success': True, 'message': 'Contenedor agregado'}, 200
         except Exception as e:
             return {'success': False, 'message': str(e)}, 400
@@ -305,7 +799,7 @@ def crear_app():
             modelo = request.form.get('modelo')
             contenedor = request.form.get('contenedor')
 
-            conn = get_mssql_connection()
+            conn = get_db()
             cur = conn.cursor()
             cur.execute("""
                 INSERT INTO sensores (IdTipoSensor, Modelo, IdContenedor, IdEstado, FechaInstalacion)
@@ -314,86 +808,174 @@ def crear_app():
 
             conn.commit()
             cur.close()
-            conn.close()
+            sensors.invalidate()
+            cache.invalidate('sensores')
+            versions.bump('sensores')
             return {'success': True, 'message': 'Sensor agregado'}, 200
         except Exception as e:
             return {'success': False, 'message': str(e)}, 400
 
+    # ========= INGESTA MASIVA DE MEDICIONES =========
+    @app.route('/mediciones/ingest', methods=['POST'])
+    def ingest_mediciones():
+        max_rows = app.config['INGEST_MAX_ROWS']
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            objects = iter_ndjson(request.get_data().splitlines())
+        else:
+            data = request.get_json(silent=True)
+            if not isinstance(data, list):
+                return {'success': False, 'message': 'Se esperaba un arreglo JSON o NDJSON'}, 400
+            objects = enumerate(data, 1)
+
+        batch = []
+        for item in objects:
+            if len(batch) == max_rows:
+                return {'success': False, 'message': f'Máximo {max_rows} lecturas por petición'}, 413
+            batch.append(item)
+
+        conn = get_db()
+        try:
+            rows, rejected = validate(batch, conn, sensors)
+            flagged = 0
+            if rows:
+                detector.ensure_loaded(conn)
+                flagged = detector.mark(rows)
+            inserted = insert_readings(conn, rows, rollups, detector,
+                                       batch_size=app.config['INGEST_BATCH_SIZE']) if rows else 0
+        except Exception as e:
+            return {'success': False, 'message': str(e)}, 400
+        if rows:
+            # Ya confirmadas: el detector suma el lote a su estado aquí
+            notify_mediciones(rows)
+        return {
+            'success': True,
+            'received': len(batch),
+            'inserted': inserted,
+            'anomalies': flagged,
+            'rejected': rejected,
+        }, 200
+
+    def csv_response(chunks, filename, args):
+        if args.get('gzip') in ('1', 'true'):
+            return app.response_class(
+                response=gzip_chunks(chunks),
+                mimetype='application/gzip',
+                headers={'Content-Disposition': f'attachment; filename="{filename}.gz"'}
+            )
+        return app.response_class(
+            response=chunks,
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+
     # ========= EXPORTAR CSV CONTENEDORES =========
     @app.route('/contenedores/exportar_csv')
+    @conditional('contenedores', 'tiposresiduos', 'ubicaciones', 'sensores', 'mediciones', 'mediciones_rollup')
     def exportar_contenedores_csv():
-        import csv
-        from io import StringIO
-
         try:
-            conn = get_mssql_connection()
-            cur = DictCursor(conn.cursor())
-
-            cur.execute("""
-                SELECT c.IdContenedor AS id, t.TipoResiduo AS tipo, c.Capacidad AS capacidad, 
-                    u.Direccion AS ubicacion,
-                    ROUND(AVG(m.PorcentajeLlenado), 1) AS promedio_llenado
-                FROM contenedores c
-                JOIN tiposresiduos t ON c.IdTipoResiduo = t.IdTipoResiduo
-                JOIN ubicaciones u ON c.IdUbicacion = u.IdUbicacion
-                LEFT JOIN sensores s ON s.IdContenedor = c.IdContenedor
-                LEFT JOIN mediciones m ON m.IdSensor = s.IdSensor
-                GROUP BY c.IdContenedor, t.TipoResiduo, u.Direccion, c.Capacidad
-                ORDER BY c.IdContenedor ASC
-            """)
-            data = cur.fetchall()
-
-            cur.close()
-            conn.close()
-
-            output = StringIO()
-            writer = csv.DictWriter(output, fieldnames=['id', 'tipo', 'capacidad', 'ubicacion', 'promedio_llenado'])
-            writer.writeheader()
-            writer.writerows(data)
-
-            return app.response_class(
-                response=output.getvalue(),
-                mimetype='text/csv',
-                headers={'Content-Disposition': 'attachment; filename="contenedores.csv"'}
-            )
-        except Exception as e:
+            desde, hasta = parse_date_range(request.args)
+            contenedor = request.args.get('idContenedor') or None
+
+            join_params, where_params = [], []
+            join_extra = ""
+            # Los filtros son por día completo: salen exactos de los agregados diarios
+            if desde:
+                join_extra += " AND r.Periodo >= ?"
+                join_params.append(desde)
+            if hasta:
+                join_extra += " AND r.Periodo < ?"
+                join_params.append(hasta)
+            where = ""
+            if contenedor:
+                where = "WHERE c.IdContenedor = ?"
+                where_params.append(int(contenedor))
+        except ValueError as e:
             return {'error': str(e)}, 400
 
+        sql = f"""
+            SELECT c.IdContenedor AS id, c.IdTipoResiduo AS tipo, c.Capacidad AS capacidad, 
+                c.IdUbicacion AS ubicacion,
+                ROUND(SUM(r.SumaLlenado) / NULLIF(SUM(r.NLlenado), 0), 1) AS promedio_llenado
+            FROM contenedores c
+            LEFT JOIN sensores s ON s.IdContenedor = c.IdContenedor
+            LEFT JOIN mediciones_rollup r ON r.IdSensor = s.IdSensor AND r.Granularidad = 'D'{join_extra}
+            {where}
+            GROUP BY c.IdContenedor, c.IdTipoResiduo, c.IdUbicacion, c.Capacidad
+            ORDER BY c.IdContenedor ASC
+        """
+        reference.ensure_loaded(get_db())
+        tipos, ubicaciones = reference.tipos_residuo, reference.ubicaciones
+
+        def names(rows):
+            return [(i, tipos[t], cap, ubicaciones[u], avg) for i, t, cap, u, avg in rows
+                    if t in tipos and u in ubicaciones]
+
+        header = ['id', 'tipo', 'capacidad', 'ubicacion', 'promedio_llenado']
+        chunks = stream_query(
+            pool, sql, tuple(join_params + where_params),
+            lambda cur, n: iter_csv(cur, header, n, transform=names),
+            batch_size=app.config['EXPORT_BATCH_SIZE'],
+        )
+        return csv_response(chunks, 'contenedores.csv', request.args)
+
     # ========= EXPORTAR CSV MEDICIONES =========
+    def mediciones_export_sql(where):
+        return f"""
+            SELECT m.IdMedicion AS id, s.IdSensor AS sensor, m.FechaHora AS fecha_hora, 
+                m.PorcentajeLlenado AS porcentaje, m.PesoKg AS peso, m.Temperatura AS temp
+            FROM mediciones m
+            JOIN sensores s ON m.IdSensor = s.IdSensor
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY m.FechaHora DESC, m.IdMedicion DESC
+        """
+
     @app.route('/mediciones/exportar_csv')
+    @conditional('mediciones', 'sensores')
     def exportar_mediciones_csv():
-        import csv
-        from io import StringIO
-
         try:
-            conn = get_mssql_connection()
-            cur = DictCursor(conn.cursor())
-
-            cur.execute("""
-                SELECT TOP 5000 m.IdMedicion AS id, s.IdSensor AS sensor, m.FechaHora AS fecha_hora, 
-                    m.PorcentajeLlenado AS porcentaje, m.PesoKg AS peso, m.Temperatura AS temp
-                FROM mediciones m
-                JOIN sensores s ON m.IdSensor = s.IdSensor
-                ORDER BY m.FechaHora DESC
-            """)
-            data = cur.fetchall()
-
-            cur.close()
-            conn.close()
+            where, params = mediciones_filters(request.args)
+        except ValueError as e:
+            return {'error': str(e)}, 400
 
-            output = StringIO()
-            writer = csv.DictWriter(output, fieldnames=['id', 'sensor', 'fecha_hora', 'porcentaje', 'peso', 'temp'])
-            writer.writeheader()
-            writer.writerows(data)
+        header = ['id', 'sensor', 'fecha_hora', 'porcentaje', 'peso', 'temp']
+        archived = archived_mediciones(request.args)
+        chunks = stream_query(
+            pool, mediciones_export_sql(where), tuple(params),
+            lambda cur, n: iter_csv(TieredCursor(cur, archived, batch_size=n), header, n),
+            batch_size=app.config['EXPORT_BATCH_SIZE'],
+        )
+        return csv_response(chunks, 'mediciones.csv', request.args)
 
-            return app.response_class(
-                response=output.getvalue(),
-                mimetype='text/csv',
-                headers={'Content-Disposition': 'attachment; filename="mediciones.csv"'}
-            )
-        except Exception as e:
+    # ========= EXPORTAR MEDICIONES EN FORMATO COLUMNAR =========
+    @app.route('/mediciones/exportar_parquet', defaults={'fmt': 'parquet'})
+    @app.route('/mediciones/exportar_arrow', defaults={'fmt': 'arrow'})
+    @conditional('mediciones', 'sensores')
+    def exportar_mediciones_columnar(fmt):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return {'error': 'La exportación columnar requiere pyarrow'}, 501
+        try:
+            where, params = mediciones_filters(request.args)
+        except ValueError as e:
             return {'error': str(e)}, 400
 
+        archived = archived_mediciones(request.args)
+        chunks = stream_query(
+            pool, mediciones_export_sql(where), tuple(params),
+            lambda cur, n: iter_columnar(TieredCursor(cur, archived, batch_size=n), fmt, n),
+            batch_size=app.config['COLUMNAR_BATCH_SIZE'],
+        )
+        if fmt == 'parquet':
+            mimetype, filename = 'application/vnd.apache.parquet', 'mediciones.parquet'
+        else:
+            mimetype, filename = 'application/vnd.apache.arrow.stream', 'mediciones.arrows'
+        return app.response_class(
+            response=chunks,
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+
     return app
 
 
@@ -0,0 +1,199 @@
+"""
+Modo de servicio ASGI de SisResiduos, para mucha concurrencia.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+
+La aplicación es la misma de crear_app(). Cada petición HTTP se ejecuta en
+un pool acotado de hilos (ASGI_WORKER_THREADS) mientras el event loop sólo
+espera: una petición lenta o en cola ocupa una corrutina y no un hilo del
+servidor. Las respuestas en streaming (exportaciones) avanzan por bloques en
+ese mismo pool y dejan de producirse si el cliente se desconecta.
+
+/eventos se atiende directamente en el event loop. Cada cliente SSE tiene
+una cola asyncio que alimenta el Broker (AsyncSubscription), así que
+mantener miles de clientes conectados no consume hilos; el límite es
+SSE_MAX_CLIENTS.
+"""
+import asyncio
+import contextvars
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from app import crear_app
+from realtime import AsyncSubscription, TooManyClients
+
+# Bytes que se acumulan por cada paso por el pool antes de enviarlos
+STREAM_CHUNK = 64 * 1024
+
+
+def wsgi_environ(scope, body):
+    """Entorno WSGI equivalente a un scope HTTP de ASGI."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else 'HTTP_' + name
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _pull(chunks, limit=STREAM_CHUNK):
+    """Lee del iterable WSGI hasta `limit` bytes; (datos, terminó)."""
+    parts, size = [], 0
+    for chunk in chunks:
+        if chunk:
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= limit:
+                return b''.join(parts), False
+    return b''.join(parts), True
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+class AsgiApp:
+    def __init__(self, flask_app, threads=None):
+        self.flask_app = flask_app
+        self.broker = flask_app.extensions['sse_broker']
+        self.heartbeat = flask_app.config['SSE_HEARTBEAT']
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads or flask_app.config['ASGI_WORKER_THREADS'],
+            thread_name_prefix='asgi',
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            if scope['path'] == '/eventos' and scope['method'] == 'GET':
+                await self._eventos(receive, send)
+            else:
+                await self._wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.flask_app.extensions['query_executor'].shutdown()
+                self.flask_app.extensions['db_pool'].close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # ----- aplicación Flask en el pool de hilos -----
+    async def _wsgi(self, scope, receive, send):
+        parts = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            parts.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        environ = wsgi_environ(scope, b''.join(parts))
+
+        loop = asyncio.get_running_loop()
+        # Todos los pasos de la petición comparten un contexto: las métricas
+        # por petición (contextvars) siguen a la respuesta aunque cambie de hilo
+        ctx = contextvars.copy_context()
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(' ', 1)[0]),
+                          [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]]
+            return lambda data: None
+
+        def call():
+            result = self.flask_app(environ, start_response)
+            chunks = iter(result)
+            return result, chunks, _pull(chunks)
+
+        def run(fn, *args):
+            return loop.run_in_executor(self.executor, ctx.run, fn, *args)
+
+        result, chunks, (data, done) = await run(call)
+        disconnect = loop.create_task(_wait_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+            while not done and not disconnect.done():
+                if data:
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                data, done = await run(_pull, chunks)
+            if not disconnect.done():
+                await send({'type': 'http.response.body', 'body': data, 'more_body': False})
+        finally:
+            disconnect.cancel()
+            if hasattr(result, 'close'):
+                await run(result.close)
+
+    # ----- SSE en el event loop -----
+    async def _eventos(self, receive, send):
+        loop = asyncio.get_running_loop()
+        try:
+            sub = self.broker.subscribe(AsyncSubscription(loop, self.broker.max_queue))
+        except TooManyClients as e:
+            await send({'type': 'http.response.start', 'status': 503,
+                        'headers': [(b'content-type', b'application/json')]})
+            await send({'type': 'http.response.body', 'body': json.dumps({'error': str(e)}).encode()})
+            return
+
+        disconnect = loop.create_task(_wait_disconnect(receive))
+        get = None
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+            while True:
+                if get is None:
+                    get = loop.create_task(sub.queue.get())
+                done, _ = await asyncio.wait((get, disconnect), timeout=self.heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnect in done:
+                    break
+                if get in done:
+                    message, get = get.result(), None
+                else:
+                    message = ": ping\n\n"
+                await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+        finally:
+            disconnect.cancel()
+            if get is not None:
+                get.cancel()
+            self.broker.unsubscribe(sub)
+
+
+app = AsgiApp(crear_app())
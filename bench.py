@@ -0,0 +1,718 @@
+#!/usr/bin/env python3
+"""
+Benchmark reproducible de SisResiduos sobre el sustituto SQLite.
+
+    python bench.py generate --db bench.db --containers 10000 --readings 50000000
+    python bench.py run --db bench.db --requests 50
+    python bench.py compare bench_results/A.json bench_results/B.json
+    python bench.py http --db bench.db --latency-ms 20 --clients 1000 --sse 500
+    python bench.py load --db bench.db --rows 2000000 --workers 0 --workers 4
+
+`generate` crea una flota sintética (determinista con --seed) con el mismo
+esquema que SQL Server y recalcula los agregados. `run` recorre todas las
+rutas de crear_app() con el cliente de pruebas de Flask y guarda p50/p99,
+throughput y pico de memoria en bench_results/ para comparar corridas.
+`http` levanta el servidor real en modo sync (gunicorn gthread, como el
+Dockerfile) y en modo ASGI (uvicorn asgi:app) y los somete a la misma carga
+concurrente de lecturas e ingesta con clientes SSE conectados.
+`load` escribe un CSV histórico con el formato de /mediciones/exportar_csv
+y lo carga con loader.py en copias de la base, una por número de workers.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from db import SQLiteBackend
+from inspect_schema import migrate
+from rollups import RollupStore
+
+WASTE_TYPES = ['Orgánico', 'Plástico', 'Vidrio', 'Papel y cartón', 'Metales']
+SENSOR_TYPES = ['Ultrasónico', 'Peso', 'Temperatura']
+
+# Centro aproximado de Bogotá; la flota se reparte en ~20 km alrededor
+CENTER = (4.65, -74.08)
+SPREAD = 0.18
+
+
+# ========= GENERADOR DE FLOTA =========
+def generate_fleet(path, containers=1000, sensors_per_container=1, readings=1_000_000,
+                   interval_minutes=15, seed=42, batch_size=50_000, indexes=True, log=print):
+    """Crea `path` desde cero con una flota sintética y devuelve sus parámetros.
+
+    Las lecturas se generan por instantes de tiempo (todas los sensores en
+    cada paso) hasta completar `readings`, terminando en la hora actual. El
+    llenado de cada contenedor sube a una tasa propia y se vacía al pasar
+    del 95%, así que las series tienen la forma de diente de sierra real.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    backend = SQLiteBackend(path)
+    backend.create_schema()
+    conn = backend.connect()
+    conn.execute('PRAGMA synchronous=OFF')
+    cur = conn.cursor()
+
+    cur.executemany("INSERT INTO tiposresiduos VALUES (?, ?)", list(enumerate(WASTE_TYPES, 1)))
+    cur.executemany("INSERT INTO tipossensores VALUES (?, ?)", list(enumerate(SENSOR_TYPES, 1)))
+    cur.executemany("INSERT INTO ubicaciones VALUES (?, ?, ?, ?)", [
+        (i, f"Calle {rng.randint(1, 200)} # {rng.randint(1, 120)}-{rng.randint(1, 99)}",
+         CENTER[0] + rng.uniform(-SPREAD, SPREAD), CENTER[1] + rng.uniform(-SPREAD, SPREAD))
+        for i in range(1, containers + 1)
+    ])
+    cur.executemany("INSERT INTO contenedores VALUES (?, ?, ?, ?, ?)", [
+        (i, rng.randint(1, len(WASTE_TYPES)), rng.choice([240, 360, 660, 1100, 3200]), i, 1)
+        for i in range(1, containers + 1)
+    ])
+    sensors = []
+    for c in range(1, containers + 1):
+        for _ in range(sensors_per_container):
+            sensors.append((len(sensors) + 1, rng.randint(1, len(SENSOR_TYPES)), f"SR-{rng.randint(100, 999)}",
+                            c, 1, '2024-01-01'))
+    cur.executemany("INSERT INTO sensores VALUES (?, ?, ?, ?, ?, ?)", sensors)
+    conn.commit()
+
+    n_sensors = len(sensors)
+    steps = max(1, math.ceil(readings / n_sensors))
+    interval = timedelta(minutes=interval_minutes)
+    start = datetime.now().replace(second=0, microsecond=0) - interval * steps
+    rate = [rng.uniform(0.05, 1.5) for _ in range(n_sensors)]
+    fill = [rng.uniform(0, 90) for _ in range(n_sensors)]
+    temp_base = [rng.uniform(12, 24) for _ in range(n_sensors)]
+
+    sql = ("INSERT INTO mediciones (IdSensor, FechaHora, PorcentajeLlenado, PesoKg, Temperatura) "
+           "VALUES (?, ?, ?, ?, ?)")
+    batch, written = [], 0
+    started = time.perf_counter()
+    for step in range(steps):
+        ts = (start + interval * step).isoformat(' ')
+        hour_wave = 4 * math.sin((step * interval_minutes / 60 - 9) / 24 * 2 * math.pi)
+        for s in range(n_sensors):
+            if written + len(batch) >= readings:
+                break
+            f = fill[s] + rate[s] * rng.uniform(0.5, 1.5)
+            if f > 95:
+                f = rng.uniform(0, 5)
+            fill[s] = f
+            batch.append((s + 1, ts, round(f, 2), round(f * 0.8, 2),
+                          round(temp_base[s] + hour_wave + rng.gauss(0, 0.5), 2)))
+        if len(batch) >= batch_size or step == steps - 1:
+            cur.executemany(sql, batch)
+            written += len(batch)
+            batch = []
+            conn.commit()
+            if log:
+                log(f"  mediciones: {written:,}/{readings:,} "
+                    f"({written / (time.perf_counter() - started):,.0f} filas/s)")
+    conn.commit()
+
+    if log:
+        log("  recalculando agregados...")
+    RollupStore(backend).rebuild(conn)
+    if indexes:
+        if log:
+            log("  creando índices...")
+        migrate(conn, backend.name)
+    conn.close()
+    return {
+        'containers': containers,
+        'sensors': n_sensors,
+        'readings': written,
+        'interval_minutes': interval_minutes,
+        'seed': seed,
+    }
+
+
+# ========= CASOS DE LA CORRIDA =========
+def fleet_info(path):
+    backend = SQLiteBackend(path)
+    conn = backend.connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*), MIN(IdSensor), MAX(IdSensor) FROM sensores")
+        n_sensors, min_sensor, max_sensor = cur.fetchone()
+        cur.execute("SELECT COUNT(*) FROM contenedores")
+        n_containers = cur.fetchone()[0]
+        cur.execute("SELECT MAX(FechaHora) FROM mediciones")
+        last = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*) FROM mediciones")
+        n_readings = cur.fetchone()[0]
+    finally:
+        conn.close()
+    last = datetime.fromisoformat(str(last)) if last else datetime.now()
+    return {
+        'containers': n_containers,
+        'sensors': n_sensors,
+        'readings': n_readings,
+        'sensor_range': (min_sensor, max_sensor),
+        'last_day': last.date(),
+    }
+
+
+def build_cases(client, info, ingest_size=1000, seed=7):
+    """Lista de (nombre, función que hace una petición y devuelve la respuesta)."""
+    rng = random.Random(seed)
+    last_day = info['last_day'].isoformat()
+    lo, hi = info['sensor_range']
+
+    def get(url, stream=False, headers=None):
+        def run():
+            resp = client.get(url, buffered=not stream, headers=headers)
+            if stream:
+                # Consumir la respuesta en streaming para medir el trabajo completo
+                for _ in resp.response:
+                    pass
+            return resp
+        return run
+
+    def deep_page():
+        first = client.get('/mediciones/data?length=25').get_json()
+        cursor = first['last']
+        for _ in range(20):
+            page = client.get('/mediciones/data', query_string={'length': 25, 'after': cursor}).get_json()
+            cursor = page['last'] or cursor
+        return client.get('/mediciones/data', query_string={'length': 25, 'after': cursor})
+
+    def ingest():
+        now = datetime.now()
+        body = '\n'.join(json.dumps({
+            'sensor': rng.randint(lo, hi),
+            'fecha_hora': (now - timedelta(seconds=rng.randint(0, 3600))).isoformat(),
+            'porcentaje': round(rng.uniform(0, 100), 2),
+            'peso': round(rng.uniform(0, 80), 2),
+            'temp': round(rng.uniform(10, 30), 2),
+        }) for _ in range(ingest_size))
+        return client.post('/mediciones/ingest', data=body, content_type='application/x-ndjson')
+
+    def revalidate(url):
+        """GET condicional con el último ETag recibido (304 si no cambió)."""
+        etag = None
+
+        def run():
+            nonlocal etag
+            resp = client.get(url, headers={'If-None-Match': etag} if etag else None)
+            etag = resp.headers.get('ETag', etag)
+            return resp
+        return run
+
+    def eventos():
+        resp = client.get('/eventos', buffered=False)
+        next(iter(resp.response))
+        resp.close()
+        return resp
+
+    cases = [
+        ('GET /', get('/')),
+        ('GET /dashboard', get('/dashboard')),
+        ('GET /contenedores', get('/contenedores')),
+        ('GET /contenedores (304)', revalidate('/contenedores')),
+        ('GET /contenedores (br)', get('/contenedores', headers={'Accept-Encoding': 'br, gzip'})),
+        ('GET /contenedores/pronostico', get('/contenedores/pronostico')),
+        ('GET /rutas', get('/rutas?horizonte=24')),
+        ('GET /mapa/contenedores (ciudad)', get('/mapa/contenedores?bbox=-74.4,4.3,-73.8,5.0&zoom=11')),
+        ('GET /mapa/contenedores (detalle)', get('/mapa/contenedores?bbox=-74.095,4.635,-74.065,4.665&zoom=16')),
+        ('GET /sensores', get('/sensores')),
+        ('GET /mediciones', get('/mediciones')),
+        ('GET /mediciones/data', get('/mediciones/data?length=25')),
+        ('GET /mediciones/data (página 21)', deep_page),
+        ('GET /mediciones/data (filtros)', get(f'/mediciones/data?length=25&desde={last_day}&idContenedor=1')),
+        ('GET /contenedores/exportar_csv', get('/contenedores/exportar_csv', stream=True)),
+        ('GET /mediciones/exportar_csv (1 día)', get(f'/mediciones/exportar_csv?desde={last_day}', stream=True)),
+        ('GET /mediciones/exportar_csv (1 día, 304)', revalidate(f'/mediciones/exportar_csv?desde={last_day}')),
+        ('GET /mediciones/exportar_csv (1 día, gzip)', get(f'/mediciones/exportar_csv?desde={last_day}',
+                                                          stream=True, headers={'Accept-Encoding': 'gzip'})),
+        ('GET /mediciones/exportar_parquet (1 día)', get(f'/mediciones/exportar_parquet?desde={last_day}', stream=True)),
+        ('GET /mediciones/exportar_arrow (1 día)', get(f'/mediciones/exportar_arrow?desde={last_day}', stream=True)),
+        ('GET /eventos (conexión)', eventos),
+        ('GET /stats', get('/stats')),
+        ('GET /metrics', get('/metrics')),
+        (f'POST /mediciones/ingest ({ingest_size} filas)', ingest),
+        ('POST /contenedores/agregar', lambda: client.post(
+            '/contenedores/agregar', data={'tipo_residuo': 1, 'capacidad': 660, 'ubicacion': 1})),
+        ('POST /sensores/agregar', lambda: client.post(
+            '/sensores/agregar', data={'tipo_sensor': 1, 'modelo': 'BENCH', 'contenedor': 1})),
+    ]
+    return cases
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    f = math.floor(k)
+    c = min(f + 1, len(ordered) - 1)
+    return ordered[f] + (ordered[c] - ordered[f]) * (k - f)
+
+
+def run_case(fn, requests, concurrency):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0)
+                  for i in range(concurrency)]
+
+    def worker(n):
+        nonlocal errors
+        for _ in range(n):
+            t0 = time.perf_counter()
+            resp = fn()
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies.append(elapsed)
+                if resp.status_code >= 400:
+                    errors += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in per_worker if n]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    return latencies, errors, wall
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run_benchmark(db_path, requests=20, concurrency=1, warmup=2, cache=True,
+                  ingest_size=1000, only=None, config=None, log=print):
+    from app import crear_app
+
+    app_config = {'DB_BACKEND': 'sqlite', 'SQLITE_PATH': db_path}
+    if not cache:
+        app_config['QUERY_CACHE_MAX_ENTRIES'] = 0
+    app_config.update(config or {})
+    app = crear_app(app_config)
+    client = app.test_client()
+    info = fleet_info(db_path)
+
+    results = []
+    exercised = set()
+    for name, fn in build_cases(client, info, ingest_size):
+        if only and only not in name:
+            continue
+        for _ in range(warmup):
+            fn()
+        latencies, errors, wall = run_case(fn, requests, concurrency)
+        peak = peak_memory(fn)
+        row = {
+            'case': name,
+            'requests': len(latencies),
+            'errors': errors,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'throughput_rps': round(len(latencies) / wall, 2),
+            'peak_alloc_kb': round(peak / 1024, 1),
+        }
+        results.append(row)
+        exercised.add(name.split(' ')[1])
+        if log:
+            log(f"  {name:45} p50 {row['p50_ms']:9.2f} ms  p99 {row['p99_ms']:9.2f} ms  "
+                f"{row['throughput_rps']:9.1f} req/s  pico {row['peak_alloc_kb']:9.1f} KiB"
+                + (f"  errores {errors}" if errors else ""))
+
+    routes = {r.rule for r in app.url_map.iter_rules() if r.endpoint != 'static'}
+    missing = sorted(routes - exercised)
+    if missing and not only and log:
+        log(f"  [aviso] rutas sin caso de benchmark: {', '.join(missing)}")
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'fleet': {k: (v.isoformat() if hasattr(v, 'isoformat') else v) for k, v in info.items()},
+        'settings': {'requests': requests, 'concurrency': concurrency, 'warmup': warmup,
+                     'cache': cache, 'ingest_size': ingest_size},
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'results': results,
+    }
+
+
+def save_results(report, out_dir='bench_results'):
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = report['timestamp'].replace(':', '').replace('-', '')
+    path = os.path.join(out_dir, f"{stamp}-{report['git'] or 'local'}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return path
+
+
+def compare(path_a, path_b):
+    with open(path_a, encoding='utf-8') as f:
+        a = {r['case']: r for r in json.load(f)['results']}
+    with open(path_b, encoding='utf-8') as f:
+        b = {r['case']: r for r in json.load(f)['results']}
+    print(f"{'caso':45} {'p50 A':>10} {'p50 B':>10} {'Δ%':>8} {'p99 A':>10} {'p99 B':>10} {'Δ%':>8}")
+    for case in [c for c in a if c in b and 'p50_ms' in a[c]]:
+        ra, rb = a[case], b[case]
+        d50 = (rb['p50_ms'] / ra['p50_ms'] - 1) * 100 if ra['p50_ms'] else 0
+        d99 = (rb['p99_ms'] / ra['p99_ms'] - 1) * 100 if ra['p99_ms'] else 0
+        print(f"{case:45} {ra['p50_ms']:10.2f} {rb['p50_ms']:10.2f} {d50:+8.1f} "
+              f"{ra['p99_ms']:10.2f} {rb['p99_ms']:10.2f} {d99:+8.1f}")
+    for case in [c for c in a if c in b and 'rows_s' in a[c]]:
+        ra, rb = a[case], b[case]
+        d = (rb['rows_s'] / ra['rows_s'] - 1) * 100 if ra['rows_s'] else 0
+        print(f"{case:45} {ra['rows_s']:10.0f} {rb['rows_s']:10.0f} {d:+8.1f}  filas/s")
+
+
+# ========= SERVIDOR REAL: SYNC VS ASGI =========
+HTTP_READS = [
+    '/mediciones/data?length=25',
+    '/stats',
+    '/contenedores/pronostico',
+    '/mapa/contenedores?bbox=-74.4,4.3,-73.8,5.0&zoom=11',
+]
+
+
+def server_command(mode, port, threads):
+    if mode == 'sync':
+        return [sys.executable, '-m', 'gunicorn', '-b', f'127.0.0.1:{port}', '--worker-class', 'gthread',
+                '--threads', str(threads), '--backlog', '4096', 'app:crear_app()']
+    return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+            '--backlog', '4096', '--log-level', 'warning', '--no-access-log']
+
+
+def tree_rss_kb(pid):
+    """RSS del proceso y sus hijos (los workers de gunicorn)."""
+    try:
+        out = subprocess.check_output(['ps', '-o', 'rss=', '-p', str(pid), '--ppid', str(pid)])
+        return sum(int(v) for v in out.split())
+    except Exception:
+        return None
+
+
+async def _request(port, method, path, body=b'', content_type='application/x-ndjson', timeout=60):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        head = f"{method} {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n"
+        if body:
+            head += f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+        writer.write(head.encode() + b'\r\n' + body)
+        await writer.drain()
+        status = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(status.split()[1])
+    finally:
+        writer.close()
+
+
+async def _sse_client(port, connected, stop, timeout):
+    """Se conecta a /eventos y mantiene la conexión hasta `stop`."""
+    t0 = time.perf_counter()
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except OSError:
+        return None
+    try:
+        writer.write(b"GET /eventos HTTP/1.1\r\nHost: bench\r\n\r\n")
+        await writer.drain()
+        status = await asyncio.wait_for(reader.readline(), timeout)
+        if b' 200 ' not in status:
+            return None
+        while b'retry' not in await asyncio.wait_for(reader.readline(), timeout):
+            pass
+        connected.append(time.perf_counter() - t0)
+        await stop.wait()
+        return True
+    except (asyncio.TimeoutError, OSError):
+        return None
+    finally:
+        writer.close()
+
+
+async def _http_load(port, info, requests, clients, sse, ingest_every, ingest_size, timeout, seed):
+    rng = random.Random(seed)
+    lo, hi = info['sensor_range']
+    stop = asyncio.Event()
+    connected = []
+    sse_tasks = [asyncio.create_task(_sse_client(port, connected, stop, timeout)) for _ in range(sse)]
+    # Dar tiempo a que los clientes SSE se conecten antes de medir
+    deadline = time.perf_counter() + timeout
+    while len(connected) < sse and time.perf_counter() < deadline and not all(t.done() for t in sse_tasks):
+        await asyncio.sleep(0.1)
+
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+
+    def ingest_body():
+        now = datetime.now()
+        return '\n'.join(json.dumps({
+            'sensor': rng.randint(lo, hi),
+            'fecha_hora': (now - timedelta(seconds=rng.randint(0, 3600))).isoformat(),
+            'porcentaje': round(rng.uniform(0, 100), 2),
+        }) for _ in range(ingest_size)).encode()
+
+    async def client():
+        nonlocal errors
+        for n in counter:
+            t0 = time.perf_counter()
+            try:
+                if ingest_every and n % ingest_every == 0:
+                    status = await _request(port, 'POST', '/mediciones/ingest', ingest_body(), timeout=timeout)
+                else:
+                    status = await _request(port, 'GET', HTTP_READS[n % len(HTTP_READS)], timeout=timeout)
+            except (asyncio.TimeoutError, OSError, IndexError, ValueError):
+                status = 599
+            latencies.append(time.perf_counter() - t0)
+            if status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    wall = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*sse_tasks)
+    return latencies, errors, wall, connected
+
+
+def run_http_benchmark(db_path, modes=('sync', 'asgi'), requests=2000, clients=500, sse=500,
+                       latency_ms=20, threads=100, ingest_every=10, ingest_size=20,
+                       timeout=60, port=8765, log=print):
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+    info = fleet_info(db_path)
+    env = dict(os.environ, DB_BACKEND='sqlite', SQLITE_PATH=os.path.abspath(db_path),
+               SQLITE_LATENCY_MS=str(latency_ms), SSE_MAX_CLIENTS=str(max(sse * 2, 500)))
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    results = []
+    for mode in modes:
+        proc = subprocess.Popen(server_command(mode, port, threads), cwd=here, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            ready = time.monotonic() + 60
+            while True:
+                try:
+                    if asyncio.run(_request(port, 'GET', '/stats', timeout=10)) == 200:
+                        break
+                except OSError:
+                    pass
+                if time.monotonic() > ready or proc.poll() is not None:
+                    raise RuntimeError(f"el servidor {mode} no arrancó")
+                time.sleep(0.2)
+
+            latencies, errors, wall, connected = asyncio.run(_http_load(
+                port, info, requests, clients, sse, ingest_every, ingest_size, timeout, seed=7))
+            row = {
+                'case': f'HTTP {mode}',
+                'requests': len(latencies),
+                'errors': errors,
+                'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+                'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+                'throughput_rps': round(len(latencies) / wall, 2),
+                'sse_connected': len(connected),
+                'sse_connect_p99_ms': round(percentile(connected, 99) * 1000, 3) if connected else None,
+                'server_rss_kb': tree_rss_kb(proc.pid),
+            }
+            results.append(row)
+            if log:
+                log(f"  {row['case']:10} p50 {row['p50_ms']:9.2f} ms  p99 {row['p99_ms']:9.2f} ms  "
+                    f"{row['throughput_rps']:8.1f} req/s  errores {errors:5}  "
+                    f"SSE {len(connected)}/{sse}  RSS {row['server_rss_kb']} KiB")
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'fleet': {k: (v.isoformat() if hasattr(v, 'isoformat') else v) for k, v in info.items()},
+        'settings': {'requests': requests, 'clients': clients, 'sse': sse, 'latency_ms': latency_ms,
+                     'threads': threads, 'ingest_every': ingest_every, 'ingest_size': ingest_size},
+        'results': results,
+    }
+
+
+# ========= CARGA MASIVA HISTÓRICA =========
+def write_history_csv(path, info, rows, interval_minutes=15, seed=42):
+    """CSV determinista con el formato de exportar_csv, anterior a la flota."""
+    rng = random.Random(seed)
+    first, last = info['sensor_range']
+    sensors = list(range(first, last + 1))
+    start = datetime.combine(info['last_day'], datetime.min.time()) - timedelta(days=365)
+    steps = max(1, rows // len(sensors))
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('id,sensor,fecha_hora,porcentaje,peso,temp\n')
+        n = 0
+        for step in range(steps + 1):
+            ts = (start + timedelta(minutes=interval_minutes * step)).isoformat(' ')
+            for sensor in sensors:
+                if n == rows:
+                    return
+                n += 1
+                f.write(f"{n},{sensor},{ts},{rng.uniform(0, 100):.2f},"
+                        f"{rng.uniform(0, 120):.2f},{rng.uniform(5, 35):.2f}\n")
+
+
+def run_load_benchmark(db_path, rows=1_000_000, workers=(0, 4), chunk_mb=16, log=print):
+    import shutil
+    import tempfile
+
+    import loader
+    from ingest import SensorDirectory
+
+    info = fleet_info(db_path)
+    tmp = tempfile.mkdtemp(prefix='bench_load_')
+    try:
+        csv_path = os.path.join(tmp, 'historico.csv')
+        write_history_csv(csv_path, info, rows)
+        size_mb = os.path.getsize(csv_path) / 2**20
+        if log:
+            log(f"  CSV de {rows:,} filas ({size_mb:,.0f} MB)")
+
+        results = []
+        for n in workers:
+            target = os.path.join(tmp, 'carga.db')
+            shutil.copyfile(db_path, target)
+            backend = SQLiteBackend(target)
+            conn = backend.connect()
+            try:
+                sensors = SensorDirectory().resolve(conn, ())
+                summary = loader.load_file(conn, csv_path, sensors, RollupStore(backend), workers=n,
+                                           chunk_bytes=int(chunk_mb * 2**20), checkpoint=False, log=None)
+            finally:
+                conn.close()
+                os.remove(target)
+            row = {
+                'case': f'LOAD workers={n}',
+                'rows': summary['insertadas'],
+                'rejected': summary['rechazadas'],
+                'seconds': summary['segundos'],
+                'rows_s': summary['filas_s'],
+                'mb_s': summary['mb_s'],
+            }
+            results.append(row)
+            if log:
+                log(f"  {row['case']:20} {row['seconds']:8.2f} s  {row['rows_s']:12,.0f} filas/s  "
+                    f"{row['mb_s']:7.2f} MB/s")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'fleet': {k: (v.isoformat() if hasattr(v, 'isoformat') else v) for k, v in info.items()},
+        'settings': {'rows': rows, 'workers': list(workers), 'chunk_mb': chunk_mb,
+                     'cpus': os.cpu_count()},
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    gen = sub.add_parser('generate', help='crear la flota sintética')
+    gen.add_argument('--db', default='bench.db')
+    gen.add_argument('--containers', type=int, default=1000)
+    gen.add_argument('--sensors-per-container', type=int, default=1)
+    gen.add_argument('--readings', type=int, default=1_000_000)
+    gen.add_argument('--interval-minutes', type=int, default=15)
+    gen.add_argument('--seed', type=int, default=42)
+    gen.add_argument('--no-indexes', action='store_true', help='no aplicar las migraciones de índices')
+
+    run = sub.add_parser('run', help='medir las rutas de la aplicación')
+    run.add_argument('--db', default='bench.db')
+    run.add_argument('--requests', type=int, default=20)
+    run.add_argument('--concurrency', type=int, default=1)
+    run.add_argument('--warmup', type=int, default=2)
+    run.add_argument('--no-cache', action='store_true', help='desactiva la caché de resultados')
+    run.add_argument('--ingest-size', type=int, default=1000)
+    run.add_argument('--only', help='sólo los casos cuyo nombre contenga este texto')
+    run.add_argument('--out', default='bench_results')
+
+    http = sub.add_parser('http', help='comparar el servidor sync (gunicorn) con el ASGI (uvicorn)')
+    http.add_argument('--db', default='bench.db')
+    http.add_argument('--mode', action='append', choices=['sync', 'asgi'],
+                      help='modo a medir (repetible; por defecto ambos)')
+    http.add_argument('--requests', type=int, default=2000)
+    http.add_argument('--clients', type=int, default=500, help='peticiones concurrentes')
+    http.add_argument('--sse', type=int, default=500, help='clientes /eventos conectados durante la carga')
+    http.add_argument('--latency-ms', type=float, default=20, help='latencia simulada por consulta')
+    http.add_argument('--threads', type=int, default=100, help='hilos del worker gthread (modo sync)')
+    http.add_argument('--ingest-every', type=int, default=10, help='una ingesta cada N peticiones (0: ninguna)')
+    http.add_argument('--ingest-size', type=int, default=20)
+    http.add_argument('--timeout', type=float, default=60)
+    http.add_argument('--port', type=int, default=8765)
+    http.add_argument('--out', default='bench_results')
+
+    load = sub.add_parser('load', help='medir la carga masiva de un CSV histórico (loader.py)')
+    load.add_argument('--db', default='bench.db')
+    load.add_argument('--rows', type=int, default=1_000_000)
+    load.add_argument('--workers', type=int, action='append',
+                      help='procesos de parseo a medir (repetible; por defecto 0 y 4)')
+    load.add_argument('--chunk-mb', type=float, default=16)
+    load.add_argument('--out', default='bench_results')
+
+    cmp_ = sub.add_parser('compare', help='comparar dos corridas guardadas')
+    cmp_.add_argument('a')
+    cmp_.add_argument('b')
+
+    args = parser.parse_args(argv)
+    if args.cmd == 'generate':
+        print(f"Generando flota en {args.db}...")
+        params = generate_fleet(args.db, args.containers, args.sensors_per_container,
+                                args.readings, args.interval_minutes, args.seed,
+                                indexes=not args.no_indexes)
+        print(f"[Done] {params}")
+    elif args.cmd == 'run':
+        print(f"Benchmark sobre {args.db}...")
+        report = run_benchmark(args.db, args.requests, args.concurrency, args.warmup,
+                               not args.no_cache, args.ingest_size, args.only)
+        print(f"[Done] resultados en {save_results(report, args.out)}")
+    elif args.cmd == 'http':
+        print(f"Servidor real sobre {args.db}...")
+        report = run_http_benchmark(args.db, args.mode or ('sync', 'asgi'), args.requests, args.clients,
+                                    args.sse, args.latency_ms, args.threads, args.ingest_every,
+                                    args.ingest_size, args.timeout, args.port)
+        print(f"[Done] resultados en {save_results(report, args.out)}")
+    elif args.cmd == 'load':
+        print(f"Carga masiva sobre una copia de {args.db}...")
+        report = run_load_benchmark(args.db, args.rows, args.workers or (0, 4), args.chunk_mb)
+        print(f"[Done] resultados en {save_results(report, args.out)}")
+    else:
+        compare(args.a, args.b)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
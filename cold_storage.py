@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Almacenamiento frío de mediciones antiguas (tabla caliente + archivos).
+
+La tabla mediciones sólo guarda lo reciente. El trabajo de retención mueve
+las lecturas con más de ARCHIVE_AFTER_DAYS días a un directorio por mes:
+
+    ARCHIVE_DIR/2024-05/
+        manifest.json                                    apunta a la generación vigente
+        g000002/
+            IdMedicion.npy IdSensor.npy FechaHora.npy PorcentajeLlenado.npy
+            PesoKg.npy Temperatura.npy Anomalia.npy      detalle (opcional)
+            resumen_Periodo.npy resumen_IdSensor.npy ... por hora y sensor
+
+Cada columna es un .npy que se abre con mmap: el detalle está ordenado por
+(FechaHora, IdMedicion), así que un rango de fechas es un searchsorted y
+sólo se leen las páginas de ese rango. El resumen tiene las columnas de
+mediciones_rollup (mismas reglas: sin temperaturas fuera de rango ni
+valores marcados por el detector de anomalías) y sirve para reconstruir los
+agregados aunque el detalle no se guarde (ARCHIVE_KEEP_FULL=0).
+
+Reescribir un mes crea una generación nueva y sólo después reemplaza
+manifest.json: los archivos que otros procesos tienen abiertos con mmap no
+se renombran ni se pisan (en Windows eso falla). La generación anterior se
+conserva hasta la reescritura siguiente, para los lectores que ya leyeron
+el manifest viejo; las más antiguas se borran entonces.
+
+Al archivar un mes se borran esas filas de mediciones y sus banderas de
+mediciones_anomalias (pasan a la columna Anomalia); mediciones_rollup no
+se toca, así que el dashboard no cambia. Las exportaciones y /mediciones/data
+leen la tabla y los archivos y los intercalan por (FechaHora, IdMedicion)
+(TieredCursor / merge_tiers): una lectura atrasada que llega a la tabla
+después de archivado su mes sale en su lugar hasta la siguiente compactación.
+
+    python cold_storage.py compact [--dias 90] [--sin-detalle]
+"""
+import heapq
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from anomalies import ANOMALIAS_JOIN, FILL_FLAGS, TEMP_FLAGS, TEMP_MAX, TEMP_MIN
+from rollups import CRITICAL_FILL
+
+DETAIL = (
+    ('IdMedicion', 'int64'),
+    ('IdSensor', 'int32'),
+    ('FechaHora', 'datetime64[us]'),
+    ('PorcentajeLlenado', 'float64'),
+    ('PesoKg', 'float64'),
+    ('Temperatura', 'float64'),
+    ('Anomalia', 'int16'),
+)
+
+SUMMARY = (
+    ('Periodo', 'datetime64[us]'),
+    ('IdSensor', 'int32'),
+    ('N', 'int64'),
+    ('NLlenado', 'int64'),
+    ('SumaLlenado', 'float64'),
+    ('MinLlenado', 'float64'),
+    ('MaxLlenado', 'float64'),
+    ('NCriticas', 'int64'),
+    ('NTemp', 'int64'),
+    ('SumaTemp', 'float64'),
+    ('MinTemp', 'float64'),
+    ('MaxTemp', 'float64'),
+)
+
+SELECT_SQL = f"""
+    SELECT m.IdMedicion, m.IdSensor, m.FechaHora, m.PorcentajeLlenado, m.PesoKg, m.Temperatura, a.Tipo
+    FROM mediciones m
+    {ANOMALIAS_JOIN}
+    WHERE m.FechaHora >= ? AND m.FechaHora < ?
+    ORDER BY m.FechaHora, m.IdMedicion
+"""
+
+DELETE_SQL = "DELETE FROM mediciones WHERE FechaHora >= ? AND FechaHora < ? AND IdMedicion <= ?"
+
+# Sólo las banderas cuya lectura ya no está en la tabla
+DELETE_FLAGS_SQL = """
+    DELETE FROM mediciones_anomalias
+    WHERE FechaHora >= ? AND FechaHora < ?
+        AND NOT EXISTS (SELECT 1 FROM mediciones m
+                        WHERE m.FechaHora = mediciones_anomalias.FechaHora
+                            AND m.IdSensor = mediciones_anomalias.IdSensor)
+"""
+
+
+def _month(dt):
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(dt):
+    return (_month(dt) + timedelta(days=32)).replace(day=1)
+
+
+def _nullable(values):
+    """Columna float -> lista de Python con None en lugar de NaN."""
+    out = values.astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
+
+
+def _group_starts(*keys):
+    change = np.zeros(len(keys[0]), dtype=bool)
+    change[0] = True
+    for k in keys:
+        change[1:] |= k[1:] != k[:-1]
+    return np.flatnonzero(change)
+
+
+def summarize(detail):
+    """Resumen por (hora, IdSensor) de columnas de detalle, como mediciones_rollup."""
+    if not len(detail['FechaHora']):
+        return {name: np.empty(0, dtype=kind) for name, kind in SUMMARY}
+    hour = detail['FechaHora'].astype('datetime64[h]')
+    sensor = detail['IdSensor']
+    order = np.lexsort((sensor, hour))
+    hour, sensor = hour[order], sensor[order]
+    fill, temp = detail['PorcentajeLlenado'][order], detail['Temperatura'][order]
+    flags = detail['Anomalia'][order]
+    with np.errstate(invalid='ignore'):
+        fill_ok = ~np.isnan(fill) & (flags & FILL_FLAGS == 0)
+        temp_ok = ~np.isnan(temp) & (temp > TEMP_MIN) & (temp < TEMP_MAX) & (flags & TEMP_FLAGS == 0)
+        critical = fill_ok & (fill > CRITICAL_FILL)
+    starts = _group_starts(hour, sensor)
+    f = np.where(fill_ok, fill, np.nan)
+    t = np.where(temp_ok, temp, np.nan)
+    n_fill = np.add.reduceat(fill_ok.astype(np.int64), starts)
+    n_temp = np.add.reduceat(temp_ok.astype(np.int64), starts)
+    return {
+        'Periodo': hour[starts].astype('datetime64[us]'),
+        'IdSensor': sensor[starts],
+        'N': np.diff(np.r_[starts, len(hour)]),
+        'NLlenado': n_fill,
+        'SumaLlenado': np.where(n_fill > 0, np.add.reduceat(np.nan_to_num(f), starts), np.nan),
+        'MinLlenado': np.fmin.reduceat(f, starts),
+        'MaxLlenado': np.fmax.reduceat(f, starts),
+        'NCriticas': np.add.reduceat(critical.astype(np.int64), starts),
+        'NTemp': n_temp,
+        'SumaTemp': np.where(n_temp > 0, np.add.reduceat(np.nan_to_num(t), starts), np.nan),
+        'MinTemp': np.fmin.reduceat(t, starts),
+        'MaxTemp': np.fmax.reduceat(t, starts),
+    }
+
+
+def merge_summaries(a, b):
+    """Combina dos resúmenes sumando los grupos (hora, sensor) repetidos."""
+    both = {name: np.concatenate([a[name], b[name]]) for name, _ in SUMMARY}
+    if not len(both['Periodo']):
+        return both
+    order = np.lexsort((both['IdSensor'], both['Periodo']))
+    both = {name: values[order] for name, values in both.items()}
+    starts = _group_starts(both['Periodo'], both['IdSensor'])
+    merged = {'Periodo': both['Periodo'][starts], 'IdSensor': both['IdSensor'][starts]}
+    for name in ('N', 'NLlenado', 'NCriticas', 'NTemp'):
+        merged[name] = np.add.reduceat(both[name], starts)
+    for name, count in (('SumaLlenado', 'NLlenado'), ('SumaTemp', 'NTemp')):
+        merged[name] = np.where(merged[count] > 0, np.add.reduceat(np.nan_to_num(both[name]), starts), np.nan)
+    for name in ('MinLlenado', 'MinTemp'):
+        merged[name] = np.fmin.reduceat(both[name], starts)
+    for name in ('MaxLlenado', 'MaxTemp'):
+        merged[name] = np.fmax.reduceat(both[name], starts)
+    return merged
+
+
+def merge_tiers(hot_rows, cold_rows, key, descending=True):
+    """Intercala filas de la tabla y del archivo, ambas ya ordenadas por
+    `key` (FechaHora, IdMedicion) en el mismo sentido."""
+    return heapq.merge(hot_rows, cold_rows, key=key, reverse=descending)
+
+
+def _fetched(cur, size):
+    while True:
+        rows = cur.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+
+class TieredCursor:
+    """Cursor de exportación: las filas de la tabla (tuplas id, sensor,
+    fecha_hora, ...) intercaladas con las del almacenamiento frío."""
+
+    def __init__(self, hot, cold_rows, descending=True, batch_size=5000):
+        self._rows = merge_tiers(_fetched(hot, batch_size), cold_rows,
+                                 key=lambda r: (r[2], r[0]), descending=descending)
+
+    def fetchmany(self, size):
+        return [row for _, row in zip(range(size), self._rows)]
+
+    def fetchall(self):
+        return list(self._rows)
+
+
+class ColdStore:
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._listed = None         # mtime del directorio al listar
+        self._periods = []          # nombres 'YYYY-MM' ordenados
+        self._open = {}             # nombre -> (mtime del manifest, manifest, columnas)
+
+    # ----- lectura -----
+    def periods(self):
+        try:
+            mtime = os.stat(self.root).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            if mtime != self._listed:
+                self._periods = sorted(
+                    name for name in os.listdir(self.root)
+                    if '.' not in name and os.path.isfile(os.path.join(self.root, name, 'manifest.json')))
+                self._listed = mtime
+            return list(self._periods)
+
+    def open(self, name):
+        """(manifest, {columna: array mmap}) de un periodo."""
+        path = os.path.join(self.root, name)
+        manifest_path = os.path.join(path, 'manifest.json')
+        mtime = os.stat(manifest_path).st_mtime_ns
+        with self._lock:
+            cached = self._open.get(name)
+            if cached is not None and cached[0] == mtime:
+                return cached[1], cached[2]
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        # Sin 'generacion': periodo escrito antes de las generaciones, con
+        # los .npy junto al manifest
+        files = os.path.join(path, manifest.get('generacion', ''))
+        columns = {}
+        for prefix, spec in (('', DETAIL if manifest['detalle'] else ()), ('resumen_', SUMMARY)):
+            for name_, _ in spec:
+                columns[prefix + name_] = np.load(os.path.join(files, f"{prefix}{name_}.npy"), mmap_mode='r')
+        with self._lock:
+            self._open[name] = (mtime, manifest, columns)
+        return manifest, columns
+
+    def horizon(self):
+        """Fin (exclusivo) de lo archivado, o None si no hay nada."""
+        names = self.periods()
+        return datetime.fromisoformat(self.open(names[-1])[0]['hasta']) if names else None
+
+    def rows(self, desde=None, hasta=None, sensors=None, descending=False, after=None, chunk=65536):
+        """Lecturas archivadas como tuplas (IdMedicion, IdSensor, FechaHora,
+        PorcentajeLlenado, PesoKg, Temperatura) en orden de (FechaHora,
+        IdMedicion), ascendente o descendente.
+
+        `sensors` limita a esos IdSensor; `after` es una clave (FechaHora,
+        IdMedicion) y deja sólo lo que viene después en el orden pedido, como
+        el cursor de /mediciones/data. Los periodos archivados sin detalle
+        no aportan filas.
+        """
+        wanted = None if sensors is None else np.fromiter(sensors, dtype=np.int64)
+        names = self.periods()
+        for name in (reversed(names) if descending else names):
+            manifest, cols = self.open(name)
+            if not manifest['detalle']:
+                continue
+            if (desde and datetime.fromisoformat(manifest['hasta']) <= desde) or \
+                    (hasta and datetime.fromisoformat(manifest['desde']) >= hasta):
+                continue
+            t = cols['FechaHora']
+            lo = np.searchsorted(t, np.datetime64(desde, 'us')) if desde else 0
+            hi = np.searchsorted(t, np.datetime64(hasta, 'us')) if hasta else len(t)
+            if after is not None:
+                at = np.datetime64(after[0], 'us')
+                if descending:
+                    hi = min(hi, np.searchsorted(t, at, 'right'))
+                else:
+                    lo = max(lo, np.searchsorted(t, at, 'left'))
+            starts = range(lo, hi, chunk)
+            for a in (reversed(starts) if descending else starts):
+                b = min(a + chunk, hi)
+                mask = np.ones(b - a, dtype=bool)
+                if wanted is not None:
+                    mask &= np.isin(cols['IdSensor'][a:b], wanted)
+                if after is not None:
+                    tt, ids = t[a:b], cols['IdMedicion'][a:b]
+                    if descending:
+                        mask &= (tt < at) | ((tt == at) & (ids < after[1]))
+                    else:
+                        mask &= (tt > at) | ((tt == at) & (ids > after[1]))
+                idx = a + np.flatnonzero(mask)
+                if descending:
+                    idx = idx[::-1]
+                # Se convierte a objetos de Python de a poco: una página de
+                # /mediciones/data sólo consume unas decenas de filas
+                for i in range(0, len(idx), 1000):
+                    part = idx[i:i + 1000]
+                    yield from zip(
+                        cols['IdMedicion'][part].tolist(),
+                        cols['IdSensor'][part].tolist(),
+                        cols['FechaHora'][part].tolist(),
+                        _nullable(cols['PorcentajeLlenado'][part]),
+                        _nullable(cols['PesoKg'][part]),
+                        _nullable(cols['Temperatura'][part]),
+                    )
+
+    def summaries(self):
+        """Genera (nombre, resumen por hora y sensor) de cada periodo."""
+        for name in self.periods():
+            _, cols = self.open(name)
+            yield name, {n: cols['resumen_' + n] for n, _ in SUMMARY}
+
+    def stats(self):
+        names = self.periods()
+        manifests = [self.open(n)[0] for n in names]
+        return {
+            'periodos': len(names),
+            'lecturas': sum(m['lecturas'] for m in manifests),
+            'con_detalle': sum(m['detalle'] for m in manifests),
+            'hasta': manifests[-1]['hasta'] if manifests else None,
+        }
+
+    # ----- escritura -----
+    def _load_full(self, name):
+        """Columnas de un periodo en memoria (para reescribirlo) o None."""
+        if name not in self.periods():
+            return None, None, None
+        manifest, cols = self.open(name)
+        detail = {n: np.array(cols[n]) for n, _ in DETAIL} if manifest['detalle'] else None
+        summary = {n: np.array(cols['resumen_' + n]) for n, _ in SUMMARY}
+        return manifest, detail, summary
+
+    def write(self, name, detail, summary, manifest):
+        """Escribe el periodo en una generación nueva y cambia el manifest.
+
+        Los .npy vigentes no se renombran ni se sobrescriben (otro proceso
+        puede tenerlos mapeados). La generación que se reemplaza se conserva
+        hasta la escritura siguiente: un lector que ya leyó el manifest
+        anterior todavía puede abrir sus archivos. Las más viejas se borran
+        aquí; si alguna sigue abierta (Windows), en una escritura posterior.
+        """
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, 'manifest.json')
+        previous = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                # '' es el formato sin generaciones, con los .npy junto al manifest
+                previous = json.load(f).get('generacion', '')
+        generations = sorted(g for g in os.listdir(path) if g.startswith('g') and g[1:].isdigit())
+        generation = f"g{int(generations[-1][1:]) + 1 if generations else 1:06d}"
+        files = os.path.join(path, generation)
+        os.makedirs(files)
+        if detail is not None:
+            for n, kind in DETAIL:
+                np.save(os.path.join(files, f"{n}.npy"), np.ascontiguousarray(detail[n], dtype=kind))
+        for n, kind in SUMMARY:
+            np.save(os.path.join(files, f"resumen_{n}.npy"), np.ascontiguousarray(summary[n], dtype=kind))
+        tmp = manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(dict(manifest, generacion=generation), f, indent=2)
+        os.replace(tmp, manifest_path)
+        with self._lock:
+            # Este proceso suelta sus mmap de la generación anterior
+            self._open.pop(name, None)
+            self._listed = None
+        for entry in os.listdir(path):
+            target = os.path.join(path, entry)
+            if entry in generations and entry != previous:
+                shutil.rmtree(target, ignore_errors=True)
+            elif entry.endswith('.npy') and previous != '':
+                try:
+                    os.remove(target)
+                except OSError:
+                    pass
+
+
+def _read_detail(cur, start, end, batch_size):
+    cur.execute(SELECT_SQL, (start, end))
+    parts = []
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        cols = list(zip(*rows))
+        parts.append({
+            'IdMedicion': np.array(cols[0], dtype=np.int64),
+            'IdSensor': np.array(cols[1], dtype=np.int32),
+            'FechaHora': np.array(cols[2], dtype='datetime64[us]'),
+            'PorcentajeLlenado': np.array(cols[3], dtype=np.float64),
+            'PesoKg': np.array(cols[4], dtype=np.float64),
+            'Temperatura': np.array(cols[5], dtype=np.float64),
+            'Anomalia': np.array([f or 0 for f in cols[6]], dtype=np.int16),
+        })
+    if not parts:
+        return None
+    return {n: np.concatenate([p[n] for p in parts]) for n, _ in DETAIL}
+
+
+def compact(conn, store, older_than_days=90, keep_full=True, now=None, batch_size=50000, log=print):
+    """Archiva las lecturas anteriores a hoy - `older_than_days` (desde la
+    medianoche) y las borra de mediciones. Devuelve cuántas se movieron.
+
+    Cada mes se procesa en su propia transacción: primero se escribe el
+    archivo y después se borran las filas; si el proceso se interrumpe entre
+    ambos pasos, la siguiente ejecución vuelve a leerlas y las reemplaza por
+    IdMedicion en el detalle (sin detalle quedarían contadas dos veces en el
+    resumen).
+    """
+    cutoff = datetime.combine((now or datetime.now()).date(), datetime.min.time()) - timedelta(days=older_than_days)
+    cur = conn.cursor()
+    moved = 0
+    try:
+        cur.execute("SELECT TOP 1 FechaHora FROM mediciones WHERE FechaHora < ? ORDER BY FechaHora", (cutoff,))
+        first = cur.fetchone()
+        month = _month(first[0]) if first else cutoff
+        while month < cutoff:
+            start, end = month, min(_next_month(month), cutoff)
+            month = _next_month(month)
+            new = _read_detail(cur, start, end, batch_size)
+            if new is None:
+                continue
+            name = start.strftime('%Y-%m')
+            manifest, detail, summary = store._load_full(name)
+            if detail is not None:
+                keep = ~np.isin(detail['IdMedicion'], new['IdMedicion'])
+                merged = {n: np.concatenate([detail[n][keep], new[n]]) for n, _ in DETAIL}
+                order = np.lexsort((merged['IdMedicion'], merged['FechaHora']))
+                detail = {n: v[order] for n, v in merged.items()}
+                summary = summarize(detail)
+            elif summary is not None:
+                # Un mes archivado sin detalle sigue sin detalle: no hay
+                # exportaciones a medias de un mismo mes
+                detail, summary = None, merge_summaries(summary, summarize(new))
+            else:
+                detail, summary = new, summarize(new)
+            if not keep_full:
+                detail = None
+            first_day = min(datetime.fromisoformat(manifest['desde']), start) if manifest else start
+            last_day = max(datetime.fromisoformat(manifest['hasta']), end) if manifest else end
+            store.write(name, detail, summary, {
+                'periodo': name,
+                'desde': first_day.isoformat(' '),
+                'hasta': last_day.isoformat(' '),
+                'lecturas': int(summary['N'].sum()),
+                'detalle': detail is not None,
+                'archivado': datetime.now().isoformat(' ', 'seconds'),
+            })
+            try:
+                cur.execute(DELETE_SQL, (start, end, int(new['IdMedicion'].max())))
+                cur.execute(DELETE_FLAGS_SQL, (start, end))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            moved += len(new['IdMedicion'])
+            if log:
+                log(f"  {name}: {len(new['IdMedicion']):,} lecturas archivadas "
+                    f"({'con' if detail is not None else 'sin'} detalle)")
+    finally:
+        cur.close()
+    return moved
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import crear_app
+
+    app = crear_app()
+    parser = argparse.ArgumentParser(description="Mueve las mediciones antiguas al almacenamiento frío")
+    parser.add_argument('cmd', choices=['compact'])
+    parser.add_argument('--dias', type=int, default=app.config['ARCHIVE_AFTER_DAYS'],
+                        help='archivar lo anterior a hoy menos estos días')
+    parser.add_argument('--sin-detalle', action='store_true',
+                        help='guardar sólo el resumen por hora y sensor')
+    args = parser.parse_args()
+
+    pool = app.extensions['db_pool']
+    conn = pool.acquire()
+    try:
+        moved = compact(conn, app.extensions['cold_store'], args.dias,
+                        keep_full=app.config['ARCHIVE_KEEP_FULL'] and not args.sin_detalle)
+    finally:
+        pool.release(conn)
+    print(f"  {moved:,} lecturas movidas a {app.config['ARCHIVE_DIR']}")
+    print("[Done]")
@@ -0,0 +1,52 @@
+"""
+Compresión negociada (br / gzip) de respuestas HTML, CSV y JSON.
+
+Se elige la codificación según Accept-Encoding (brotli si el cliente lo
+acepta y el paquete está instalado, si no gzip). Las respuestas completas
+se comprimen de una vez; las exportaciones en streaming se comprimen trozo
+a trozo, sin acumular el cuerpo en memoria.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:     # br es opcional: sin el paquete sólo se ofrece gzip
+    brotli = None
+
+COMPRESSIBLE = {'text/html', 'text/csv', 'application/json'}
+
+
+def negotiate(accept_encodings):
+    """Codificación a usar ('br', 'gzip') o None; `accept_encodings` es
+    request.accept_encodings. Ante igual preferencia gana br."""
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return accept_encodings.best_match(offered)
+
+
+def compressor(encoding, gzip_level=6, brotli_quality=5):
+    """(compress, finish) para un flujo en `encoding`."""
+    if encoding == 'br':
+        comp = brotli.Compressor(quality=brotli_quality)
+        return comp.process, comp.finish
+    comp = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+    return comp.compress, comp.flush
+
+
+def compress_body(data, encoding, gzip_level=6, brotli_quality=5):
+    compress, finish = compressor(encoding, gzip_level, brotli_quality)
+    return compress(data) + finish()
+
+
+def compress_chunks(chunks, encoding, gzip_level=6, brotli_quality=5):
+    """Comprime al vuelo un iterable de str/bytes y cierra el original al terminar."""
+    compress, finish = compressor(encoding, gzip_level, brotli_quality)
+    try:
+        for chunk in chunks:
+            data = compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
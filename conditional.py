@@ -0,0 +1,65 @@
+"""
+Versiones de datos por tabla y GET condicional (ETag / Last-Modified).
+
+Las rutas que escriben llaman a bump(tabla, ...) después del commit; cada
+vista declara de qué tablas depende y su ETag sale sólo de esos contadores,
+así que un cliente con la versión vigente recibe 304 sin consultar la base
+de datos.
+
+Los contadores viven en el proceso: el ETag incluye un identificador del
+arranque (los contadores vuelven a cero al reiniciar) y, como otros workers
+pueden escribir sin que este se entere, una ventana de `ttl` segundos que
+también cambia el ETag, igual que el TTL de QueryCache.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class DataVersions:
+    def __init__(self, ttl=30.0):
+        self.ttl = ttl
+        self.boot = f"{os.getpid():x}{time.time_ns() // 1000000:x}"
+        self._started = time.time()
+        self._versions = {}     # tabla -> contador
+        self._updated = {}      # tabla -> epoch del último cambio
+        self._lock = threading.Lock()
+
+    def bump(self, *tables):
+        now = time.time()
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+                self._updated[table] = now
+
+    def version(self, table):
+        with self._lock:
+            return self._versions.get(table, 0)
+
+    def validator(self, tables, extra=''):
+        """(etag, last_modified) de una respuesta que depende de `tables`."""
+        now = time.time()
+        with self._lock:
+            counts = '.'.join(str(self._versions.get(t, 0)) for t in sorted(tables))
+            modified = max([self._started] + [self._updated.get(t, 0) for t in tables])
+        window = ''
+        if self.ttl:
+            window = int(now // self.ttl)
+            modified = max(modified, window * self.ttl)
+        etag = f"{self.boot}-{counts}-{window}{'-' + extra if extra else ''}"
+        return etag, datetime.fromtimestamp(int(modified), timezone.utc)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._versions)
+
+
+def is_not_modified(request, etag, last_modified):
+    """True si el cliente ya tiene esta versión (If-None-Match manda sobre
+    If-Modified-Since, RFC 9110)."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
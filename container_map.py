@@ -0,0 +1,159 @@
+"""
+Índice en memoria de contenedores para el mapa (bbox + zoom).
+
+Los contenedores con coordenadas se guardan en una SpatialGrid en grados
+para responder la vista de detalle, y para cada nivel de zoom hasta
+`cluster_max_zoom` se mantienen agregados por celda (cantidad, centroide,
+llenado promedio, críticos). Una consulta sólo recorre las celdas que
+cubren la vista, así que el tamaño de la respuesta y su costo dependen de
+la vista y no del tamaño de la flota.
+
+Los niveles de llenado salen de LatestReadings (último llenado válido) y
+se actualizan con las mediciones que inserta la aplicación; las
+coordenadas y el tipo de residuo salen de ReferenceData. Los contenedores
+se recargan cada `max_age` segundos o cuando se invalida el índice.
+"""
+import math
+import threading
+import time
+
+from spatial import SpatialGrid
+
+# Coordenadas y tipo salen de ReferenceData (reference_data.py)
+LOAD_SQL = "SELECT IdContenedor, IdTipoResiduo, IdUbicacion FROM contenedores"
+
+# Una celda de cluster mide CLUSTER_PX píxeles de un tile de 256
+CLUSTER_PX = 64
+
+
+def cluster_cell(zoom):
+    """Lado en grados de la celda de cluster para un nivel de zoom."""
+    return 360.0 / (2 ** zoom) * CLUSTER_PX / 256
+
+
+class ContainerMap:
+    def __init__(self, cluster_max_zoom=14, max_points=2000, critical=85, max_age=600):
+        self.cluster_max_zoom = cluster_max_zoom
+        self.max_points = max_points
+        self.critical = critical
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._grid = SpatialGrid(cluster_cell(cluster_max_zoom + 1))
+        self._by_id = {}        # IdContenedor -> [lat, lng, tipo, nivel]
+        self._levels = []       # por zoom: {(cx, cy): [n, sum_lat, sum_lng, sum_nivel, n_nivel, criticos]}
+        self.without_location = 0
+
+    # ----- carga -----
+    def load(self, conn, latest, reference):
+        cur = conn.cursor()
+        try:
+            cur.execute(LOAD_SQL)
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+
+        grid = SpatialGrid(cluster_cell(self.cluster_max_zoom + 1))
+        by_id = {}
+        levels = [{} for _ in range(self.cluster_max_zoom + 1)]
+        tipos, coordenadas = reference.tipos_residuo, reference.coordenadas
+        located = 0
+        for id_contenedor, id_tipo, id_ubicacion in rows:
+            if id_ubicacion not in coordenadas:
+                continue
+            located += 1
+            lat, lng = coordenadas[id_ubicacion]
+            nivel = latest.fill_level(id_contenedor, None)
+            entry = [lat, lng, tipos.get(id_tipo), float(nivel) if nivel is not None else None]
+            by_id[id_contenedor] = entry
+            grid.insert(lng, lat, id_contenedor)
+            self._add(levels, entry, 1)
+        with self._lock:
+            self._grid, self._by_id, self._levels = grid, by_id, levels
+            self.without_location = len(rows) - located
+            self._loaded_at = time.monotonic()
+
+    def ensure_loaded(self, conn, latest, reference):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age:
+            self.load(conn, latest, reference)
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def _add(self, levels, entry, sign):
+        lat, lng, _, nivel = entry
+        for zoom, cells in enumerate(levels):
+            cell = cluster_cell(zoom)
+            key = (math.floor(lng / cell), math.floor(lat / cell))
+            agg = cells.get(key)
+            if agg is None:
+                agg = cells[key] = [0, 0.0, 0.0, 0.0, 0, 0]
+            agg[0] += sign
+            agg[1] += sign * lat
+            agg[2] += sign * lng
+            if nivel is not None:
+                agg[3] += sign * nivel
+                agg[4] += sign
+                agg[5] += sign * (nivel > self.critical)
+            if agg[0] == 0:
+                del cells[key]
+
+    def apply(self, readings, latest):
+        """Actualiza el nivel de los contenedores de un lote de mediciones.
+
+        Se registra después de LatestReadings.apply: el nivel sale de ahí
+        (último llenado válido), así que una lectura atrasada o marcada
+        como anómala no cambia el mapa.
+        """
+        ids = {r['IdContenedor'] for r in readings}
+        with self._lock:
+            for id_contenedor in ids:
+                entry = self._by_id.get(id_contenedor)
+                nivel = latest.fill_level(id_contenedor, None)
+                if entry is None or nivel is None or entry[3] == float(nivel):
+                    continue
+                self._add(self._levels, entry, -1)
+                entry[3] = float(nivel)
+                self._add(self._levels, entry, 1)
+
+    # ----- consulta -----
+    def query(self, west, south, east, north, zoom):
+        """Clusters (zoom <= cluster_max_zoom) o contenedores de la vista."""
+        zoom = max(0, int(zoom))
+        with self._lock:
+            if zoom <= self.cluster_max_zoom:
+                return {'tipo': 'clusters', 'items': self._clusters(west, south, east, north, zoom),
+                        'truncado': False}
+            found = self._grid.query_bbox(west, south, east, north)
+            items = []
+            for idx in found[:self.max_points]:
+                id_contenedor = self._grid.point(idx)[2]
+                lat, lng, tipo, nivel = self._by_id[id_contenedor]
+                items.append({'id': id_contenedor, 'lat': lat, 'lng': lng, 'tipo': tipo, 'nivel': nivel})
+            return {'tipo': 'puntos', 'items': items, 'truncado': len(found) > self.max_points}
+
+    def _clusters(self, west, south, east, north, zoom):
+        cells = self._levels[zoom]
+        cell = cluster_cell(zoom)
+        cx0, cy0 = math.floor(west / cell), math.floor(south / cell)
+        cx1, cy1 = math.floor(east / cell), math.floor(north / cell)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(cells):
+            selected = [(k, v) for k, v in cells.items() if cx0 <= k[0] <= cx1 and cy0 <= k[1] <= cy1]
+        else:
+            selected = [((cx, cy), cells[(cx, cy)])
+                        for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1) if (cx, cy) in cells]
+        items = []
+        for _, (n, sum_lat, sum_lng, sum_nivel, n_nivel, criticos) in selected:
+            items.append({
+                'n': n,
+                'lat': sum_lat / n,
+                'lng': sum_lng / n,
+                'nivel_prom': round(sum_nivel / n_nivel, 1) if n_nivel else None,
+                'criticos': criticos,
+            })
+        return items
+
+    def stats(self):
+        with self._lock:
+            return {'contenedores': len(self._by_id), 'sin_ubicacion': self.without_location,
+                    'celdas': sum(len(c) for c in self._levels)}
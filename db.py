@@ -0,0 +1,515 @@
+"""
+Capa de conexiones de SisResiduos: backends intercambiables y pool.
+
+El backend 'mssql' usa pyodbc contra SQL Server (producción); el backend
+'sqlite' es un sustituto local con el mismo esquema, pensado para pruebas
+y benchmarks. Ambos se usan a través de ConnectionPool.
+"""
+import math
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+
+
+class PoolTimeout(Exception):
+    """No se pudo obtener una conexión del pool dentro del tiempo límite."""
+
+
+# ========= BACKEND SQL SERVER =========
+class MSSQLBackend:
+    name = 'mssql'
+
+    def __init__(self, host, database, driver='ODBC Driver 17 for SQL Server'):
+        self.host = host
+        self.database = database
+        self.driver = driver
+
+    def connect(self):
+        import pyodbc
+
+        conn_str = (
+            f"DRIVER={{{self.driver}}};"
+            f"SERVER={self.host};"
+            f"DATABASE={self.database};"
+            f"Trusted_Connection=yes;"
+        )
+        return pyodbc.connect(conn_str)
+
+    def ping(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT 1")
+            cur.fetchone()
+        finally:
+            cur.close()
+
+    def set_query_timeout(self, conn, seconds):
+        """Límite por consulta (pyodbc lo aplica en segundos enteros)."""
+        conn.timeout = 0 if seconds is None else max(1, math.ceil(seconds))
+
+    def connection_lost(self, exc):
+        """El error deja la conexión inutilizable (red, servidor, tiempo
+        límite), no es un error de SQL o de datos."""
+        import pyodbc
+
+        return isinstance(exc, (pyodbc.OperationalError, pyodbc.InterfaceError))
+
+    # Expresiones para truncar fechas (agregados por periodo)
+    def hour_bucket(self, col):
+        return f"DATEADD(hour, DATEDIFF(hour, 0, {col}), 0)"
+
+    def day_bucket(self, col):
+        return f"CAST(CAST({col} AS date) AS datetime)"
+
+    def hour_of_day_bucket(self, col):
+        return f"DATEADD(hour, DATEPART(HOUR, {col}), 0)"
+
+    def locked(self, table):
+        """`table` para un SELECT de lectura-y-escritura (upsert): retiene
+        hasta el commit las claves leídas y el rango de las que faltan."""
+        return f"{table} WITH (UPDLOCK, HOLDLOCK)"
+
+
+# ========= BACKEND SQLITE (SUSTITUTO LOCAL) =========
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiposresiduos (
+    IdTipoResiduo INTEGER PRIMARY KEY,
+    TipoResiduo   TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ubicaciones (
+    IdUbicacion INTEGER PRIMARY KEY,
+    Direccion   TEXT,
+    Latitud     REAL,
+    Longitud    REAL
+);
+CREATE TABLE IF NOT EXISTS tipossensores (
+    IdTipoSensor INTEGER PRIMARY KEY,
+    TipoSensor   TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS contenedores (
+    IdContenedor  INTEGER PRIMARY KEY,
+    IdTipoResiduo INTEGER REFERENCES tiposresiduos(IdTipoResiduo),
+    Capacidad     INTEGER,
+    IdUbicacion   INTEGER REFERENCES ubicaciones(IdUbicacion),
+    IdEstado      INTEGER
+);
+CREATE TABLE IF NOT EXISTS sensores (
+    IdSensor         INTEGER PRIMARY KEY,
+    IdTipoSensor     INTEGER REFERENCES tipossensores(IdTipoSensor),
+    Modelo           TEXT,
+    IdContenedor     INTEGER REFERENCES contenedores(IdContenedor),
+    IdEstado         INTEGER,
+    FechaInstalacion DATE
+);
+CREATE TABLE IF NOT EXISTS mediciones (
+    IdMedicion        INTEGER PRIMARY KEY,
+    IdSensor          INTEGER REFERENCES sensores(IdSensor),
+    FechaHora         DATETIME,
+    PorcentajeLlenado REAL,
+    PesoKg            REAL,
+    Temperatura       REAL
+);
+"""
+
+_TOP_RE = re.compile(r'\bSELECT(\s+DISTINCT)?\s+TOP\s+(\d+)\s+', re.IGNORECASE)
+_CONST_ARG_RE = re.compile(r'\b(DATEPART|CONVERT)\(\s*(\w+)\s*,', re.IGNORECASE)
+_CAST_TODAY_RE = re.compile(r'CAST\(\s*GETDATE\(\)\s+AS\s+date\s*\)', re.IGNORECASE)
+_ISNULL_RE = re.compile(r'\bISNULL\(', re.IGNORECASE)
+
+
+def _scope_end(sql, start):
+    """Posición donde termina el SELECT que empieza en start (paréntesis o fin)."""
+    depth = 0
+    for i in range(start, len(sql)):
+        ch = sql[i]
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            if depth == 0:
+                return i
+            depth -= 1
+    return len(sql.rstrip().rstrip(';'))
+
+
+def translate_tsql(sql):
+    """Traduce a SQLite el subconjunto de T-SQL que usa la aplicación."""
+    matches = list(_TOP_RE.finditer(sql))
+    for m in reversed(matches):
+        end = _scope_end(sql, m.end())
+        sql = (sql[:m.start()] + 'SELECT' + (m.group(1) or '') + ' '
+               + sql[m.end():end].rstrip() + f' LIMIT {m.group(2)}' + sql[end:])
+    sql = _CAST_TODAY_RE.sub("date('now', 'localtime')", sql)
+    sql = _ISNULL_RE.sub('IFNULL(', sql)
+    sql = _CONST_ARG_RE.sub(lambda m: f"{m.group(1)}('{m.group(2).lower()}',", sql)
+    return sql
+
+
+def _sqlite_getdate():
+    return datetime.now().isoformat(' ', 'seconds')
+
+
+def _sqlite_datepart(part, value):
+    if value is None:
+        return None
+    dt = datetime.fromisoformat(str(value))
+    return getattr(dt, part)
+
+
+def _sqlite_convert(kind, value):
+    if value is None:
+        return None
+    if kind == 'date':
+        return str(value)[:10]
+    return value
+
+
+class _TSQLCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        if self.connection.latency:
+            time.sleep(self.connection.latency)
+        return super().execute(translate_tsql(sql), params)
+
+    def executemany(self, sql, seq_of_params):
+        if self.connection.latency:
+            time.sleep(self.connection.latency)
+        return super().executemany(translate_tsql(sql), seq_of_params)
+
+
+class _TSQLConnection(sqlite3.Connection):
+    latency = 0.0
+
+    def cursor(self, factory=_TSQLCursor):
+        return super().cursor(factory)
+
+
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(' '))
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+sqlite3.register_converter('DATETIME', lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter('DATE', lambda b: date.fromisoformat(b.decode()[:10]))
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def __init__(self, path, latency_ms=0):
+        self.path = path
+        # Espera por consulta que simula la ida y vuelta a un servidor remoto
+        # (benchmarks de concurrencia); 0 en uso normal
+        self.latency = latency_ms / 1000
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            factory=_TSQLConnection,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+        )
+        conn.create_function('GETDATE', 0, _sqlite_getdate)
+        conn.create_function('DATEPART', 2, _sqlite_datepart, deterministic=True)
+        conn.create_function('CONVERT', 2, _sqlite_convert, deterministic=True)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.latency = self.latency
+        return conn
+
+    def ping(self, conn):
+        conn.execute("SELECT 1").fetchone()
+
+    def set_query_timeout(self, conn, seconds):
+        """Interrumpe la consulta en curso al vencer el plazo."""
+        if seconds is None:
+            conn.set_progress_handler(None, 0)
+            return
+        deadline = time.monotonic() + seconds
+        conn.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+
+    def connection_lost(self, exc):
+        # sqlite3 usa OperationalError también para errores de SQL: se mira
+        # el mensaje (incluye la consulta interrumpida por set_query_timeout)
+        if isinstance(exc, sqlite3.InterfaceError):
+            return True
+        return isinstance(exc, (sqlite3.OperationalError, sqlite3.ProgrammingError)) and any(
+            m in str(exc) for m in ('interrupted', 'closed database', 'disk I/O', 'unable to open'))
+
+    def hour_bucket(self, col):
+        return f"strftime('%Y-%m-%d %H:00:00', {col})"
+
+    def day_bucket(self, col):
+        return f"strftime('%Y-%m-%d 00:00:00', {col})"
+
+    def hour_of_day_bucket(self, col):
+        return f"strftime('1900-01-01 %H:00:00', {col})"
+
+    def locked(self, table):
+        # SQLite bloquea la base entera al primer INSERT de la transacción
+        return table
+
+    def create_schema(self):
+        conn = self.connect()
+        try:
+            conn.executescript(SQLITE_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def make_backend(config):
+    """Construye el backend configurado en app.config['DB_BACKEND']."""
+    kind = config.get('DB_BACKEND', 'mssql')
+    if kind == 'mssql':
+        return MSSQLBackend(
+            config['SQL_SERVER_HOST'],
+            config['SQL_SERVER_DB'],
+            config['SQL_DRIVER'],
+        )
+    if kind == 'sqlite':
+        return SQLiteBackend(config['SQLITE_PATH'], config.get('SQLITE_LATENCY_MS', 0))
+    raise ValueError(f"DB_BACKEND desconocido: {kind!r}")
+
+
+# ========= FILAS COMPACTAS =========
+_row_classes = {}
+
+
+def row_class(colnames):
+    """Clase de fila para un conjunto de columnas (se crea una vez y se reusa).
+
+    Las filas son tuplas sin __dict__ que comparten un único índice
+    nombre -> posición, y admiten fila['col'], fila.col y fila[0], además de
+    keys()/get()/items() para que dict(fila) y csv.DictWriter funcionen.
+    """
+    colnames = tuple(colnames)
+    cls = _row_classes.get(colnames)
+    if cls is not None:
+        return cls
+
+    index = {name: i for i, name in enumerate(colnames)}
+    getitem = tuple.__getitem__
+
+    class Row(tuple):
+        __slots__ = ()
+        _fields = colnames
+        _index = index
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                return getitem(self, index[key])
+            return getitem(self, key)
+
+        def __getattr__(self, name):
+            try:
+                return getitem(self, index[name])
+            except KeyError:
+                raise AttributeError(name) from None
+
+        def __contains__(self, key):
+            return key in index
+
+        def keys(self):
+            return index.keys()
+
+        def values(self):
+            return tuple(self)
+
+        def items(self):
+            return zip(colnames, self)
+
+        def get(self, key, default=None):
+            i = index.get(key)
+            return default if i is None else getitem(self, i)
+
+        def __repr__(self):
+            return f"Row({', '.join(f'{k}={v!r}' for k, v in zip(colnames, self))})"
+
+    _row_classes[colnames] = Row
+    return Row
+
+
+class RowCursor:
+    """Envuelve un cursor DB-API y devuelve filas compactas (ver row_class)."""
+
+    def __init__(self, cursor, batch_size=1000):
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self._row = None
+
+    def execute(self, sql, params=None):
+        if params is None:
+            res = self.cursor.execute(sql)
+        else:
+            res = self.cursor.execute(sql, params)
+        description = self.cursor.description
+        self._row = row_class(col[0] for col in description) if description else None
+        return res
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is None or self._row is None:
+            return row
+        return self._row(row)
+
+    def fetchmany(self, size=None):
+        rows = self.cursor.fetchmany(size or self.batch_size)
+        if self._row is None:
+            return rows
+        return [self._row(r) for r in rows]
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        if self._row is None:
+            return rows
+        return [self._row(r) for r in rows]
+
+    def __iter__(self):
+        """Recorre el resultado por lotes de fetchmany, sin cargarlo entero."""
+        while True:
+            rows = self.fetchmany()
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        try:
+            self.cursor.close()
+        except Exception:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+# ========= POOL DE CONEXIONES =========
+class ConnectionPool:
+    """
+    Pool de tamaño fijo. Las conexiones se crean bajo demanda hasta `size`;
+    después, quien pide una conexión espera hasta `timeout` segundos.
+    Las conexiones que llevan más de `ping_after` segundos ociosas se
+    verifican con el backend antes de entregarse.
+
+    `wrap`, si se indica, envuelve cada conexión nueva (instrumentación) y
+    `on_acquire` recibe los segundos que tardó cada acquire().
+    """
+
+    def __init__(self, backend, size=5, timeout=10.0, ping_after=30.0, wrap=None, on_acquire=None):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.wrap = wrap
+        self.on_acquire = on_acquire
+        self._idle = []   # pila LIFO de (conexión, momento en que se devolvió)
+        self._lock = threading.Lock()
+        # Avisa a quien espera cuando se devuelve una conexión o se libera
+        # un cupo al descartar una rota
+        self._available = threading.Condition(self._lock)
+        self._opened = 0
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'discarded': 0,
+        }
+
+    def _new_connection(self):
+        conn = self.backend.connect()
+        if self.wrap is not None:
+            conn = self.wrap(conn)
+        with self._lock:
+            self._stats['created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._available:
+            self._opened -= 1
+            self._stats['discarded'] += 1
+            self._available.notify()
+
+    def _alive(self, conn):
+        try:
+            self.backend.ping(conn)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        started = time.perf_counter()
+        waited = False
+        while True:
+            with self._available:
+                while True:
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._opened < self.size:
+                        self._opened += 1
+                        conn = None
+                        break
+                    remaining = self.timeout - (time.perf_counter() - started)
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(
+                            f"sin conexiones libres tras {self.timeout}s (size={self.size})"
+                        )
+                    waited = True
+                    self._available.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self._new_connection()
+                except Exception:
+                    with self._available:
+                        self._opened -= 1
+                        self._available.notify()
+                    raise
+                break
+            if time.monotonic() - last_used < self.ping_after or self._alive(conn):
+                break
+            self._discard(conn)
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_time_total'] += elapsed
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], elapsed)
+        if self.on_acquire is not None:
+            self.on_acquire(elapsed)
+        return conn
+
+    def release(self, conn, broken=False):
+        if broken:
+            self._discard(conn)
+            return
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._available:
+            self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['size'] = self.size
+            data['open'] = self._opened
+            data['idle'] = len(self._idle)
+        data['in_use'] = data['open'] - data['idle']
+        return data
@@ -0,0 +1,153 @@
+"""
+Exportaciones en streaming: las filas se leen del cursor por lotes
+(fetchmany) y se envían al cliente a medida que llegan, así que la memoria
+usada no depende del número de filas exportadas.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime, timedelta
+
+
+def parse_date_range(args):
+    """Lee desde/hasta (YYYY-MM-DD) de los parámetros; hasta es inclusivo.
+
+    Devuelve (desde, hasta_exclusivo) como datetime o None. Lanza ValueError
+    si alguna fecha no tiene el formato esperado.
+    """
+    desde = args.get('desde') or None
+    hasta = args.get('hasta') or None
+    if desde:
+        desde = datetime.strptime(desde, '%Y-%m-%d')
+    if hasta:
+        hasta = datetime.strptime(hasta, '%Y-%m-%d') + timedelta(days=1)
+    return desde, hasta
+
+
+def iter_batches(cursor, batch_size=1000):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+def iter_csv(cursor, header, batch_size=1000, transform=None):
+    """Genera el CSV por trozos: la cabecera y luego un trozo por lote.
+
+    `transform`, si se indica, recibe cada lote y devuelve las filas a escribir.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    yield buf.getvalue()
+    for rows in iter_batches(cursor, batch_size):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(transform(rows) if transform else rows)
+        yield buf.getvalue()
+
+
+def gzip_chunks(chunks):
+    """Comprime al vuelo un iterable de str en formato gzip."""
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = comp.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield comp.flush()
+
+
+def stream_query(pool, sql, params, render, batch_size=1000):
+    """Ejecuta `sql` con una conexión propia del pool y delega en `render`.
+
+    La conexión se toma dentro del generador y se devuelve al pool cuando
+    termina (o se interrumpe) la respuesta, no al salir de la vista.
+    """
+    conn = pool.acquire()
+    try:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, params)
+            yield from render(cur, batch_size)
+        finally:
+            cur.close()
+    finally:
+        pool.release(conn)
+
+
+# ========= EXPORTACIÓN COLUMNAR (Parquet / Arrow IPC) =========
+MEDICIONES_ARROW_COLUMNS = (
+    ('id', 'int64'),
+    ('sensor', 'int32'),
+    ('fecha_hora', 'timestamp[us]'),
+    ('porcentaje', 'float64'),
+    ('peso', 'float64'),
+    ('temp', 'float64'),
+)
+
+
+class _Drain:
+    """Archivo de sólo escritura que acumula bytes hasta que se vacía."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def arrow_schema(columns=MEDICIONES_ARROW_COLUMNS):
+    import pyarrow as pa
+
+    return pa.schema([pa.field(name, pa.type_for_alias(kind)) for name, kind in columns])
+
+
+def iter_columnar(cursor, fmt, batch_size=10000, columns=MEDICIONES_ARROW_COLUMNS):
+    """Genera un archivo Parquet o un stream Arrow IPC por lotes del cursor.
+
+    Cada lote de fetchmany se convierte directamente en un RecordBatch con
+    tipos fijos (sin pasar por texto) y se envía en cuanto se escribe.
+    """
+    import pyarrow as pa
+
+    schema = arrow_schema(columns)
+    sink = _Drain()
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+        write = writer.write_batch
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+
+    try:
+        for rows in iter_batches(cursor, batch_size):
+            arrays = [pa.array(col, type=field.type) for col, field in zip(zip(*rows), schema)]
+            write(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
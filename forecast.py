@@ -0,0 +1,237 @@
+"""
+Pronóstico de llenado ("tiempo hasta lleno") de todos los contenedores.
+
+Las lecturas recientes de PorcentajeLlenado de cada contenedor se guardan en
+dos matrices NumPy (una fila por contenedor, `max_points` columnas) y la
+tasa de llenado se ajusta por mínimos cuadrados para todas las filas a la
+vez. Sólo se usa el ciclo actual: una caída brusca del llenado es un
+vaciado y reinicia la serie del contenedor.
+
+Igual que LatestReadings, se carga con una consulta, se mantiene con las
+mediciones que inserta la aplicación (sólo se reajustan las filas que
+cambiaron) y se recarga completo cada `max_age` segundos.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from anomalies import ANOMALIAS_JOIN, FILL_OK_SQL, fill_ok
+
+LOAD_SQL = f"""
+    SELECT s.IdContenedor, m.FechaHora, m.PorcentajeLlenado
+    FROM mediciones m
+    JOIN sensores s ON m.IdSensor = s.IdSensor
+    {ANOMALIAS_JOIN}
+    WHERE m.FechaHora >= ? AND m.PorcentajeLlenado IS NOT NULL AND {FILL_OK_SQL}
+"""
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _seconds(dt):
+    return (dt - EPOCH).total_seconds()
+
+
+class FillForecaster:
+    def __init__(self, window_hours=48, max_points=64, min_points=3, max_age=3600,
+                 full=100.0, reset_drop=10.0):
+        self.window_hours = window_hours
+        self.max_points = max_points
+        self.min_points = min_points
+        self.max_age = max_age
+        self.full = full
+        self.reset_drop = reset_drop
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._reset(0)
+
+    def _reset(self, capacity):
+        w = self.max_points
+        self._row = {}
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._t = np.zeros((capacity, w))
+        self._y = np.zeros((capacity, w))
+        self._n = np.zeros(capacity, dtype=np.int64)
+        self._slope = np.full(capacity, np.nan)     # % por hora
+        self._level = np.full(capacity, np.nan)     # % ajustado en la última lectura
+        self._tlast = np.zeros(capacity)
+        self._dirty = np.zeros(capacity, dtype=bool)
+
+    def _grow(self):
+        capacity = max(16, 2 * len(self._ids))
+        extra = capacity - len(self._ids)
+        w = self.max_points
+        self._ids = np.concatenate([self._ids, np.zeros(extra, dtype=np.int64)])
+        self._t = np.concatenate([self._t, np.zeros((extra, w))])
+        self._y = np.concatenate([self._y, np.zeros((extra, w))])
+        self._n = np.concatenate([self._n, np.zeros(extra, dtype=np.int64)])
+        self._slope = np.concatenate([self._slope, np.full(extra, np.nan)])
+        self._level = np.concatenate([self._level, np.full(extra, np.nan)])
+        self._tlast = np.concatenate([self._tlast, np.zeros(extra)])
+        self._dirty = np.concatenate([self._dirty, np.zeros(extra, dtype=bool)])
+
+    # ----- carga completa -----
+    def load(self, conn, now=None):
+        since = (now or datetime.now()) - timedelta(hours=self.window_hours)
+        ids, times, fills = [], [], []
+        cur = conn.cursor()
+        try:
+            cur.execute(LOAD_SQL, (since,))
+            while True:
+                rows = cur.fetchmany(10000)
+                if not rows:
+                    break
+                for id_contenedor, fecha, fill in rows:
+                    ids.append(id_contenedor)
+                    times.append(fecha)
+                    fills.append(fill)
+        finally:
+            cur.close()
+
+        ids = np.array(ids, dtype=np.int64)
+        t = np.array(times, dtype='datetime64[us]').astype(np.int64) / 1e6
+        y = np.array(fills, dtype=np.float64)
+        with self._lock:
+            self._load_arrays(ids, t, y)
+            self._loaded_at = time.monotonic()
+
+    def _load_arrays(self, ids, t, y):
+        """Vuelca las lecturas (sin orden) en las matrices, todo vectorizado."""
+        order = np.lexsort((t, ids))
+        ids, t, y = ids[order], t[order], y[order]
+        if len(ids):
+            # Cada contenedor empieza grupo; cada vaciado empieza un ciclo
+            new_group = np.r_[True, ids[1:] != ids[:-1]]
+            drop = np.r_[False, (y[1:] < y[:-1] - self.reset_drop) & ~new_group[1:]]
+            cycle = np.cumsum(new_group | drop)
+            group = np.cumsum(new_group) - 1
+            ends = np.r_[np.flatnonzero(new_group)[1:], len(ids)] - 1
+            keep = cycle == cycle[ends][group]
+            ids, t, y = ids[keep], t[keep], y[keep]
+
+        new_group = np.r_[True, ids[1:] != ids[:-1]] if len(ids) else np.zeros(0, dtype=bool)
+        starts = np.flatnonzero(new_group)
+        group = np.cumsum(new_group) - 1
+        counts = np.diff(np.r_[starts, len(ids)])
+        pos = np.arange(len(ids)) - starts[group]
+        skip = np.maximum(counts - self.max_points, 0)
+        keep = pos >= skip[group]
+        col = (pos - skip[group])[keep]
+        row = group[keep]
+
+        self._reset(len(starts))
+        self._ids[:] = ids[starts]
+        self._t[row, col] = t[keep]
+        self._y[row, col] = y[keep]
+        self._n[:] = np.minimum(counts, self.max_points)
+        self._dirty[:] = True
+        self._row = {int(i): r for r, i in enumerate(self._ids)}
+
+    def ensure_loaded(self, conn):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age:
+            self.load(conn)
+
+    # ----- actualización incremental -----
+    def apply(self, readings):
+        """Incorpora mediciones recién insertadas (dicts con IdContenedor)."""
+        w = self.max_points
+        with self._lock:
+            for r in readings:
+                # Un salto o un valor pegado no es la tendencia de llenado
+                if not fill_ok(r):
+                    continue
+                fill = r['PorcentajeLlenado']
+                row = self._row.get(r['IdContenedor'])
+                if row is None:
+                    row = len(self._row)
+                    if row == len(self._ids):
+                        self._grow()
+                    self._row[r['IdContenedor']] = row
+                    self._ids[row] = r['IdContenedor']
+                t = _seconds(r['FechaHora'])
+                n = self._n[row]
+                if n:
+                    if t < self._t[row, n - 1]:
+                        continue
+                    if fill < self._y[row, n - 1] - self.reset_drop:
+                        n = 0
+                if n == w:
+                    self._t[row, :-1] = self._t[row, 1:]
+                    self._y[row, :-1] = self._y[row, 1:]
+                    n -= 1
+                self._t[row, n] = t
+                self._y[row, n] = fill
+                self._n[row] = n + 1
+                self._dirty[row] = True
+
+    def _refit(self):
+        rows = np.flatnonzero(self._dirty[:len(self._row)])
+        if not len(rows):
+            return
+        t, y, n = self._t[rows], self._y[rows], self._n[rows]
+        last = np.maximum(n - 1, 0)
+        tlast = t[np.arange(len(rows)), last]
+        ylast = y[np.arange(len(rows)), last]
+        mask = np.arange(self.max_points) < n[:, None]
+        mask &= t >= (tlast - self.window_hours * 3600)[:, None]
+
+        x = np.where(mask, (t - tlast[:, None]) / 3600, 0.0)
+        y = np.where(mask, y, 0.0)
+        k = mask.sum(axis=1).astype(np.float64)
+        sx, sy = x.sum(axis=1), y.sum(axis=1)
+        sxx, sxy = (x * x).sum(axis=1), (x * y).sum(axis=1)
+        den = k * sxx - sx * sx
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.where(den > 0, (k * sxy - sx * sy) / den, np.nan)
+            level = (sy - slope * sx) / k
+        slope[k < self.min_points] = np.nan
+        # Sin tendencia, el nivel es la última lectura
+        level = np.where(np.isnan(slope), ylast, level)
+
+        self._slope[rows] = slope
+        self._level[rows] = level
+        self._tlast[rows] = tlast
+        self._dirty[rows] = False
+
+    # ----- consulta -----
+    def arrays(self, now=None):
+        """(ids, nivel_actual, tasa_hora, horas_para_lleno) como arrays NumPy.
+
+        horas_para_lleno es NaN si el contenedor no se está llenando o no
+        tiene lecturas suficientes, y 0 si ya debería estar lleno.
+        """
+        now = _seconds(now or datetime.now())
+        with self._lock:
+            self._refit()
+            count = len(self._row)
+            ids = self._ids[:count].copy()
+            slope = self._slope[:count].copy()
+            level = self._level[:count].copy()
+            tlast = self._tlast[:count].copy()
+
+        elapsed = np.maximum(now - tlast, 0) / 3600
+        with np.errstate(invalid='ignore'):
+            current = np.clip(level + np.where(slope > 0, slope, 0) * elapsed, 0, self.full)
+            hours = np.where(slope > 1e-6, (self.full - current) / slope, np.nan)
+        return ids, current, slope, hours
+
+    def forecast(self, now=None):
+        """{IdContenedor: {...}} listo para JSON o plantillas."""
+        now = now or datetime.now()
+        ids, current, slope, hours = self.arrays(now)
+        current = np.round(current, 1).tolist()
+        slope = np.round(slope, 3).tolist()
+        hours = np.round(hours, 1).tolist()
+        result = {}
+        for i, id_contenedor in enumerate(ids.tolist()):
+            tasa, horas = slope[i], hours[i]
+            ok = horas == horas
+            result[id_contenedor] = {
+                'nivel': current[i],
+                'tasa_hora': tasa if tasa == tasa else None,
+                'horas_para_lleno': horas if ok else None,
+                'lleno_en': (now + timedelta(hours=horas)).isoformat(' ', 'minutes') if ok else None,
+            }
+        return result
@@ -0,0 +1,199 @@
+"""
+Ingesta masiva de mediciones.
+
+Cada lectura usa los mismos nombres de columna que produce
+/mediciones/exportar_csv: sensor, fecha_hora, porcentaje, peso, temp.
+La validación se hace en memoria contra un directorio de sensores
+precargado y la inserción va por lotes (executemany) en una transacción.
+"""
+import json
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+MAX_FUTURE = timedelta(days=1)
+
+INSERT_SQL = """
+    INSERT INTO mediciones (IdSensor, FechaHora, PorcentajeLlenado, PesoKg, Temperatura)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def _optional_float(value, name):
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} no es numérico: {value!r}")
+    if not math.isfinite(number):
+        raise ValueError(f"{name} no es finito: {value!r}")
+    return number
+
+
+def parse_timestamp(value):
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        dt = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt
+
+
+def parse_reading(obj, now=None):
+    """Valida una lectura y la devuelve con los nombres de columna de la BD."""
+    if not isinstance(obj, dict):
+        raise ValueError("la lectura debe ser un objeto JSON")
+    try:
+        sensor = int(obj['sensor'])
+    except KeyError:
+        raise ValueError("falta sensor")
+    except (TypeError, ValueError):
+        raise ValueError(f"sensor inválido: {obj['sensor']!r}")
+    if 'fecha_hora' not in obj:
+        raise ValueError("falta fecha_hora")
+    try:
+        fecha = parse_timestamp(obj['fecha_hora'])
+    except (TypeError, ValueError):
+        raise ValueError(f"fecha_hora inválida: {obj['fecha_hora']!r}")
+    if fecha > (now or datetime.now()) + MAX_FUTURE:
+        raise ValueError(f"fecha_hora en el futuro: {fecha.isoformat()}")
+
+    porcentaje = _optional_float(obj.get('porcentaje'), 'porcentaje')
+    if porcentaje is not None and not 0 <= porcentaje <= 100:
+        raise ValueError(f"porcentaje fuera de rango: {porcentaje}")
+    peso = _optional_float(obj.get('peso'), 'peso')
+    if peso is not None and peso < 0:
+        raise ValueError(f"peso negativo: {peso}")
+    temp = _optional_float(obj.get('temp'), 'temp')
+
+    return {
+        'IdSensor': sensor,
+        'FechaHora': fecha,
+        'PorcentajeLlenado': porcentaje,
+        'PesoKg': peso,
+        'Temperatura': temp,
+    }
+
+
+def iter_ndjson(lines):
+    """Genera (número de línea, objeto o excepción) por cada línea no vacía."""
+    for n, line in enumerate(lines, 1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if not line:
+                continue
+            yield n, json.loads(line)
+        except ValueError as e:
+            # UnicodeDecodeError también es ValueError
+            yield n, e
+
+
+class SensorDirectory:
+    """IdSensor -> (IdContenedor, IdTipoResiduo), cargado una vez por worker.
+
+    Si llega un sensor desconocido se recarga antes de rechazarlo, así que
+    los sensores creados por otros procesos se reconocen solos; como mucho
+    una vez cada `reload_interval` segundos, para que un cliente que insiste
+    con un id inexistente no recorra la tabla en cada petición. Los sensores
+    creados por la propia aplicación llegan con invalidate().
+    """
+
+    def __init__(self, reload_interval=30):
+        self.reload_interval = reload_interval
+        self._sensors = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT s.IdSensor, s.IdContenedor, c.IdTipoResiduo
+                FROM sensores s
+                LEFT JOIN contenedores c ON s.IdContenedor = c.IdContenedor
+            """)
+            sensors = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+        finally:
+            cur.close()
+        with self._lock:
+            self._sensors = sensors
+            self._loaded_at = time.monotonic()
+        return sensors
+
+    def invalidate(self):
+        with self._lock:
+            self._sensors = None
+
+    def resolve(self, conn, ids):
+        sensors = self._sensors
+        if sensors is None or (not set(ids) <= sensors.keys()
+                               and time.monotonic() - self._loaded_at > self.reload_interval):
+            sensors = self.load(conn)
+        return sensors
+
+
+def validate(objects, conn, sensors, now=None):
+    """Valida en bloque; devuelve (filas válidas, rechazos por fila).
+
+    `objects` es un iterable de (número de fila, objeto) donde el objeto
+    puede ser una excepción de parseo. Las filas válidas se enriquecen con
+    IdContenedor e IdTipoResiduo del sensor.
+    """
+    now = now or datetime.now()
+    parsed, rejected = [], []
+    for n, obj in objects:
+        if isinstance(obj, Exception):
+            rejected.append({'row': n, 'error': f"JSON inválido: {obj}"})
+            continue
+        try:
+            parsed.append((n, parse_reading(obj, now)))
+        except ValueError as e:
+            rejected.append({'row': n, 'error': str(e)})
+
+    directory = sensors.resolve(conn, {r['IdSensor'] for _, r in parsed}) if parsed else {}
+    rows = []
+    for n, r in parsed:
+        owner = directory.get(r['IdSensor'])
+        if owner is None:
+            rejected.append({'row': n, 'error': f"sensor {r['IdSensor']} no existe"})
+            continue
+        r['IdContenedor'], r['IdTipoResiduo'] = owner
+        rows.append(r)
+    rejected.sort(key=lambda e: e['row'])
+    return rows, rejected
+
+
+def insert_readings(conn, rows, rollups=None, anomalies=None, batch_size=5000, deltas=None):
+    """Inserta las filas, sus banderas de anomalía y los agregados en una
+    sola transacción.
+
+    `deltas` son los agregados de `rows` si ya se acumularon aparte.
+    """
+    cur = conn.cursor()
+    if hasattr(cur, 'fast_executemany'):
+        cur.fast_executemany = True
+    try:
+        for i in range(0, len(rows), batch_size):
+            cur.executemany(INSERT_SQL, [
+                (r['IdSensor'], r['FechaHora'], r['PorcentajeLlenado'], r['PesoKg'], r['Temperatura'])
+                for r in rows[i:i + batch_size]
+            ])
+        if anomalies is not None:
+            anomalies.record(cur, rows)
+        if rollups is not None:
+            if deltas is None:
+                rollups.apply(cur, rows)
+            else:
+                rollups.apply_deltas(cur, deltas)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return len(rows)
@@ -2,12 +2,39 @@
 """
 Script to inspect SQL Server schema and print table column names.
 Helps identify correct column names for queries.
+
+The same column lookup backs SchemaCatalog, the in-memory catalog the web
+app resolves once at startup instead of querying INFORMATION_SCHEMA on
+every request.
+
+It also works as an index advisor and migration tool:
+
+    python inspect_schema.py                    # columnas de cada tabla
+    python inspect_schema.py advise [--metrics ARCHIVO|URL]
+    python inspect_schema.py migrate [--dry-run]
+
+`advise` collects the SQL the app issues (string literals in the app's
+modules, plus the normalized statements of a /metrics dump if given),
+works out which columns each query seeks, joins, ranges and orders on,
+and compares that with the existing indexes. It also flags predicates
+that wrap a column in a function and so can't use an index. `migrate`
+creates the indexes in INDEXES if they don't exist yet.
 """
-import pyodbc
+import ast
+import glob
 import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+TABLES = ['contenedores', 'mediciones', 'sensores', 'tiposresiduos', 'ubicaciones', 'tipossensores']
+
 
 def get_mssql_connection():
     """Return a new pyodbc connection using Trusted_Connection (Windows Auth)."""
+    import pyodbc
+
     driver = os.environ.get('MSSQL_DRIVER', 'ODBC Driver 17 for SQL Server')
     server = 'localhost'
     database = 'SisResiduos'
@@ -19,37 +46,511 @@ def get_mssql_connection():
     )
     return pyodbc.connect(conn_str)
 
+
+def fetch_columns(conn, database, backend='mssql', tables=TABLES):
+    """Return {table: [(column, data_type), ...]} in ordinal order.
+
+    Table names are matched case-insensitively and returned lowercased.
+    """
+    tables = [t.lower() for t in tables]
+    cur = conn.cursor()
+    result = {}
+    try:
+        if backend == 'sqlite':
+            for table in tables:
+                cur.execute(f"PRAGMA table_info({table})")
+                rows = cur.fetchall()
+                if rows:
+                    result[table] = [(row[1], row[2]) for row in rows]
+        else:
+            cur.execute(f"""
+                SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE
+                FROM INFORMATION_SCHEMA.COLUMNS
+                WHERE TABLE_CATALOG = ? AND LOWER(TABLE_NAME) IN ({', '.join('?' * len(tables))})
+                ORDER BY TABLE_NAME, ORDINAL_POSITION
+            """, (database, *tables))
+            for table, column, data_type in cur.fetchall():
+                result.setdefault(table.lower(), []).append((column, data_type))
+    finally:
+        cur.close()
+    return result
+
+
+class SchemaCatalog:
+    """Column names per table, loaded once and kept in memory.
+
+    Lookups never touch the database unless the catalog is empty or older
+    than `ttl` seconds; `refresh()` reloads it explicitly.
+    """
+
+    def __init__(self, pool, database, ttl=3600):
+        self.pool = pool
+        self.database = database
+        self.ttl = ttl
+        self._tables = None
+        self._resolved = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        conn = self.pool.acquire()
+        try:
+            columns = fetch_columns(conn, self.database, self.pool.backend.name)
+        finally:
+            self.pool.release(conn)
+        with self._lock:
+            self._tables = {t.lower(): cols for t, cols in columns.items()}
+            self._resolved = {}
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._tables is None:
+            self.refresh()
+        elif time.monotonic() - self._loaded_at > self.ttl:
+            try:
+                self.refresh()
+            except Exception:
+                # Seguir con el catálogo anterior y reintentar tras otro TTL
+                self._loaded_at = time.monotonic()
+
+    def columns(self, table):
+        self._ensure_fresh()
+        with self._lock:
+            tables = self._tables
+        return [col for col, _ in tables.get(table.lower(), [])]
+
+    def resolve(self, table, candidates):
+        """First of `candidates` that exists in `table`, or None."""
+        self._ensure_fresh()
+        key = (table.lower(), tuple(candidates))
+        # A concurrent refresh() swaps both dicts under the lock; read them
+        # once so a lookup never mixes the old cache with the new catalog
+        with self._lock:
+            tables, resolved = self._tables, self._resolved
+        if key not in resolved:
+            cols = {col for col, _ in tables.get(table.lower(), [])}
+            found = next((c for c in candidates if c in cols), None)
+            with self._lock:
+                resolved[key] = found
+            return found
+        return resolved[key]
+
+
+# ========= ÍNDICES (migraciones idempotentes) =========
+IndexSpec = namedtuple('IndexSpec', 'name table columns include')
+
+INDEXES = [
+    # Historial por sensor y el join sensores -> mediciones filtrado por fecha
+    IndexSpec('IX_mediciones_IdSensor_FechaHora', 'mediciones',
+              ('IdSensor', 'FechaHora'), ('PorcentajeLlenado', 'PesoKg', 'Temperatura')),
+    # Rangos de fecha de todos los sensores, exportaciones y paginación keyset
+    # (IdMedicion, la clave primaria, ya va implícita al final del índice)
+    IndexSpec('IX_mediciones_FechaHora', 'mediciones',
+              ('FechaHora',), ('IdSensor', 'PorcentajeLlenado', 'PesoKg', 'Temperatura')),
+    # Join contenedores -> sensores de la exportación y del listado
+    IndexSpec('IX_sensores_IdContenedor', 'sensores', ('IdContenedor',), ()),
+]
+
+
+def index_ddl(spec, backend='mssql'):
+    """CREATE INDEX que no falla si el índice ya existe.
+
+    SQLite no tiene INCLUDE: las columnas incluidas van al final de la clave
+    para que el índice siga cubriendo la consulta.
+    """
+    if backend == 'sqlite':
+        cols = ', '.join(spec.columns + spec.include)
+        return f"CREATE INDEX IF NOT EXISTS {spec.name} ON {spec.table} ({cols})"
+    include = f" INCLUDE ({', '.join(spec.include)})" if spec.include else ""
+    return (
+        f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{spec.name}' "
+        f"AND object_id = OBJECT_ID('{spec.table}'))\n"
+        f"    CREATE NONCLUSTERED INDEX {spec.name} ON {spec.table} "
+        f"({', '.join(spec.columns)}){include}"
+    )
+
+
+def migrate(conn, backend='mssql', indexes=INDEXES, dry_run=False):
+    """Crea los índices que falten. Devuelve los nombres creados."""
+    existing = {name.lower() for name in fetch_indexes(conn, backend)}
+    created = []
+    cur = conn.cursor()
+    try:
+        for spec in indexes:
+            if spec.name.lower() in existing:
+                continue
+            if not dry_run:
+                cur.execute(index_ddl(spec, backend))
+            created.append(spec.name)
+        if created and not dry_run:
+            if backend == 'sqlite':
+                cur.execute("ANALYZE")
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return created
+
+
+def fetch_indexes(conn, backend='mssql', tables=TABLES + ['mediciones_rollup']):
+    """Return {index_name: (table, key_columns)}; primary keys included."""
+    cur = conn.cursor()
+    result = {}
+    try:
+        if backend == 'sqlite':
+            for table in tables:
+                cur.execute(f"PRAGMA table_info({table})")
+                pk = [row[1] for row in sorted(cur.fetchall(), key=lambda r: r[5]) if row[5]]
+                if pk:
+                    result[f'PK_{table}'] = (table, tuple(pk))
+                cur.execute(f"PRAGMA index_list({table})")
+                for name in [row[1] for row in cur.fetchall()]:
+                    cur.execute(f"PRAGMA index_info({name})")
+                    cols = tuple(row[2] for row in sorted(cur.fetchall()))
+                    result.setdefault(name, (table, cols))
+        else:
+            cur.execute("""
+                SELECT OBJECT_NAME(i.object_id) AS tabla, i.name, c.name AS columna
+                FROM sys.indexes i
+                JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+                JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+                WHERE i.name IS NOT NULL AND ic.is_included_column = 0
+                  AND OBJECTPROPERTY(i.object_id, 'IsUserTable') = 1
+                ORDER BY i.object_id, i.index_id, ic.key_ordinal
+            """)
+            for table, name, column in cur.fetchall():
+                if table.lower() in tables:
+                    entry = result.setdefault(name, (table.lower(), ()))
+                    result[name] = (entry[0], entry[1] + (column,))
+    finally:
+        cur.close()
+    return result
+
+
+# ========= ASESOR DE ÍNDICES =========
+_SQL_START_RE = re.compile(r'^\s*(SELECT|WITH|UPDATE|DELETE)\b', re.I)
+_TABLE_RE = re.compile(
+    r'\b(?:FROM|JOIN|UPDATE)\s+\[?(\w+)\]?(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|ON|LEFT|RIGHT|INNER|'
+    r'OUTER|CROSS|GROUP|ORDER|SET|WITH|UNION|HAVING)\b)(\w+))?', re.I)
+_COLUMN = r'(?:\[?(\w+)\]?\.)?\[?([A-Za-z_]\w*)\]?'
+_COMPARE_RE = re.compile(_COLUMN + r'\s*(=|>=|<=|<>|<|>|\bBETWEEN\b|\bIN\b)\s*(' + _COLUMN + r'|\?|\()', re.I)
+_FUNCTION_RE = re.compile(
+    r'\b(CONVERT|CAST|DATEPART|DATEADD|DATEDIFF|YEAR|MONTH|DAY|ISNULL|COALESCE|LOWER|UPPER|'
+    r'LTRIM|RTRIM|SUBSTRING)\s*\(([^()]*)\)\s*(=|>=|<=|<>|<|>|\bBETWEEN\b|\bIN\b)', re.I)
+_CLAUSE_RE = re.compile(r'\b(WHERE|ON|ORDER\s+BY|GROUP\s+BY|PARTITION\s+BY|HAVING|SELECT|FROM|SET|'
+                        r'LEFT|RIGHT|INNER|JOIN|UNION|VALUES|OVER|ROWS|LIMIT)\b', re.I)
+_KEYWORDS = {'AND', 'OR', 'NOT', 'NULL', 'IS', 'ASC', 'DESC', 'AS', 'CASE', 'WHEN', 'THEN', 'ELSE',
+             'END', 'TOP', 'DISTINCT', 'BY', 'ON', 'IN', 'BETWEEN', 'LIKE', 'EXISTS'}
+
+
+def sql_from_source(paths):
+    """SQL statements found as string literals (and f-strings) in `paths`.
+
+    The interpolated parts of an f-string are dropped, so dynamic WHERE
+    clauses only show up in the statements captured at runtime.
+    """
+    found = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Constant) and isinstance(node.value, str):
+                text = node.value
+            elif isinstance(node, ast.JoinedStr):
+                text = ''.join(v.value if isinstance(v, ast.Constant) else ' ' for v in node.values)
+            else:
+                continue
+            if _SQL_START_RE.match(text):
+                found.append((f"{os.path.basename(path)}:{node.lineno}", text))
+    return found
+
+
+def sql_from_metrics(text):
+    """Normalized statements from a /metrics dump (sisresiduos_sql_statement_info)."""
+    found = []
+    for line in text.splitlines():
+        m = re.match(r'sisresiduos_sql_statement_info\{statement="(\w+)",sql="(.*)"\} ', line)
+        if m:
+            sql = m.group(2).replace('\\"', '"').replace('\\\\', '\\')
+            if _SQL_START_RE.match(sql):
+                found.append((f"metrics:{m.group(1)}", sql))
+    return found
+
+
+def _clauses(sql):
+    """[(clausula, texto)] partiendo en las palabras clave de primer nivel."""
+    parts, last, name = [], 0, ''
+    for m in _CLAUSE_RE.finditer(sql):
+        parts.append((name, sql[last:m.start()]))
+        name, last = ' '.join(m.group(1).upper().split()), m.end()
+    parts.append((name, sql[last:]))
+    return parts
+
+
+def analyze_query(sql, columns):
+    """Usage of each table's columns by one statement.
+
+    `columns` is {table: [column, ...]} and is used to attribute bare column
+    names. Returns ({table: usage}, findings) where usage has the keys eq,
+    range, join, order and select (lists of column names).
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    aliases = {}
+    for m in _TABLE_RE.finditer(sql):
+        table = m.group(1).lower()
+        if table in columns:
+            aliases[(m.group(2) or table).lower()] = table
+            aliases[table] = table
+    tables = set(aliases.values())
+    usage = {t: {'eq': [], 'range': [], 'join': [], 'order': [], 'select': []} for t in tables}
+    findings = []
+
+    def owner(alias, column):
+        if alias:
+            table = aliases.get(alias.lower())
+            return table if table and column in columns[table] else None
+        matches = [t for t in tables if column in columns[t]]
+        return matches[0] if len(matches) == 1 else None
+
+    def add(kind, table, column):
+        if table and column not in usage[table][kind]:
+            usage[table][kind].append(column)
+
+    joins = []
+    for clause, text in _clauses(sql):
+        if clause in ('WHERE', 'ON', 'HAVING'):
+            for m in _FUNCTION_RE.finditer(text):
+                args = m.group(2)
+                for col in re.finditer(_COLUMN, args):
+                    if owner(col.group(1), col.group(2)):
+                        findings.append(f"{m.group(1).upper()}({args.strip()}) en {clause}: "
+                                        f"la columna no puede usar un índice; usar un rango")
+                        break
+            # Dentro de un OR una igualdad no sirve para buscar en el índice
+            has_or = re.search(r'\bOR\b', text, re.I) is not None
+            for m in _COMPARE_RE.finditer(text):
+                table = owner(m.group(1), m.group(2))
+                op = m.group(3).upper()
+                other = owner(m.group(5), m.group(6)) if m.group(6) else None
+                if other and op == '=':
+                    if table:
+                        joins.append((table, m.group(2), other, m.group(6)))
+                elif op in ('=', 'IN') and not has_or:
+                    add('eq', table, m.group(2))
+                elif op != '<>':
+                    add('range', table, m.group(2))
+        elif clause in ('ORDER BY', 'PARTITION BY'):
+            for col in re.finditer(_COLUMN, text):
+                if col.group(2).upper() not in _KEYWORDS:
+                    add('order', owner(col.group(1), col.group(2)), col.group(2))
+        elif clause in ('SELECT', 'GROUP BY', 'SET'):
+            for col in re.finditer(_COLUMN, text):
+                if col.group(2).upper() not in _KEYWORDS:
+                    add('select', owner(col.group(1), col.group(2)), col.group(2))
+
+    # En un join, la tabla filtrada (y la otra no) es la que dirige: su
+    # columna de join no se busca en un índice, la de la otra tabla sí.
+    def filtered(table):
+        return bool(usage[table]['eq'] or usage[table]['range'])
+
+    for table, column, other, other_column in joins:
+        drives = filtered(table) and not filtered(other)
+        if not drives:
+            add('join', table, column)
+        if not (filtered(other) and not filtered(table)):
+            add('join', other, other_column)
+    return usage, findings
+
+
+def _candidates(table_usage):
+    """(columnas de búsqueda, clave) de los índices útiles para una tabla."""
+    u = table_usage
+    keys = []
+    # Cada join se busca por separado: una columna por tabla relacionada
+    seeks = [u['eq'] + [c] for c in u['join'] if c not in u['eq']] or ([u['eq']] if u['eq'] else [])
+    for seek in seeks:
+        tail = u['range'][:1] or [c for c in u['order'] if c not in seek]
+        keys.append((tuple(seek), tuple(seek + [c for c in tail if c not in seek])))
+    tail = u['range'][:1] or u['order'][:1]
+    if tail and not u['eq']:
+        # Sin igualdades la tabla también puede recorrerse por rango/orden
+        keys.append(((), tuple(tail + [c for c in u['order'] if c not in tail])))
+    return keys
+
+
+def _covered(key, indexes, table):
+    """Existe un índice de `table` cuya clave empieza por `key`."""
+    return any(t == table and cols[:len(key)] == key for t, cols in indexes)
+
+
+def advise(statements, columns, indexes, planned=INDEXES, row_counts=None, min_rows=10000):
+    """Missing indexes for `statements` given the current `indexes`.
+
+    Returns (recommendations, findings). Each recommendation is a dict with
+    table, columns, include, sources and planned (the IndexSpec in INDEXES
+    that would cover it, if any). Tables with fewer than `min_rows` rows
+    are skipped.
+    """
+    existing = [(t.lower(), tuple(c.lower() for c in cols)) for t, cols in indexes.values()]
+    pending = [(p.table.lower(), tuple(c.lower() for c in p.columns)) for p in planned]
+    lower_columns = {t.lower(): cols for t, cols in columns.items()}
+    pk = {t: cols for name, (t, cols) in indexes.items() if name.lower().startswith('pk_')}
+    recs, findings = {}, []
+
+    for source, sql in statements:
+        usage, problems = analyze_query(sql, lower_columns)
+        findings.extend(f"{source}: {p}" for p in problems)
+        for table, u in usage.items():
+            if row_counts is not None and row_counts.get(table, 0) < min_rows:
+                continue
+            table_pk = {c.lower() for c in pk.get(table, ())}
+            for seek, key in _candidates(u):
+                # La clave primaria va implícita al final de todo índice
+                while len(key) > 1 and key[-1].lower() in table_pk:
+                    key = key[:-1]
+                lkey = tuple(c.lower() for c in key)
+                # Basta un índice que ya resuelva las igualdades y joins; el
+                # rango sobre una columna posterior sólo filtra lo encontrado
+                if _covered(lkey, existing, table) or (
+                        seek and _covered(tuple(c.lower() for c in seek), existing, table)):
+                    continue
+                skip = {c.lower() for c in key} | table_pk
+                include = [c for c in u['select'] + u['order'] + u['range'] if c.lower() not in skip]
+                rec = recs.setdefault((table, key), {
+                    'table': table, 'columns': key, 'include': [], 'sources': [],
+                    'planned': next((p.name for p, pl in zip(planned, pending)
+                                     if pl[0] == table and pl[1][:len(lkey)] == lkey), None),
+                })
+                rec['include'].extend(c for c in include if c not in rec['include'])
+                if source not in rec['sources']:
+                    rec['sources'].append(source)
+
+    # Una clave que es prefijo de otra recomendada no hace falta aparte
+    keys = list(recs)
+    for table, key in keys:
+        if any(t == table and k != key and k[:len(key)] == key for t, k in keys):
+            longer = next(recs[(t, k)] for t, k in keys if t == table and k != key and k[:len(key)] == key)
+            longer['sources'].extend(s for s in recs[(table, key)]['sources'] if s not in longer['sources'])
+            del recs[(table, key)]
+    return list(recs.values()), sorted(set(findings))
+
+
+def table_row_counts(conn, tables):
+    cur = conn.cursor()
+    try:
+        counts = {}
+        for table in tables:
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = cur.fetchone()[0]
+        return counts
+    finally:
+        cur.close()
+
+
+def app_sources():
+    here = os.path.dirname(os.path.abspath(__file__))
+    skip = {'inspect_schema.py', 'bench.py', 'showcolums.py'}
+    return sorted(p for p in glob.glob(os.path.join(here, '*.py')) if os.path.basename(p) not in skip)
+
+
+def read_metrics(location):
+    if location.startswith(('http://', 'https://')):
+        from urllib.request import urlopen
+
+        with urlopen(location, timeout=30) as resp:
+            return resp.read().decode('utf-8')
+    with open(location, encoding='utf-8') as f:
+        return f.read()
+
+
+def run_advisor(conn, backend, database, metrics=None, min_rows=10000):
+    tables = TABLES + ['mediciones_rollup']
+    columns = {t: [c for c, _ in cols] for t, cols in fetch_columns(conn, database, backend, tables).items()}
+    indexes = fetch_indexes(conn, backend, tables)
+    statements = sql_from_source(app_sources())
+    if metrics:
+        statements += sql_from_metrics(read_metrics(metrics))
+    counts = table_row_counts(conn, [t for t in tables if t in {c.lower() for c in columns}])
+
+    recs, findings = advise(statements, columns, indexes, row_counts=counts, min_rows=min_rows)
+    print(f"{len(statements)} consultas analizadas, {len(indexes)} índices existentes")
+    print("\n=== Predicados que no pueden usar índices ===")
+    for finding in findings:
+        print(f"  {finding}")
+    if not findings:
+        print("  [ninguno]")
+    print("\n=== Índices que faltan ===")
+    for rec in recs:
+        include = f" INCLUDE ({', '.join(rec['include'])})" if rec['include'] else ""
+        status = f"pendiente: migrate crea {rec['planned']}" if rec['planned'] else "sin migración"
+        print(f"  {rec['table']} ({', '.join(rec['columns'])}){include}  [{status}]")
+        print(f"      usado por: {', '.join(rec['sources'][:6])}{' ...' if len(rec['sources']) > 6 else ''}")
+    if not recs:
+        print("  [ninguno]")
+    return recs, findings
+
+
 def inspect_table(table_name):
     """Print all columns for a given table."""
     conn = get_mssql_connection()
-    cur = conn.cursor()
-    
+
     print(f"\n=== Columns in table: {table_name} ===")
-    cur.execute("""
-        SELECT COLUMN_NAME, DATA_TYPE
-        FROM INFORMATION_SCHEMA.COLUMNS
-        WHERE TABLE_NAME = ? AND TABLE_CATALOG = ?
-        ORDER BY ORDINAL_POSITION
-    """, (table_name, 'SisResiduos'))
-    
-    rows = cur.fetchall()
+    rows = fetch_columns(conn, 'SisResiduos', tables=[table_name]).get(table_name.lower(), [])
     for row in rows:
         print(f"  {row[0]:30} {row[1]}")
-    
+
     if not rows:
         print(f"  [No columns found or table does not exist]")
-    
-    cur.close()
+
     conn.close()
 
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Esquema, asesor de índices y migraciones')
+    sub = parser.add_subparsers(dest='cmd')
+    adv = sub.add_parser('advise', help='reportar índices que faltan')
+    adv.add_argument('--metrics', help='volcado o URL de /metrics con las consultas en ejecución')
+    adv.add_argument('--min-rows', type=int, default=10000, help='ignorar tablas más pequeñas')
+    mig = sub.add_parser('migrate', help='crear los índices de INDEXES que falten')
+    mig.add_argument('--dry-run', action='store_true', help='sólo mostrar el DDL')
+    args = parser.parse_args(argv)
+
+    if args.cmd is None:
+        print("Inspecting SQL Server schema...")
+        for table in TABLES:
+            try:
+                inspect_table(table)
+            except Exception as e:
+                print(f"\n=== Error inspecting {table} ===")
+                print(f"  {e}")
+        print("\n[Done]")
+        return
+
+    # La conexión sale de la configuración de la app (DB_BACKEND, SQLITE_PATH, ...)
+    from app import crear_app
+
+    app = crear_app()
+    pool = app.extensions['db_pool']
+    backend = pool.backend.name
+    conn = pool.acquire()
+    try:
+        if args.cmd == 'advise':
+            run_advisor(conn, backend, app.config['SQL_SERVER_DB'], args.metrics, args.min_rows)
+        else:
+            created = migrate(conn, backend, dry_run=args.dry_run)
+            for spec in INDEXES:
+                if spec.name in created:
+                    print(index_ddl(spec, backend) + (";" if args.dry_run else ""))
+            print(f"[Done] {len(created)} índices {'por crear' if args.dry_run else 'creados'}, "
+                  f"{len(INDEXES) - len(created)} ya existían")
+    finally:
+        pool.release(conn)
+
+
 if __name__ == '__main__':
-    tables = ['contenedores', 'mediciones', 'sensores', 'tiposresiduos', 'ubicaciones', 'tipossensores']
-    print("Inspecting SQL Server schema...")
-    for table in tables:
-        try:
-            inspect_table(table)
-        except Exception as e:
-            print(f"\n=== Error inspecting {table} ===")
-            print(f"  {e}")
-    
-    print("\n[Done]")
+    import sys
+
+    main(sys.argv[1:])
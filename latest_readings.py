@@ -0,0 +1,161 @@
+"""
+Índice en memoria de la última medición por contenedor.
+
+Se carga una vez con una sola consulta (ROW_NUMBER por IdContenedor) y
+después se mantiene con las mediciones que inserta la propia aplicación.
+Como cada worker de gunicorn tiene su propio índice, cada `max_age`
+segundos se suman las mediciones que hayan escrito otros procesos
+(IdMedicion mayor que el último visto), en un hilo aparte si hay pool, así
+que ninguna petición vuelve a recorrer la tabla completa.
+
+Por contenedor se guarda la última lectura tal cual (con sus banderas en
+'Anomalia') y, aparte, el último llenado válido según fill_ok(): es el que
+devuelve fill_level() y el que alimenta niveles, críticos y alertas.
+"""
+import logging
+import threading
+import time
+
+from anomalies import ANOMALIAS_JOIN, FILL_OK_SQL, fill_ok
+
+log = logging.getLogger('sisresiduos.latest')
+
+LOAD_SQL = f"""
+    SELECT IdContenedor, IdSensor, FechaHora, PorcentajeLlenado, PesoKg, Temperatura, Tipo, rn, ok
+    FROM (
+        SELECT IdContenedor, IdSensor, FechaHora, PorcentajeLlenado, PesoKg, Temperatura, Tipo, ok,
+            ROW_NUMBER() OVER (
+                PARTITION BY IdContenedor
+                ORDER BY FechaHora DESC, IdMedicion DESC
+            ) AS rn,
+            ROW_NUMBER() OVER (
+                PARTITION BY IdContenedor, ok
+                ORDER BY FechaHora DESC, IdMedicion DESC
+            ) AS rn_ok
+        FROM (
+            SELECT s.IdContenedor, m.IdMedicion, m.IdSensor, m.FechaHora, m.PorcentajeLlenado,
+                m.PesoKg, m.Temperatura, a.Tipo,
+                CASE WHEN m.PorcentajeLlenado IS NOT NULL AND {FILL_OK_SQL} THEN 1 ELSE 0 END AS ok
+            FROM mediciones m
+            JOIN sensores s ON m.IdSensor = s.IdSensor
+            {ANOMALIAS_JOIN}
+        ) lecturas
+    ) ultimas
+    WHERE rn = 1 OR (ok = 1 AND rn_ok = 1)
+"""
+
+CATCH_UP_SQL = f"""
+    SELECT m.IdMedicion, s.IdContenedor, m.IdSensor, m.FechaHora, m.PorcentajeLlenado,
+        m.PesoKg, m.Temperatura, a.Tipo
+    FROM mediciones m
+    JOIN sensores s ON m.IdSensor = s.IdSensor
+    {ANOMALIAS_JOIN}
+    WHERE m.IdMedicion > ?
+"""
+
+LAST_ID_SQL = "SELECT TOP 1 IdMedicion FROM mediciones ORDER BY IdMedicion DESC"
+
+FIELDS = ('IdSensor', 'FechaHora', 'PorcentajeLlenado', 'PesoKg', 'Temperatura', 'Anomalia')
+
+
+class LatestReadings:
+    def __init__(self, max_age=300, pool=None):
+        self.max_age = max_age
+        self.pool = pool
+        self._by_container = {}
+        self._fill = {}             # IdContenedor -> (FechaHora, último llenado válido)
+        self._last_id = 0
+        self._loaded_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def load(self, conn):
+        cur = conn.cursor()
+        try:
+            # Se toma antes de la carga: lo que entre mientras tanto lo suma catch_up()
+            cur.execute(LAST_ID_SQL)
+            row = cur.fetchone()
+            last_id = row[0] if row else 0
+            cur.execute(LOAD_SQL)
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        latest, fill = {}, {}
+        for id_contenedor, *values, rn, ok in rows:
+            reading = dict(zip(FIELDS, values))
+            if rn == 1:
+                latest[id_contenedor] = reading
+            if ok == 1:
+                fill[id_contenedor] = (reading['FechaHora'], reading['PorcentajeLlenado'])
+        with self._lock:
+            self._by_container, self._fill = latest, fill
+            self._last_id = last_id
+            self._loaded_at = time.monotonic()
+
+    def catch_up(self, conn):
+        """Suma las mediciones con IdMedicion mayor que el último visto."""
+        cur = conn.cursor()
+        try:
+            cur.execute(CATCH_UP_SQL, (self._last_id,))
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        self.apply([dict(zip(('IdContenedor',) + FIELDS, r[1:])) for r in rows])
+        with self._lock:
+            self._last_id = max([self._last_id] + [r[0] for r in rows])
+            self._loaded_at = time.monotonic()
+
+    def ensure_loaded(self, conn):
+        if self._loaded_at is None:
+            self.load(conn)
+        elif time.monotonic() - self._loaded_at > self.max_age:
+            if self.pool is None:
+                self.catch_up(conn)
+                return
+            with self._lock:
+                if self._refreshing:
+                    return
+                self._refreshing = True
+            threading.Thread(target=self._refresh, name='latest-readings', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            conn = self.pool.acquire()
+            try:
+                self.catch_up(conn)
+            finally:
+                self.pool.release(conn)
+        except Exception:
+            # Se reintenta en la siguiente petición; mientras tanto sirve lo que hay
+            log.exception("No se pudieron recoger las mediciones nuevas")
+        finally:
+            self._refreshing = False
+
+    def apply(self, readings):
+        """Incorpora mediciones recién insertadas (dicts con IdContenedor)."""
+        with self._lock:
+            for r in readings:
+                id_contenedor = r['IdContenedor']
+                current = self._by_container.get(id_contenedor)
+                if current is None or r['FechaHora'] >= current['FechaHora']:
+                    self._by_container[id_contenedor] = {k: r.get(k) for k in FIELDS}
+                fill = self._fill.get(id_contenedor)
+                if fill_ok(r) and (fill is None or r['FechaHora'] >= fill[0]):
+                    self._fill[id_contenedor] = (r['FechaHora'], r['PorcentajeLlenado'])
+
+    def get(self, id_contenedor):
+        return self._by_container.get(id_contenedor)
+
+    def fill_level(self, id_contenedor, default=0):
+        """Último llenado no marcado como anómalo."""
+        fill = self._fill.get(id_contenedor)
+        return default if fill is None else fill[1]
+
+    def filled_at(self, id_contenedor):
+        """FechaHora del llenado que devuelve fill_level(), o None."""
+        fill = self._fill.get(id_contenedor)
+        return None if fill is None else fill[0]
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._by_container)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Carga masiva de mediciones históricas desde archivos CSV o NDJSON.
+
+    python loader.py historico_2023.csv [otro.ndjson ...] [--workers 8] [--bloque-mb 16]
+
+Las columnas son las de /mediciones/exportar_csv (id, sensor, fecha_hora,
+porcentaje, peso, temp; `id` se ignora y la base asigna uno nuevo), así que
+una exportación se puede volver a cargar tal cual. Cada línea es una
+lectura.
+
+El archivo se reparte en bloques de `--bloque-mb` que terminan en fin de
+línea. Un pool de procesos lee, parsea y valida cada bloque (las mismas
+reglas que /mediciones/ingest) contra el mapa IdSensor -> contenedor
+precargado una sola vez, y acumula sus agregados; el proceso principal sólo
+inserta cada bloque en una transacción (executemany por lotes más el upsert
+de los agregados) mientras los workers preparan los siguientes. Hay como
+mucho 2 x workers bloques en vuelo, así que la memoria no depende del tamaño
+del archivo.
+
+Después de cada bloque se guarda un checkpoint (<archivo>.carga.json) con el
+byte y la línea por donde seguir: si la carga se interrumpe, al relanzarla
+continúa desde ahí. Si el proceso muere justo entre el commit de un bloque
+y la escritura del checkpoint, ese bloque se vuelve a insertar.
+
+Las banderas de anomalías no se calculan en la carga (el detector necesita
+las lecturas en orden por sensor): al terminar conviene correr
+`python anomalies.py backfill --desde <primera fecha cargada>`.
+"""
+import csv
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from ingest import iter_ndjson, validate, insert_readings
+from rollups import accumulate
+
+
+class _FixedDirectory:
+    """Mapa de sensores ya cargado, con la interfaz de SensorDirectory."""
+
+    def __init__(self, sensors):
+        self._sensors = sensors
+
+    def resolve(self, conn, ids):
+        return self._sensors
+
+
+# ========= WORKERS (parseo y validación) =========
+_worker = {}
+
+
+def _init_worker(fmt, header, sensors, rollups):
+    _worker.update(fmt=fmt, header=header, directory=_FixedDirectory(sensors), rollups=rollups)
+
+
+def _csv_objects(lines, header):
+    """Como iter_ndjson para líneas CSV en bytes: una línea que no es UTF-8
+    válido o que el lector CSV no acepta se rechaza sola y no corre la
+    numeración de las demás."""
+    undecodable = {}
+
+    def decoded():
+        for n, line in enumerate(lines, 1):
+            try:
+                yield line.decode('utf-8')
+            except UnicodeDecodeError as e:
+                undecodable[n] = e
+                yield ''
+
+    reader = csv.reader(decoded())
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # El lector sigue en la línea siguiente
+            yield reader.line_num, e
+            continue
+        n = reader.line_num
+        if n in undecodable:
+            yield n, undecodable.pop(n)
+            continue
+        if not row:
+            continue
+        if len(row) != len(header):
+            yield n, ValueError(f"se esperaban {len(header)} columnas y hay {len(row)}")
+        else:
+            yield n, dict(zip(header, row))
+
+
+def parse_chunk(path, start, end):
+    """Lee y valida los bytes [start, end) de `path`.
+
+    Devuelve (filas válidas, deltas de agregados o None, rechazos con la
+    línea relativa al bloque, líneas del bloque).
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        # Se corta en bytes y sólo por \n, como iter_chunks: splitlines()
+        # también corta en \x0b, \x1c o \u2028 y correría la numeración
+        lines = f.read(end - start).split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+    if _worker['fmt'] == 'csv':
+        objects = _csv_objects(lines, _worker['header'])
+    else:
+        objects = iter_ndjson(lines)
+    rows, rejected = validate(objects, None, _worker['directory'])
+    if _worker['fmt'] == 'csv':
+        for r in rejected:
+            if r['error'].startswith('JSON inválido: '):
+                r['error'] = 'CSV inválido: ' + r['error'][len('JSON inválido: '):]
+    deltas = accumulate(rows) if _worker['rollups'] else None
+    return rows, deltas, rejected, len(lines)
+
+
+# ========= BLOQUES Y CHECKPOINT =========
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext in ('.ndjson', '.jsonl', '.json'):
+        return 'ndjson'
+    raise ValueError(f"formato desconocido para {path} (se esperaba .csv o .ndjson)")
+
+
+def read_header(path):
+    """(columnas, byte donde empiezan los datos) de un CSV."""
+    with open(path, 'rb') as f:
+        line = f.readline()
+        offset = f.tell()
+    header = [h.strip().lower() for h in next(csv.reader([line.decode('utf-8-sig')]))]
+    missing = {'sensor', 'fecha_hora'} - set(header)
+    if missing:
+        raise ValueError(f"faltan columnas en la cabecera: {', '.join(sorted(missing))}")
+    return header, offset
+
+
+def iter_chunks(path, start, size, chunk_bytes):
+    """Rangos (inicio, fin) de unos `chunk_bytes` que terminan en fin de línea."""
+    with open(path, 'rb') as f:
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size) if start + chunk_bytes < size else size
+            yield start, end
+            start = end
+
+
+class Checkpoint:
+    """Progreso de la carga de un archivo, guardado junto a él."""
+
+    def __init__(self, path, data_path):
+        self.path = path
+        stat = os.stat(data_path)
+        self.identity = {'archivo': os.path.abspath(data_path), 'tamano': stat.st_size, 'mtime': stat.st_mtime}
+        self.state = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding='utf-8') as f:
+            state = json.load(f)
+        if {k: state.get(k) for k in self.identity} != self.identity:
+            raise ValueError(f"{self.path} es de otra versión del archivo; bórrelo para cargar desde el inicio")
+        self.state = state
+        return state
+
+    def save(self, **progress):
+        self.state = dict(self.identity, **progress)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2, default=str)
+        os.replace(tmp, self.path)
+
+
+# ========= CARGA =========
+def load_file(conn, path, sensors, rollups=None, workers=None, chunk_bytes=16 << 20,
+              batch_size=5000, checkpoint=True, rejects=None, log=print):
+    """Carga `path` en mediciones y devuelve un resumen con filas/s.
+
+    `sensors` es el mapa IdSensor -> (IdContenedor, IdTipoResiduo);
+    `workers=0` parsea en el mismo proceso; `rejects` es un archivo abierto
+    donde se escribe cada rechazo como una línea JSON.
+    """
+    fmt = detect_format(path)
+    header, start = read_header(path) if fmt == 'csv' else (None, 0)
+    size = os.path.getsize(path)
+    line = 2 if fmt == 'csv' else 1
+    inserted = rejected = 0
+    first = None
+
+    ckpt = Checkpoint(path + '.carga.json', path) if checkpoint else None
+    state = ckpt.load() if ckpt else None
+    if state:
+        if state.get('completo'):
+            if log:
+                log(f"  {path}: ya cargado ({state['insertadas']:,} filas)")
+            return dict(state, filas_s=0.0)
+        start, line = state['offset'], state['linea']
+        inserted, rejected = state['insertadas'], state['rechazadas']
+        first = state.get('primera_fecha')
+        if log:
+            log(f"  {path}: se retoma en la línea {line:,} ({start / size:.0%})")
+
+    workers = os.cpu_count() if workers is None else workers
+    began, resumed_at, resumed_rows = time.perf_counter(), start, inserted
+    chunks = iter_chunks(path, start, size, chunk_bytes)
+    init = (fmt, header, sensors, rollups is not None)
+    executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=init) if workers else None
+    if executor is None:
+        _init_worker(*init)
+
+    def submit(pending):
+        span = next(chunks, None)
+        if span is not None:
+            if executor is None:
+                pending.append((span, parse_chunk(path, *span)))
+            else:
+                pending.append((span, executor.submit(parse_chunk, path, *span)))
+
+    try:
+        pending = deque()
+        for _ in range(max(1, workers) * 2):
+            submit(pending)
+        while pending:
+            (_, end), result = pending.popleft()
+            rows, deltas, bad, n_lines = result if executor is None else result.result()
+            submit(pending)
+
+            if rows:
+                insert_readings(conn, rows, rollups, batch_size=batch_size, deltas=deltas)
+                oldest = min(r['FechaHora'] for r in rows)
+                first = oldest if first is None or str(oldest) < str(first) else first
+            for r in bad:
+                r['row'] += line - 1
+                if rejects is not None:
+                    rejects.write(json.dumps(dict(r, archivo=path), ensure_ascii=False) + '\n')
+            inserted += len(rows)
+            rejected += len(bad)
+            line += n_lines
+            if ckpt:
+                ckpt.save(offset=end, linea=line, insertadas=inserted, rechazadas=rejected,
+                          primera_fecha=first, completo=end >= size)
+            if log:
+                elapsed = time.perf_counter() - began
+                log(f"  {path}: {end / 2**20:,.0f}/{size / 2**20:,.0f} MB  {inserted:,} filas "
+                    f"({(inserted - resumed_rows) / elapsed:,.0f} filas/s)  {rejected:,} rechazadas")
+                for r in bad[:3] if rejects is None else ():
+                    log(f"    línea {r['row']}: {r['error']}")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - began
+    return {
+        'archivo': path,
+        'insertadas': inserted,
+        'rechazadas': rejected,
+        'primera_fecha': first,
+        'segundos': round(elapsed, 3),
+        'filas_s': round((inserted - resumed_rows) / elapsed, 1) if elapsed else 0.0,
+        'mb_s': round((size - resumed_at) / 2**20 / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import crear_app
+    from ingest import SensorDirectory
+
+    parser = argparse.ArgumentParser(description="Carga masiva de mediciones desde CSV/NDJSON")
+    parser.add_argument('archivos', nargs='+')
+    parser.add_argument('--workers', type=int, default=None, help='procesos de parseo (0: en el mismo proceso)')
+    parser.add_argument('--bloque-mb', type=float, default=16, help='tamaño de cada bloque/transacción')
+    parser.add_argument('--rechazos', help='escribir los rechazos en este archivo NDJSON')
+    parser.add_argument('--sin-checkpoint', action='store_true')
+    parser.add_argument('--sin-agregados', action='store_true',
+                        help='no actualizar mediciones_rollup por bloque; recalcularla al final')
+    args = parser.parse_args()
+
+    app = crear_app()
+    pool = app.extensions['db_pool']
+    rollups = app.extensions['rollups']
+    conn = pool.acquire()
+    rejects = open(args.rechazos, 'a', encoding='utf-8') if args.rechazos else None
+    try:
+        sensors = SensorDirectory().resolve(conn, ())
+        for path in args.archivos:
+            summary = load_file(conn, path, sensors, None if args.sin_agregados else rollups,
+                                workers=args.workers, chunk_bytes=int(args.bloque_mb * 2**20),
+                                batch_size=app.config['INGEST_BATCH_SIZE'],
+                                checkpoint=not args.sin_checkpoint, rejects=rejects)
+            print(f"  {summary}")
+            if summary['primera_fecha']:
+                print(f"  banderas de anomalías: python anomalies.py backfill "
+                      f"--desde {str(summary['primera_fecha'])[:10]}")
+        if args.sin_agregados:
+            print("  recalculando agregados...")
+            rollups.rebuild(conn)
+    finally:
+        if rejects is not None:
+            rejects.close()
+        pool.release(conn)
+    print("[Done]")
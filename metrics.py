@@ -0,0 +1,299 @@
+"""
+Instrumentación de SQL y endpoint /metrics (formato texto de Prometheus).
+
+Las conexiones del pool se envuelven al crearse, así que todo cursor de la
+aplicación (RowCursor, exportaciones, ingesta, índices en memoria) queda
+medido: latencia por sentencia (execute + fetch), filas devueltas, tiempo
+de espera por una conexión y totales por ruta. Las sentencias se agrupan
+por su SQL normalizado y las que pasan de `slow_ms` van al log.
+"""
+import contextvars
+import hashlib
+import logging
+import re
+import threading
+import time
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_log = logging.getLogger('sisresiduos.sql')
+
+_current_request = contextvars.ContextVar('sisresiduos_request', default=None)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w\]])-?\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    """SQL sin literales ni espacios redundantes, para agrupar sentencias."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('(?...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'n')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value):
+        self.total += value
+        self.n += 1
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels=''):
+        sep = ',' if labels else ''
+        out, cumulative = [], 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            out.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        out.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.n}')
+        out.append(f'{name}_sum{{{labels}}} {self.total:.6f}' if labels else f'{name}_sum {self.total:.6f}')
+        out.append(f'{name}_count{{{labels}}} {self.n}' if labels else f'{name}_count {self.n}')
+        return out
+
+
+class RequestStats:
+    """Acumulador de una petición; lo comparten los hilos del QueryExecutor,
+    así que SQLMetrics sólo lo actualiza con su lock tomado."""
+    __slots__ = ('route', 'sql_count', 'sql_time', 'rows', 'acquire_time', 'started')
+
+    def __init__(self, route):
+        self.route = route
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        self.acquire_time = 0.0
+        self.started = time.perf_counter()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+class SQLMetrics:
+    def __init__(self, slow_ms=500.0):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._statements = {}      # id -> [sql normalizado, Histogram, filas]
+        self._ids = {}             # sql original -> id (evita normalizar cada vez)
+        self._acquire = Histogram()
+        self._routes = {}          # ruta -> [peticiones, seg, seg_sql, sentencias, filas, seg_espera]
+
+    # ----- registro -----
+    def statement_id(self, sql):
+        sid = self._ids.get(sql)
+        if sid is None:
+            normalized = normalize_sql(sql)
+            sid = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:10]
+            with self._lock:
+                self._statements.setdefault(sid, [normalized, Histogram(), 0])
+                if len(self._ids) < 10000:
+                    self._ids[sql] = sid
+        return sid
+
+    def record_statement(self, sid, elapsed, rows):
+        req = _current_request.get()
+        with self._lock:
+            entry = self._statements[sid]
+            entry[1].observe(elapsed)
+            entry[2] += rows
+            if req is not None:
+                req.sql_count += 1
+                req.sql_time += elapsed
+                req.rows += rows
+        if elapsed * 1000 >= self.slow_ms:
+            slow_log.warning("consulta lenta %.1f ms, %d filas [%s] %s", elapsed * 1000, rows,
+                             req.route if req else '-', self._statements[sid][0])
+
+    def record_acquire(self, elapsed):
+        req = _current_request.get()
+        with self._lock:
+            self._acquire.observe(elapsed)
+            if req is not None:
+                req.acquire_time += elapsed
+
+    def start_request(self, route):
+        req = RequestStats(route)
+        return req, _current_request.set(req)
+
+    def end_request(self, req, token, finish=True):
+        _current_request.reset(token)
+        if finish:
+            self._finish_request(req)
+
+    def track_stream(self, iterable, req):
+        """Cuerpo en streaming: sus consultas corren después de la vista, así
+        que se atribuyen a la petición y ésta se cierra al terminar el envío."""
+        token = _current_request.set(req)
+        try:
+            yield from iterable
+        finally:
+            _current_request.reset(token)
+            self._finish_request(req)
+
+    def _finish_request(self, req):
+        elapsed = time.perf_counter() - req.started
+        with self._lock:
+            r = self._routes.setdefault(req.route, [0, 0.0, 0.0, 0, 0, 0.0])
+            r[0] += 1
+            r[1] += elapsed
+            r[2] += req.sql_time
+            r[3] += req.sql_count
+            r[4] += req.rows
+            r[5] += req.acquire_time
+
+    def wrap_connection(self, conn):
+        return InstrumentedConnection(conn, self)
+
+    # ----- exposición -----
+    def render(self, extra=()):
+        with self._lock:
+            statements = [(sid, e[0], e[1], e[2]) for sid, e in self._statements.items()]
+            routes = dict(self._routes)
+            lines = []
+            lines.append('# HELP sisresiduos_db_acquire_seconds Espera por una conexión del pool.')
+            lines.append('# TYPE sisresiduos_db_acquire_seconds histogram')
+            lines.extend(self._acquire.lines('sisresiduos_db_acquire_seconds'))
+
+            lines.append('# HELP sisresiduos_sql_statement_seconds Latencia por sentencia (execute + fetch).')
+            lines.append('# TYPE sisresiduos_sql_statement_seconds histogram')
+            for sid, _, hist, _ in statements:
+                lines.extend(hist.lines('sisresiduos_sql_statement_seconds', f'statement="{sid}"'))
+
+        lines.append('# HELP sisresiduos_sql_statement_rows_total Filas devueltas por sentencia.')
+        lines.append('# TYPE sisresiduos_sql_statement_rows_total counter')
+        for sid, _, _, rows in statements:
+            lines.append(f'sisresiduos_sql_statement_rows_total{{statement="{sid}"}} {rows}')
+
+        lines.append('# HELP sisresiduos_sql_statement_info SQL normalizado de cada sentencia.')
+        lines.append('# TYPE sisresiduos_sql_statement_info gauge')
+        for sid, sql, _, _ in statements:
+            lines.append(f'sisresiduos_sql_statement_info{{statement="{sid}",sql="{_escape(sql[:2000])}"}} 1')
+
+        route_metrics = (
+            ('requests_total', 'Peticiones atendidas', 0, 'counter'),
+            ('seconds_total', 'Tiempo total de las peticiones', 1, 'counter'),
+            ('sql_seconds_total', 'Tiempo en SQL', 2, 'counter'),
+            ('sql_statements_total', 'Sentencias SQL ejecutadas', 3, 'counter'),
+            ('sql_rows_total', 'Filas leídas', 4, 'counter'),
+            ('acquire_seconds_total', 'Espera por conexiones del pool', 5, 'counter'),
+        )
+        for suffix, help_text, idx, kind in route_metrics:
+            name = f'sisresiduos_route_{suffix}'
+            lines.append(f'# HELP {name} {help_text}, por ruta.')
+            lines.append(f'# TYPE {name} {kind}')
+            for route, values in sorted(routes.items()):
+                value = values[idx]
+                value = f'{value:.6f}' if isinstance(value, float) else value
+                lines.append(f'{name}{{route="{_escape(route)}"}} {value}')
+
+        for name, kind, help_text, value in extra:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# ========= ENVOLTORIOS DE CONEXIÓN Y CURSOR =========
+class InstrumentedCursor:
+    __slots__ = ('_cursor', '_metrics', '_conn', '_sid', '_elapsed', '_rows')
+
+    def __init__(self, cursor, metrics, conn):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_metrics', metrics)
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_sid', None)
+        object.__setattr__(self, '_elapsed', 0.0)
+        object.__setattr__(self, '_rows', 0)
+
+    def _finish(self):
+        if self._sid is not None:
+            self._metrics.record_statement(self._sid, self._elapsed, self._rows)
+            object.__setattr__(self, '_sid', None)
+
+    def _start(self, sql):
+        self._finish()
+        object.__setattr__(self, '_sid', self._metrics.statement_id(sql))
+        object.__setattr__(self, '_elapsed', 0.0)
+        object.__setattr__(self, '_rows', 0)
+
+    def _timed(self, fn, *args):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            object.__setattr__(self, '_elapsed', self._elapsed + time.perf_counter() - t0)
+
+    def execute(self, sql, *params):
+        self._start(sql)
+        self._timed(self._cursor.execute, sql, *params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._start(sql)
+        self._timed(self._cursor.executemany, sql, seq_of_params)
+        return self
+
+    def _count(self, rows):
+        object.__setattr__(self, '_rows', self._rows + len(rows))
+        return rows
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is not None:
+            object.__setattr__(self, '_rows', self._rows + 1)
+        return row
+
+    def fetchmany(self, *size):
+        return self._count(self._timed(self._cursor.fetchmany, *size))
+
+    def fetchall(self):
+        return self._count(self._timed(self._cursor.fetchall))
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+    @property
+    def connection(self):
+        return self._conn
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+
+class InstrumentedConnection:
+    __slots__ = ('_conn', '_metrics')
+
+    def __init__(self, conn, metrics):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_metrics', metrics)
+
+    def cursor(self):
+        return InstrumentedCursor(self._conn.cursor(), self._metrics, self)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
@@ -0,0 +1,78 @@
+"""
+Ejecución concurrente de consultas independientes.
+
+Cada tarea recibe su propia conexión del pool y corre en un ThreadPool
+acotado compartido por todas las peticiones. Si una consulta falla o pasa
+del tiempo límite, las demás siguen y el llamador recibe el error por
+nombre junto con los resultados que sí llegaron.
+"""
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class QueryExecutor:
+    def __init__(self, pool, max_workers=8, timeout=10.0):
+        self.pool = pool
+        self.timeout = timeout
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='query')
+
+    def _run_one(self, fn, deadline):
+        conn = self.pool.acquire()
+        broken = False
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise QueryTimeout("sin tiempo antes de empezar")
+            self.pool.backend.set_query_timeout(conn, remaining)
+            cur = conn.cursor()
+            try:
+                return fn(cur)
+            finally:
+                cur.close()
+        except QueryTimeout:
+            broken = True
+            raise
+        except Exception as e:
+            # Un error de SQL o de datos en fn no invalida la conexión
+            broken = self.pool.backend.connection_lost(e)
+            raise
+        finally:
+            try:
+                self.pool.backend.set_query_timeout(conn, None)
+            except Exception:
+                broken = True
+            self.pool.release(conn, broken=broken)
+
+    def run(self, tasks, timeout=None):
+        """Ejecuta {nombre: fn(cursor)} en paralelo.
+
+        Devuelve (resultados, errores): dos dicts por nombre. Una tarea que
+        no termina a tiempo aparece en errores con QueryTimeout.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        # Cada tarea corre con el contexto del llamador (métricas por petición)
+        futures = {name: self._threads.submit(contextvars.copy_context().run, self._run_one, fn, deadline)
+                   for name, fn in tasks.items()}
+        wait(futures.values(), timeout=timeout)
+
+        results, errors = {}, {}
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+                errors[name] = QueryTimeout(f"{name}: más de {timeout}s")
+                continue
+            exc = future.exception()
+            if exc is not None:
+                errors[name] = exc
+            else:
+                results[name] = future.result()
+        return results, errors
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,105 @@
+"""
+Caché de resultados de consultas con invalidación por escritura.
+
+Cada entrada declara de qué tablas depende; las rutas que escriben llaman a
+invalidate(tabla, ...) y se descartan justo las entradas afectadas. El
+tamaño se limita por número de entradas y por filas retenidas (LRU), y un
+TTL acota lo que puedan haber cambiado otros workers.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def _cost(value):
+    """Filas retenidas por un resultado (listas, dicts de listas, escalares)."""
+    if isinstance(value, (list, tuple)):
+        return max(len(value), 1)
+    if isinstance(value, dict):
+        return max(sum(_cost(v) for v in value.values()), 1)
+    return 1
+
+
+class QueryCache:
+    def __init__(self, max_entries=256, max_rows=200000, ttl=30.0):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._entries = OrderedDict()      # key -> (value, tables, cost, expires)
+        self._by_table = {}                # tabla -> {keys}
+        self._generation = {}              # tabla -> contador de invalidaciones
+        self._rows = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'expired': 0}
+
+    def _drop(self, key):
+        value, tables, cost, _ = self._entries.pop(key)
+        self._rows -= cost
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+
+    def get_or_compute(self, key, tables, compute, store=None):
+        """Devuelve el resultado en caché o lo calcula con compute().
+
+        `store`, si se indica, decide con el valor calculado si se guarda.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[3] > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[0]
+                self._drop(key)
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            generations = {t: self._generation.get(t, 0) for t in tables}
+
+        value = compute()
+        cost = _cost(value)
+
+        with self._lock:
+            # Si hubo una escritura mientras se calculaba, no se guarda
+            if any(self._generation.get(t, 0) != g for t, g in generations.items()):
+                return value
+            if cost > self.max_rows or (store is not None and not store(value)):
+                return value
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, frozenset(tables), cost, now + self.ttl)
+            self._rows += cost
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._drop(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+        return value
+
+    def invalidate(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._generation[table] = self._generation.get(table, 0) + 1
+                for key in list(self._by_table.get(table, ())):
+                    if key in self._entries:
+                        self._drop(key)
+                        self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            for table in list(self._by_table):
+                self._generation[table] = self._generation.get(table, 0) + 1
+            self._entries.clear()
+            self._by_table.clear()
+            self._rows = 0
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['entries'] = len(self._entries)
+            data['rows'] = self._rows
+        lookups = data['hits'] + data['misses']
+        data['hit_ratio'] = round(data['hits'] / lookups, 4) if lookups else 0.0
+        return data
@@ -0,0 +1,167 @@
+"""
+Difusión en vivo de mediciones y alertas por Server-Sent Events.
+
+El broker serializa cada evento una sola vez y lo reparte a la cola
+acotada de cada cliente conectado; un cliente lento pierde los eventos más
+viejos en vez de frenar a los demás. Nada de esto consulta la base de
+datos: los eventos salen de las mediciones que inserta la aplicación.
+
+Subscription usa una cola de hilos (un hilo por cliente, modo WSGI);
+AsyncSubscription entrega los eventos a una cola asyncio del event loop
+(modo ASGI, ver asgi.py) y así un cliente no ocupa ningún hilo.
+"""
+import asyncio
+import json
+import queue
+import threading
+
+from anomalies import fill_ok
+
+
+class TooManyClients(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def put(self, message):
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class AsyncSubscription:
+    """Suscripción atendida desde un event loop; put() es seguro desde cualquier hilo."""
+
+    def __init__(self, loop, max_queue):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def put(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # Loop cerrado: el cliente ya no existe
+            pass
+
+    def _put(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+class Broker:
+    def __init__(self, max_clients=500, max_queue=100):
+        self.max_clients = max_clients
+        self.max_queue = max_queue
+        self._subs = set()
+        self._lock = threading.Lock()
+        self._published = 0
+
+    def subscribe(self, sub=None):
+        if sub is None:
+            sub = Subscription(self.max_queue)
+        with self._lock:
+            if len(self._subs) >= self.max_clients:
+                raise TooManyClients(f"máximo {self.max_clients} clientes")
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def publish(self, event, data):
+        message = f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        with self._lock:
+            subs = list(self._subs)
+            self._published += 1
+        for sub in subs:
+            sub.put(message)
+
+    def stats(self):
+        with self._lock:
+            subs = list(self._subs)
+            published = self._published
+        return {
+            'clients': len(subs),
+            'published': published,
+            'dropped': sum(s.dropped for s in subs),
+        }
+
+
+def sse_stream(broker, sub, heartbeat=15.0):
+    """Generador de la respuesta text/event-stream de un cliente."""
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                yield sub.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": ping\n\n"
+    finally:
+        broker.unsubscribe(sub)
+
+
+def readings_publisher(broker, latest, threshold):
+    """Listener de mediciones: publica lecturas y cruces del umbral crítico.
+
+    Debe ejecutarse antes de que el índice `latest` incorpore el lote, para
+    comparar cada contenedor con su nivel anterior. Una lectura más vieja
+    que la guardada (atrasada o de una carga histórica) no es una lectura
+    en vivo ni una alerta, y un llenado marcado como anómalo tampoco cuenta.
+    """
+    def publish(rows):
+        newest, newest_ok = {}, {}
+        criticas = 0
+        for r in rows:
+            id_contenedor = r['IdContenedor']
+            before = latest.get(id_contenedor)
+            if before is not None and r['FechaHora'] < before['FechaHora']:
+                continue
+            current = newest.get(id_contenedor)
+            if current is None or r['FechaHora'] >= current['FechaHora']:
+                newest[id_contenedor] = r
+            if not fill_ok(r):
+                continue
+            if r['PorcentajeLlenado'] > threshold:
+                criticas += 1
+            current = newest_ok.get(id_contenedor)
+            if current is None or r['FechaHora'] >= current['FechaHora']:
+                newest_ok[id_contenedor] = r
+
+        lecturas, cruces = [], []
+        for id_contenedor, r in newest.items():
+            lecturas.append({
+                'contenedor': id_contenedor,
+                'sensor': r['IdSensor'],
+                'fecha_hora': r['FechaHora'].isoformat(' ', 'seconds'),
+                'porcentaje': r.get('PorcentajeLlenado'),
+                'temp': r.get('Temperatura'),
+            })
+        for id_contenedor, r in newest_ok.items():
+            filled_at = latest.filled_at(id_contenedor)
+            if filled_at is not None and r['FechaHora'] < filled_at:
+                continue
+            fill = r['PorcentajeLlenado']
+            previous = latest.fill_level(id_contenedor, None)
+            if fill > threshold and (previous is None or previous <= threshold):
+                cruces.append({'contenedor': id_contenedor, 'porcentaje': fill, 'anterior': previous})
+
+        broker.publish('lecturas', {'recibidas': len(rows), 'lecturas': lecturas})
+        if criticas or cruces:
+            broker.publish('alertas', {'nuevas_criticas': criticas, 'cruces': cruces})
+
+    return publish
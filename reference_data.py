@@ -0,0 +1,107 @@
+"""
+Tablas de referencia en memoria: tiposresiduos, ubicaciones y tipossensores.
+
+Son tablas pequeñas que casi no cambian y que casi todas las consultas de
+listado unían sólo para convertir IDs en nombres. Se cargan una vez por
+worker, indexadas por ID, y las consultas calientes devuelven los IDs y los
+resuelven aquí (resolve()), con menos JOINs y resultados más chicos.
+
+Se recargan cuando cambia la versión de alguna de las tablas en
+DataVersions, o cada `max_age` segundos para recoger lo que cambien otros
+procesos.
+"""
+import threading
+import time
+
+TABLES = ('tiposresiduos', 'ubicaciones', 'tipossensores')
+
+
+def _sorted_options(names):
+    return [{'id': i, 'nombre': n} for i, n in
+            sorted(names.items(), key=lambda item: (item[1] or '').casefold())]
+
+
+class ReferenceData:
+    def __init__(self, versions, max_age=600):
+        self.versions = versions
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._loaded_versions = None
+        self.tipos_residuo = {}     # IdTipoResiduo -> TipoResiduo
+        self.ubicaciones = {}       # IdUbicacion -> Direccion
+        self.coordenadas = {}       # IdUbicacion -> (lat, lng), sólo las que tienen
+        self.tipos_sensor = {}      # IdTipoSensor -> TipoSensor
+        self._options = {}
+
+    def _current_versions(self):
+        return tuple(self.versions.version(t) for t in TABLES)
+
+    def load(self, conn):
+        versions = self._current_versions()
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT IdTipoResiduo, TipoResiduo FROM tiposresiduos")
+            tipos_residuo = dict(cur.fetchall())
+            cur.execute("SELECT IdUbicacion, Direccion, Latitud, Longitud FROM ubicaciones")
+            ubicaciones, coordenadas = {}, {}
+            for id_ubicacion, direccion, lat, lng in cur.fetchall():
+                ubicaciones[id_ubicacion] = direccion
+                if lat is not None and lng is not None:
+                    # DECIMAL de SQL Server llega como Decimal
+                    coordenadas[id_ubicacion] = (float(lat), float(lng))
+            cur.execute("SELECT IdTipoSensor, TipoSensor FROM tipossensores")
+            tipos_sensor = dict(cur.fetchall())
+        finally:
+            cur.close()
+
+        options = {
+            'tiposresiduos': _sorted_options(tipos_residuo),
+            'ubicaciones': _sorted_options(ubicaciones),
+            'tipossensores': _sorted_options(tipos_sensor),
+        }
+        with self._lock:
+            self.tipos_residuo, self.ubicaciones, self.coordenadas = tipos_residuo, ubicaciones, coordenadas
+            self.tipos_sensor, self._options = tipos_sensor, options
+            self._loaded_versions = versions
+            self._loaded_at = time.monotonic()
+
+    def ensure_loaded(self, conn):
+        if (self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age
+                or self._current_versions() != self._loaded_versions):
+            self.load(conn)
+
+    def options(self, table):
+        """[{'id', 'nombre'}] ordenado por nombre, para los <select> de alta."""
+        return self._options.get(table, [])
+
+    def stats(self):
+        return {
+            'tiposresiduos': len(self.tipos_residuo),
+            'ubicaciones': len(self.ubicaciones),
+            'tipossensores': len(self.tipos_sensor),
+            'versiones': self._loaded_versions,
+        }
+
+
+def resolve(rows, columns, inner=True):
+    """Sustituye IDs por nombres en filas de RowCursor.
+
+    `columns` es {columna: {id: nombre}}. Con `inner` las filas con un ID
+    desconocido se descartan, como hacía el JOIN; si no, quedan con None
+    (LEFT JOIN).
+    """
+    if not rows:
+        return rows
+    cls = type(rows[0])
+    positions = [(cls._index[col], lookup) for col, lookup in columns.items()]
+    result = []
+    for row in rows:
+        values = list(row)
+        for pos, lookup in positions:
+            if inner and values[pos] not in lookup:
+                break
+            values[pos] = lookup.get(values[pos])
+        else:
+            result.append(cls(values))
+    return result
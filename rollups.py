@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Agregados pre-calculados de mediciones (tabla mediciones_rollup).
+
+Por cada sensor se guardan tres granularidades:
+  'H'  -> por hora        (Periodo = inicio de la hora)
+  'D'  -> por día         (Periodo = medianoche)
+  'HD' -> por hora del día, acumulado histórico (Periodo = 1900-01-01 HH:00)
+
+Cada fila lleva IdContenedor e IdTipoResiduo del sensor, conteos, suma,
+mínimo y máximo de PorcentajeLlenado y Temperatura (sólo temperaturas
+válidas) y cuántas lecturas superaron el umbral crítico de llenado. Los
+valores que el detector de anomalías marcó (mediciones_anomalias) no se
+suman: una lectura con el llenado marcado sólo aporta su temperatura y
+viceversa.
+
+Las rutas que insertan mediciones (y loader.py) llaman a
+RollupStore.apply() dentro de la misma transacción. Archivar mediciones
+antiguas (cold_storage.py) no toca esta tabla; rebuild() suma los
+resúmenes archivados a lo que queda en mediciones.
+
+Al iniciar, crear_app() crea la tabla si falta y la recalcula si está vacía
+y ya hay mediciones. Lo que se escriba en mediciones sin pasar por
+RollupStore (INSERT a mano, ETL de terceros, scripts de SQL Server) no
+llega a los agregados: después de una carga así hay que recalcular.
+
+    python rollups.py rebuild        # crea la tabla si falta y la recalcula
+"""
+from datetime import datetime
+
+import anomalies
+from anomalies import ANOMALIAS_JOIN, FILL_FLAGS, FILL_OK_SQL, TEMP_FLAGS, TEMP_MAX, TEMP_MIN, TEMP_OK_SQL
+
+CRITICAL_FILL = 85
+
+HOUR_OF_DAY_BASE = datetime(1900, 1, 1)
+
+COLUMNS = (
+    'Granularidad', 'Periodo', 'IdSensor', 'IdContenedor', 'IdTipoResiduo',
+    'N', 'NLlenado', 'SumaLlenado', 'MinLlenado', 'MaxLlenado', 'NCriticas',
+    'NTemp', 'SumaTemp', 'MinTemp', 'MaxTemp',
+)
+
+MSSQL_DDL = """
+IF OBJECT_ID('mediciones_rollup') IS NULL
+CREATE TABLE mediciones_rollup (
+    Granularidad  VARCHAR(2) NOT NULL,
+    Periodo       DATETIME   NOT NULL,
+    IdSensor      INT        NOT NULL,
+    IdContenedor  INT,
+    IdTipoResiduo INT,
+    N             INT        NOT NULL,
+    NLlenado      INT        NOT NULL,
+    SumaLlenado   FLOAT,
+    MinLlenado    FLOAT,
+    MaxLlenado    FLOAT,
+    NCriticas     INT        NOT NULL,
+    NTemp         INT        NOT NULL,
+    SumaTemp      FLOAT,
+    MinTemp       FLOAT,
+    MaxTemp       FLOAT,
+    CONSTRAINT PK_mediciones_rollup PRIMARY KEY (Granularidad, Periodo, IdSensor)
+)
+"""
+
+SQLITE_DDL = """
+CREATE TABLE IF NOT EXISTS mediciones_rollup (
+    Granularidad  TEXT     NOT NULL,
+    Periodo       DATETIME NOT NULL,
+    IdSensor      INTEGER  NOT NULL,
+    IdContenedor  INTEGER,
+    IdTipoResiduo INTEGER,
+    N             INTEGER  NOT NULL,
+    NLlenado      INTEGER  NOT NULL,
+    SumaLlenado   REAL,
+    MinLlenado    REAL,
+    MaxLlenado    REAL,
+    NCriticas     INTEGER  NOT NULL,
+    NTemp         INTEGER  NOT NULL,
+    SumaTemp      REAL,
+    MinTemp       REAL,
+    MaxTemp       REAL,
+    PRIMARY KEY (Granularidad, Periodo, IdSensor)
+)
+"""
+
+_REBUILD_SQL = """
+    INSERT INTO mediciones_rollup ({columns})
+    SELECT '{gran}', {bucket}, m.IdSensor, s.IdContenedor, c.IdTipoResiduo,
+        COUNT(*),
+        COUNT(CASE WHEN {fill_ok} THEN m.PorcentajeLlenado END),
+        SUM(CASE WHEN {fill_ok} THEN m.PorcentajeLlenado END),
+        MIN(CASE WHEN {fill_ok} THEN m.PorcentajeLlenado END),
+        MAX(CASE WHEN {fill_ok} THEN m.PorcentajeLlenado END),
+        SUM(CASE WHEN {fill_ok} AND m.PorcentajeLlenado > {crit} THEN 1 ELSE 0 END),
+        SUM(CASE WHEN {temp_ok} THEN 1 ELSE 0 END),
+        SUM(CASE WHEN {temp_ok} THEN m.Temperatura END),
+        MIN(CASE WHEN {temp_ok} THEN m.Temperatura END),
+        MAX(CASE WHEN {temp_ok} THEN m.Temperatura END)
+    FROM mediciones m
+    JOIN sensores s ON m.IdSensor = s.IdSensor
+    JOIN contenedores c ON s.IdContenedor = c.IdContenedor
+    {anomalias_join}
+    GROUP BY {bucket}, m.IdSensor, s.IdContenedor, c.IdTipoResiduo
+"""
+
+
+def periods(fecha_hora):
+    """Claves de periodo (granularidad, inicio) de una lectura."""
+    hour = fecha_hora.replace(minute=0, second=0, microsecond=0)
+    return (
+        ('H', hour),
+        ('D', hour.replace(hour=0)),
+        ('HD', HOUR_OF_DAY_BASE.replace(hour=hour.hour)),
+    )
+
+
+def _valid_temp(t):
+    return t is not None and TEMP_MIN < t < TEMP_MAX
+
+
+def _merge_min(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _merge_max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+def accumulate(readings):
+    """Agrupa lecturas en deltas {(gran, periodo, IdSensor): [valores]}.
+
+    Cada lectura es un dict con IdSensor, IdContenedor, IdTipoResiduo,
+    FechaHora, PorcentajeLlenado, Temperatura y opcionalmente Anomalia
+    (banderas del detector). Los valores siguen el orden de COLUMNS a partir
+    de IdContenedor.
+    """
+    deltas = {}
+    for r in readings:
+        fill = r.get('PorcentajeLlenado')
+        temp = r.get('Temperatura')
+        flags = r.get('Anomalia') or 0
+        has_fill = fill is not None and not flags & FILL_FLAGS
+        has_temp = _valid_temp(temp) and not flags & TEMP_FLAGS
+        for gran, start in periods(r['FechaHora']):
+            key = (gran, start, r['IdSensor'])
+            d = deltas.get(key)
+            if d is None:
+                d = deltas[key] = [r.get('IdContenedor'), r.get('IdTipoResiduo'),
+                                   0, 0, None, None, None, 0, 0, None, None, None]
+            d[2] += 1
+            if has_fill:
+                d[3] += 1
+                d[4] = fill if d[4] is None else d[4] + fill
+                d[5] = _merge_min(d[5], fill)
+                d[6] = _merge_max(d[6], fill)
+                if fill > CRITICAL_FILL:
+                    d[7] += 1
+            if has_temp:
+                d[8] += 1
+                d[9] = temp if d[9] is None else d[9] + temp
+                d[10] = _merge_min(d[10], temp)
+                d[11] = _merge_max(d[11], temp)
+    return deltas
+
+
+def accumulate_summaries(rows):
+    """Como accumulate(), a partir de resúmenes por hora y sensor.
+
+    Cada fila es (Periodo, IdSensor, IdContenedor, IdTipoResiduo) seguido de
+    las columnas de COLUMNS desde N, con None donde no hay valores.
+    """
+    deltas = {}
+    for hour, sensor, contenedor, tipo, n, n_fill, s_fill, lo_fill, hi_fill, crit, n_temp, s_temp, lo_temp, hi_temp in rows:
+        for gran, start in periods(hour):
+            key = (gran, start, sensor)
+            d = deltas.get(key)
+            if d is None:
+                d = deltas[key] = [contenedor, tipo, 0, 0, None, None, None, 0, 0, None, None, None]
+            d[2] += n
+            d[3] += n_fill
+            if n_fill:
+                d[4] = s_fill if d[4] is None else d[4] + s_fill
+                d[5] = _merge_min(d[5], lo_fill)
+                d[6] = _merge_max(d[6], hi_fill)
+            d[7] += crit
+            d[8] += n_temp
+            if n_temp:
+                d[9] = s_temp if d[9] is None else d[9] + s_temp
+                d[10] = _merge_min(d[10], lo_temp)
+                d[11] = _merge_max(d[11], hi_temp)
+    return deltas
+
+
+_UPDATE_SQL = """
+    UPDATE mediciones_rollup SET
+        N = N + ?,
+        NLlenado = NLlenado + ?,
+        SumaLlenado = ISNULL(SumaLlenado, 0) + ?,
+        MinLlenado = CASE WHEN MinLlenado IS NULL OR ? < MinLlenado THEN ? ELSE MinLlenado END,
+        MaxLlenado = CASE WHEN MaxLlenado IS NULL OR ? > MaxLlenado THEN ? ELSE MaxLlenado END,
+        NCriticas = NCriticas + ?,
+        NTemp = NTemp + ?,
+        SumaTemp = ISNULL(SumaTemp, 0) + ?,
+        MinTemp = CASE WHEN MinTemp IS NULL OR ? < MinTemp THEN ? ELSE MinTemp END,
+        MaxTemp = CASE WHEN MaxTemp IS NULL OR ? > MaxTemp THEN ? ELSE MaxTemp END
+    WHERE Granularidad = ? AND Periodo = ? AND IdSensor = ?
+"""
+
+_INSERT_SQL = (
+    f"INSERT INTO mediciones_rollup ({', '.join(COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(COLUMNS))})"
+)
+
+
+class RollupStore:
+    def __init__(self, backend, cold=None):
+        self.backend = backend
+        self.cold = cold        # ColdStore con los resúmenes de lo archivado
+
+    def ensure_schema(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute(SQLITE_DDL if self.backend.name == 'sqlite' else MSSQL_DDL)
+        finally:
+            cur.close()
+        conn.commit()
+
+    def rebuild_if_empty(self, conn):
+        """Crea la tabla y la recalcula si está vacía pero hay mediciones
+        (despliegue nuevo o tabla borrada). Devuelve si recalculó."""
+        self.ensure_schema(conn)
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT TOP 1 1 FROM mediciones_rollup")
+            if cur.fetchone() is not None:
+                return False
+            cur.execute("SELECT TOP 1 1 FROM mediciones")
+            has_data = cur.fetchone() is not None
+        finally:
+            cur.close()
+        if not has_data and not (self.cold is not None and self.cold.periods()):
+            return False
+        self.rebuild(conn)
+        return True
+
+    def apply(self, cur, readings):
+        """Suma las lecturas a los agregados. No hace commit."""
+        return self.apply_deltas(cur, accumulate(readings))
+
+    def apply_deltas(self, cur, deltas):
+        """Suma deltas ya acumulados con accumulate() (p. ej. en otro
+        proceso). No hace commit."""
+        if not deltas:
+            return 0
+
+        # Claves que ya existen, consultadas una vez por periodo distinto.
+        # La lectura queda bloqueada hasta el commit: otra ingesta del mismo
+        # periodo espera y ve las filas insertadas aquí en vez de insertarlas
+        # otra vez (violación de la clave primaria). En orden para que dos
+        # ingestas no se bloqueen en cruz.
+        existing = set()
+        sql = (f"SELECT IdSensor FROM {self.backend.locked('mediciones_rollup')} "
+               "WHERE Granularidad = ? AND Periodo = ?")
+        for gran, start in sorted({(k[0], k[1]) for k in deltas}):
+            cur.execute(sql, (gran, start))
+            existing.update((gran, start, row[0]) for row in cur.fetchall())
+
+        updates, inserts = [], []
+        for key, d in deltas.items():
+            gran, start, sensor = key
+            if key in existing:
+                updates.append((
+                    d[2], d[3], d[4] or 0, d[5], d[5], d[6], d[6], d[7],
+                    d[8], d[9] or 0, d[10], d[10], d[11], d[11],
+                    gran, start, sensor,
+                ))
+            else:
+                inserts.append((gran, start, sensor, *d))
+        if updates:
+            cur.executemany(_UPDATE_SQL, updates)
+        if inserts:
+            cur.executemany(_INSERT_SQL, inserts)
+        return len(deltas)
+
+    def rebuild(self, conn):
+        buckets = {
+            'H': self.backend.hour_bucket('m.FechaHora'),
+            'D': self.backend.day_bucket('m.FechaHora'),
+            'HD': self.backend.hour_of_day_bucket('m.FechaHora'),
+        }
+        fill_ok = f"m.PorcentajeLlenado IS NOT NULL AND {FILL_OK_SQL}"
+        temp_ok = f"m.Temperatura > {TEMP_MIN} AND m.Temperatura < {TEMP_MAX} AND {TEMP_OK_SQL}"
+        self.ensure_schema(conn)
+        anomalies.ensure_schema(conn, self.backend.name)
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM mediciones_rollup")
+            for gran, bucket in buckets.items():
+                cur.execute(_REBUILD_SQL.format(
+                    columns=', '.join(COLUMNS), gran=gran, bucket=bucket,
+                    crit=CRITICAL_FILL, fill_ok=fill_ok, temp_ok=temp_ok, anomalias_join=ANOMALIAS_JOIN,
+                ))
+            if self.cold is not None:
+                self._add_archived(cur)
+            conn.commit()
+        finally:
+            cur.close()
+
+    def _add_archived(self, cur):
+        # Con el dueño actual de cada sensor, igual que el JOIN de _REBUILD_SQL
+        cur.execute("""
+            SELECT s.IdSensor, s.IdContenedor, c.IdTipoResiduo
+            FROM sensores s
+            JOIN contenedores c ON s.IdContenedor = c.IdContenedor
+        """)
+        owners = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+        for _, summary in self.cold.summaries():
+            columns = [summary[name].tolist() for name in ('Periodo', 'IdSensor') + COLUMNS[5:]]
+            rows = []
+            for values in zip(*columns):
+                owner = owners.get(values[1])
+                if owner is not None:
+                    rows.append((values[0], values[1], *owner,
+                                 *(None if v != v else v for v in values[2:])))
+            self.apply_deltas(cur, accumulate_summaries(rows))
+
+
+if __name__ == '__main__':
+    import sys
+
+    from app import crear_app
+
+    if sys.argv[1:] != ['rebuild']:
+        print("Uso: python rollups.py rebuild")
+        sys.exit(2)
+
+    app = crear_app()
+    pool = app.extensions['db_pool']
+    conn = pool.acquire()
+    try:
+        app.extensions['rollups'].rebuild(conn)
+    finally:
+        pool.release(conn)
+    print("[Done]")
@@ -10,7 +10,7 @@ def agregar_contenedor():
         capacidad = request.form.get('capacidad')
         ubicacion = request.form.get('ubicacion')
         
-        conn = get_mssql_connection()
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("""
             INSERT INTO contenedores (IdTipoResiduo, Capacidad, IdUbicacion, IdEstado)
@@ -18,7 +18,6 @@ def agregar_contenedor():
         """, (int(tipo_residuo), int(capacidad), int(ubicacion), 1))
         conn.commit()
         cur.close()
-        conn.close()
         
         return {'success': True, 'message': 'Contenedor agregado correctamente'}, 200
     except Exception as e:
@@ -34,7 +33,7 @@ def agregar_sensor():
         modelo = request.form.get('modelo')
         contenedor = request.form.get('contenedor')
         
-        conn = get_mssql_connection()
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("""
             INSERT INTO sensores (IdTipoSensor, Modelo, IdContenedor, IdEstado, FechaInstalacion)
@@ -42,7 +41,6 @@ def agregar_sensor():
         """, (int(tipo_sensor), modelo, int(contenedor), 1))
         conn.commit()
         cur.close()
-        conn.close()
         
         return {'success': True, 'message': 'Sensor agregado correctamente'}, 200
     except Exception as e:
@@ -57,8 +55,8 @@ def exportar_contenedores_csv():
     from io import StringIO
     
     try:
-        conn = get_mssql_connection()
-        cur = DictCursor(conn.cursor())
+        conn = get_db()
+        cur = RowCursor(conn.cursor())
         
         sql = """
             SELECT c.IdContenedor AS id, t.TipoResiduo AS tipo, c.Capacidad AS capacidad, 
@@ -75,7 +73,6 @@ def exportar_contenedores_csv():
         cur.execute(sql)
         data = cur.fetchall()
         cur.close()
-        conn.close()
         
         # Crear CSV en memoria
         output = StringIO()
@@ -102,8 +99,8 @@ def exportar_mediciones_csv():
     from io import StringIO
     
     try:
-        conn = get_mssql_connection()
-        cur = DictCursor(conn.cursor())
+        conn = get_db()
+        cur = RowCursor(conn.cursor())
         
         cur.execute("""
             SELECT TOP 5000 m.IdMedicion AS id, s.IdSensor AS sensor, m.FechaHora AS fecha_hora, 
@@ -114,7 +111,6 @@ def exportar_mediciones_csv():
         """)
         data = cur.fetchall()
         cur.close()
-        conn.close()
         
         # Crear CSV en memoria
         output = StringIO()
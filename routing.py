@@ -0,0 +1,245 @@
+"""
+Planificación de rutas de recolección con capacidad (varios vehículos).
+
+Las paradas se proyectan a kilómetros alrededor del depósito (a escala de
+ciudad la distancia euclídea proyectada se confunde con la geodésica) y se
+indexan en una SpatialGrid: cada parada sólo considera a sus `neighbors`
+vecinas más cercanas, tanto al construir como al mejorar, así que el costo
+crece casi lineal con el número de paradas.
+
+Construcción: ahorros de Clarke-Wright respetando la capacidad.
+Mejora: 2-opt dentro de cada ruta y reubicación de paradas entre rutas
+vecinas, repetidos hasta que no haya mejoras o se agote `time_budget`.
+"""
+import math
+import time
+
+from spatial import SpatialGrid
+
+EARTH_KM = 6371.0
+
+
+def project(lat, lng, lat0, lng0):
+    """(x, y) en km respecto a (lat0, lng0), proyección equirectangular."""
+    x = math.radians(lng - lng0) * math.cos(math.radians(lat0)) * EARTH_KM
+    y = math.radians(lat - lat0) * EARTH_KM
+    return x, y
+
+
+class RoutePlanner:
+    def __init__(self, stops, depot, capacity, neighbors=12):
+        """`stops`: lista de (lat, lng, demanda); `depot`: (lat, lng)."""
+        self.capacity = capacity
+        self.demand = [s[2] for s in stops]
+        self.xy = [project(s[0], s[1], depot[0], depot[1]) for s in stops]
+        n = len(stops)
+        self.d0 = [math.hypot(x, y) for x, y in self.xy]
+
+        if n:
+            xs = [p[0] for p in self.xy]
+            ys = [p[1] for p in self.xy]
+            area = max((max(xs) - min(xs)) * (max(ys) - min(ys)), 1e-6)
+            cell = max(math.sqrt(area / n) * 2, 0.01)
+        else:
+            cell = 1.0
+        grid = SpatialGrid(cell)
+        for x, y in self.xy:
+            grid.insert(x, y)
+        k = min(neighbors, n - 1)
+        self.neighbors = [grid.nearest(x, y, k, exclude=i) if k > 0 else []
+                          for i, (x, y) in enumerate(self.xy)]
+
+    def dist(self, i, j):
+        """Distancia en km; -1 es el depósito."""
+        if i < 0:
+            return 0.0 if j < 0 else self.d0[j]
+        if j < 0:
+            return self.d0[i]
+        a, b = self.xy[i], self.xy[j]
+        return math.hypot(a[0] - b[0], a[1] - b[1])
+
+    def route_length(self, route):
+        if not route:
+            return 0.0
+        total = self.d0[route[0]] + self.d0[route[-1]]
+        for a, b in zip(route, route[1:]):
+            total += self.dist(a, b)
+        return total
+
+    # ----- construcción -----
+    def savings(self):
+        """Rutas por ahorros de Clarke-Wright; paradas que no caben aparte."""
+        cap = self.capacity
+        oversized = [i for i, d in enumerate(self.demand) if d > cap]
+        skip = set(oversized)
+        routes = {i: [i] for i in range(len(self.demand)) if i not in skip}
+        load = {i: self.demand[i] for i in routes}
+        route_of = {i: i for i in routes}
+
+        pairs = set()
+        for i, nbrs in enumerate(self.neighbors):
+            if i in skip:
+                continue
+            for j in nbrs:
+                if j not in skip:
+                    pairs.add((i, j) if i < j else (j, i))
+        candidates = []
+        for i, j in pairs:
+            s = self.d0[i] + self.d0[j] - self.dist(i, j)
+            if s > 0:
+                candidates.append((s, i, j))
+        candidates.sort(reverse=True)
+
+        for _, i, j in candidates:
+            ri, rj = route_of[i], route_of[j]
+            if ri == rj or load[ri] + load[rj] > cap:
+                continue
+            a, b = routes[ri], routes[rj]
+            if a[-1] == i and b[0] == j:
+                merged = a + b
+            elif a[0] == i and b[-1] == j:
+                merged = b + a
+            elif a[-1] == i and b[-1] == j:
+                merged = a + b[::-1]
+            elif a[0] == i and b[0] == j:
+                merged = a[::-1] + b
+            else:
+                continue
+            routes[ri] = merged
+            load[ri] += load.pop(rj)
+            for node in b:
+                route_of[node] = ri
+            del routes[rj]
+        return list(routes.values()), oversized
+
+    # ----- mejora local -----
+    def two_opt(self, route, deadline):
+        """Mejora una ruta invirtiendo tramos; devuelve (ruta, mejoras).
+
+        Para la arista p-q sólo se prueban los tramos cuyo nuevo enlace une
+        p o q con una de sus vecinas, así que cada pasada cuesta
+        O(n · neighbors) en lugar de O(n²).
+        """
+        improvements = 0
+        improved = True
+        tour = [-1] + route + [-1]
+        pos = {node: i for i, node in enumerate(tour) if node >= 0}
+        while improved:
+            improved = False
+            for a in range(len(tour) - 3):
+                if time.monotonic() >= deadline:
+                    return tour[1:-1], improvements
+                p, q = tour[a], tour[a + 1]
+                # Nuevas aristas p-r (r = tour[b]) o q-s (s = tour[b + 1])
+                ends = {pos[r] for r in (self.neighbors[p] if p >= 0 else ()) if r in pos}
+                ends.update(pos[s] - 1 for s in self.neighbors[q] if s in pos)
+                for b in sorted(ends):
+                    if b < a + 2 or b > len(tour) - 2:
+                        continue
+                    p, q, r, s = tour[a], tour[a + 1], tour[b], tour[b + 1]
+                    delta = self.dist(p, r) + self.dist(q, s) - self.dist(p, q) - self.dist(r, s)
+                    if delta < -1e-9:
+                        tour[a + 1:b + 1] = tour[a + 1:b + 1][::-1]
+                        for i in range(a + 1, b + 1):
+                            pos[tour[i]] = i
+                        improved = True
+                        improvements += 1
+        return tour[1:-1], improvements
+
+    def relocate(self, routes, deadline):
+        """Mueve paradas a la ruta de una vecina si acorta el total."""
+        cap = self.capacity
+        load = [sum(self.demand[i] for i in r) for r in routes]
+        where = {}
+        for r, route in enumerate(routes):
+            for pos, i in enumerate(route):
+                where[i] = (r, pos)
+
+        improvements = 0
+        for i in list(where):
+            if time.monotonic() >= deadline:
+                break
+            ri, pi = where[i]
+            src = routes[ri]
+            prev = src[pi - 1] if pi > 0 else -1
+            nxt = src[pi + 1] if pi + 1 < len(src) else -1
+            gain = self.dist(prev, i) + self.dist(i, nxt) - self.dist(prev, nxt)
+
+            best = None
+            for j in self.neighbors[i]:
+                rj, pj = where.get(j, (None, None))
+                if rj is None or rj == ri or load[rj] + self.demand[i] > cap:
+                    continue
+                dst = routes[rj]
+                before = dst[pj - 1] if pj > 0 else -1
+                after = dst[pj + 1] if pj + 1 < len(dst) else -1
+                # Insertar justo antes o justo después de la vecina
+                for cost, pos in ((self.dist(before, i) + self.dist(i, j) - self.dist(before, j), pj),
+                                  (self.dist(j, i) + self.dist(i, after) - self.dist(j, after), pj + 1)):
+                    if cost - gain < -1e-9 and (best is None or cost < best[0]):
+                        best = (cost, rj, pos)
+            if best is None:
+                continue
+
+            _, rj, pos = best
+            del src[pi]
+            routes[rj].insert(pos, i)
+            load[ri] -= self.demand[i]
+            load[rj] += self.demand[i]
+            for r in (ri, rj):
+                for p, node in enumerate(routes[r]):
+                    where[node] = (r, p)
+            improvements += 1
+        return [r for r in routes if r], improvements
+
+    def solve(self, time_budget=2.0):
+        started = time.monotonic()
+        deadline = started + time_budget
+        routes, oversized = self.savings()
+        initial = sum(self.route_length(r) for r in routes)
+
+        improvements = 0
+        while time.monotonic() < deadline:
+            round_improvements = 0
+            for n, route in enumerate(routes):
+                routes[n], found = self.two_opt(route, deadline)
+                round_improvements += found
+            routes, found = self.relocate(routes, deadline)
+            round_improvements += found
+            improvements += round_improvements
+            if not round_improvements:
+                break
+
+        return {
+            'routes': routes,
+            'oversized': oversized,
+            'initial_km': initial,
+            'distance_km': sum(self.route_length(r) for r in routes),
+            'improvements': improvements,
+            'elapsed': time.monotonic() - started,
+        }
+
+
+def plan_routes(stops, depot, capacity, vehicles=None, neighbors=12, time_budget=2.0):
+    """Rutas para `stops` [(lat, lng, demanda)] desde `depot` (lat, lng).
+
+    Si hacen falta más rutas que `vehicles`, se atienden las más cargadas y
+    las paradas del resto quedan en 'unassigned' junto con las que no caben
+    en un vehículo.
+    """
+    planner = RoutePlanner(stops, depot, capacity, neighbors)
+    result = planner.solve(time_budget)
+    routes = result['routes']
+    unassigned = list(result['oversized'])
+    if vehicles is not None and len(routes) > vehicles:
+        routes.sort(key=lambda r: sum(planner.demand[i] for i in r), reverse=True)
+        for route in routes[vehicles:]:
+            unassigned.extend(route)
+        routes = routes[:vehicles]
+        result['distance_km'] = sum(planner.route_length(r) for r in routes)
+    result['routes'] = [
+        {'stops': r, 'load': sum(planner.demand[i] for i in r), 'distance_km': planner.route_length(r)}
+        for r in routes
+    ]
+    result['unassigned'] = unassigned
+    return result
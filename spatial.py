@@ -0,0 +1,107 @@
+"""
+Índice espacial en rejilla uniforme para puntos en 2D.
+
+Cada punto cae en una celda de lado `cell`; una búsqueda por rectángulo o
+de vecinos más cercanos sólo revisa las celdas que tocan, así que el costo
+depende de los puntos cercanos y no del total. Las coordenadas pueden ser
+grados (lat/lng) o kilómetros proyectados, siempre que `cell` use la misma
+unidad.
+"""
+import heapq
+import math
+
+
+class SpatialGrid:
+    def __init__(self, cell):
+        self.cell = cell
+        self._cells = {}
+        self._points = []
+        self._bounds = None     # celdas extremas ocupadas (cx0, cy0, cx1, cy1)
+
+    def __len__(self):
+        return len(self._points)
+
+    def _key(self, x, y):
+        return math.floor(x / self.cell), math.floor(y / self.cell)
+
+    def insert(self, x, y, item=None):
+        """Agrega un punto y devuelve su índice; `item` queda guardado con él (ver point())."""
+        idx = len(self._points)
+        self._points.append((x, y, idx if item is None else item))
+        key = self._key(x, y)
+        self._cells.setdefault(key, []).append(idx)
+        if self._bounds is None:
+            self._bounds = key + key
+        else:
+            b = self._bounds
+            self._bounds = (min(b[0], key[0]), min(b[1], key[1]), max(b[2], key[0]), max(b[3], key[1]))
+        return idx
+
+    def point(self, idx):
+        return self._points[idx]
+
+    def query_bbox(self, x0, y0, x1, y1):
+        """Índices de los puntos dentro del rectángulo [x0, x1] x [y0, y1]."""
+        cx0, cy0 = self._key(x0, y0)
+        cx1, cy1 = self._key(x1, y1)
+        points = self._points
+        found = []
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            # Rectángulo más grande que la zona ocupada: recorrer las celdas con datos
+            cells = (idxs for (cx, cy), idxs in self._cells.items()
+                     if cx0 <= cx <= cx1 and cy0 <= cy <= cy1)
+        else:
+            cells = (self._cells.get((cx, cy), ())
+                     for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1))
+        for idxs in cells:
+            for idx in idxs:
+                x, y, _ = points[idx]
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    found.append(idx)
+        return found
+
+    def nearest(self, x, y, k, exclude=None):
+        """Los `k` índices más cercanos a (x, y), del más cercano al más lejano.
+
+        Revisa anillos de celdas cada vez más grandes y para en cuanto el
+        k-ésimo encontrado está más cerca que cualquier celda por revisar.
+        """
+        if not self._points:
+            return []
+        cx, cy = self._key(x, y)
+        points = self._points
+        heap = []       # (-distancia, idx) de los k mejores
+        ring = 0
+        max_ring = self._max_ring(cx, cy)
+        while ring <= max_ring:
+            for key in self._ring(cx, cy, ring):
+                for idx in self._cells.get(key, ()):
+                    if idx == exclude:
+                        continue
+                    px, py, _ = points[idx]
+                    d = math.hypot(px - x, py - y)
+                    if len(heap) < k:
+                        heapq.heappush(heap, (-d, idx))
+                    elif d < -heap[0][0]:
+                        heapq.heapreplace(heap, (-d, idx))
+            # Todo punto de anillos posteriores está al menos a ring * cell
+            if len(heap) == k and -heap[0][0] <= ring * self.cell:
+                break
+            ring += 1
+        return [idx for _, idx in sorted(heap, key=lambda e: -e[0])]
+
+    def _max_ring(self, cx, cy):
+        x0, y0, x1, y1 = self._bounds
+        return max(abs(x0 - cx), abs(x1 - cx), abs(y0 - cy), abs(y1 - cy))
+
+    @staticmethod
+    def _ring(cx, cy, r):
+        if r == 0:
+            yield cx, cy
+            return
+        for dx in range(-r, r + 1):
+            yield cx + dx, cy - r
+            yield cx + dx, cy + r
+        for dy in range(-r + 1, r):
+            yield cx - r, cy + dy
+            yield cx + r, cy + dy